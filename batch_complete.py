@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+"""
+Run chat completions for a JSONL file of prompts, in parallel
+
+Each input line is a JSON object with either a "prompt" string or a
+"messages" list, plus an optional "id" and per-row "model", "temperature"
+and "max_tokens" overrides. Each output line carries the row id, the
+response, token counts and latency.
+
+The output file doubles as a checkpoint: rerunning with the same output
+skips rows that already succeeded, so they aren't billed again.
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional, Set, Tuple, Union
+
+from dotenv import load_dotenv
+
+from kimi_chat.cache import make_cache_key
+from kimi_chat.clients import ClientPoolConfig, ClientRegistry, default_base_url
+from kimi_chat.completion import get_kimi_response
+from kimi_chat.scheduler import RequestScheduler, SchedulerConfig
+
+# Answers kept after they are written, so later duplicates of a prompt reuse them
+DEDUPE_WINDOW = 1000
+
+
+def read_rows(path: str) -> Iterator[Tuple[int, Union[Dict, ValueError]]]:
+    """Yield (line number, row) from a JSONL file without loading it all
+
+    A line that isn't a JSON object is yielded as the ValueError saying so,
+    so one bad line fails its own row rather than the whole batch.
+    """
+    stream = sys.stdin if path == "-" else open(path, encoding="utf-8")
+    try:
+        for line_number, line in enumerate(stream, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                row = json.loads(line)
+            except json.JSONDecodeError as e:
+                yield line_number, ValueError(f"line {line_number} is not valid JSON: {e}")
+                continue
+            if not isinstance(row, dict):
+                yield line_number, ValueError(f"line {line_number} is not a JSON object")
+                continue
+            yield line_number, row
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+
+
+def row_request(row: Dict, args: argparse.Namespace) -> Tuple[str, float, int, List[Dict[str, str]]]:
+    """Model, temperature, max_tokens and messages for a row, CLI values as defaults"""
+    if "messages" in row:
+        messages = row["messages"]
+        if not isinstance(messages, list) or not messages or not all(
+                isinstance(message, dict) and isinstance(message.get("role"), str)
+                and isinstance(message.get("content"), str) for message in messages):
+            raise ValueError("'messages' must be a non-empty list of objects with string 'role' and 'content'")
+    elif "prompt" in row:
+        if not isinstance(row["prompt"], str):
+            raise ValueError("'prompt' must be a string")
+        messages = [{"role": "user", "content": row["prompt"]}]
+    else:
+        raise ValueError("row needs a 'prompt' or 'messages' field")
+    return (
+        row.get("model", args.model),
+        float(row.get("temperature", args.temperature)),
+        int(row.get("max_tokens", args.max_tokens)),
+        messages,
+    )
+
+
+def completed_rows(path: str) -> Set[str]:
+    """Ids of rows already answered successfully in a previous run"""
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                row = json.loads(line)
+            except json.JSONDecodeError:
+                # A partially written last line from an interrupted run
+                continue
+            if not row.get("error"):
+                done.add(row["id"])
+    return done
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def failed_future(error: Exception) -> Future:
+    """A future that already holds ``error``, for rows that fail validation"""
+    future: Future = Future()
+    future.set_exception(error)
+    return future
+
+
+def finished_future(result: Dict) -> Future:
+    """A future that already holds ``result``, for rows answered earlier in the run"""
+    future: Future = Future()
+    future.set_result(result)
+    return future
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Run Kimi AI chat completions for a JSONL file of prompts")
+    parser.add_argument("input", help="Input JSONL file, or - for stdin")
+    parser.add_argument("output", help="Output JSONL file; appended to and used to resume")
+    parser.add_argument("--model", default="kimi-k2-turbo-preview")
+    parser.add_argument("--temperature", type=float, default=0.6)
+    parser.add_argument("--max-tokens", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=8, help="Requests in flight at once")
+    parser.add_argument("--api-key", default=os.getenv("KIMI_API_KEY", ""),
+                        help="Defaults to KIMI_API_KEY")
+    parser.add_argument("--base-url", default=default_base_url(),
+                        help="Defaults to KIMI_BASE_URL or the Moonshot AI endpoint")
+    args = parser.parse_args()
+
+    if not args.api_key:
+        print("❌ API key is required (--api-key or KIMI_API_KEY)", file=sys.stderr)
+        sys.exit(1)
+
+    pool_config = ClientPoolConfig.from_env()
+    pool_config.max_connections = max(pool_config.max_connections, args.concurrency)
+    pool_config.max_keepalive_connections = max(pool_config.max_keepalive_connections, args.concurrency)
+    client = ClientRegistry(pool_config).get(args.api_key, args.base_url)
+    scheduler_config = SchedulerConfig.from_env()
+    scheduler_config.max_concurrency = min(scheduler_config.max_concurrency, args.concurrency)
+    scheduler = RequestScheduler(scheduler_config)
+
+    done = completed_rows(args.output)
+    out = open(args.output, "a", encoding="utf-8")
+    write_lock = threading.Lock()
+    # Bounds how many rows are read ahead of the workers
+    window = threading.BoundedSemaphore(args.concurrency * 2)
+    # Requests still running by dedupe key, and the last DEDUPE_WINDOW successful answers
+    in_flight: Dict[str, Future] = {}
+    answered: "OrderedDict[str, Dict]" = OrderedDict()
+    dedupe_lock = threading.Lock()
+    latencies: List[float] = []
+    counts = {"written": 0, "skipped": 0, "deduped": 0, "failed": 0, "cost": 0.0}
+
+    def complete(model: str, temperature: float, max_tokens: int, messages: List[Dict[str, str]]) -> Dict:
+        metrics: Dict = {}
+        response = get_kimi_response(client, messages, model, temperature, max_tokens,
+                                     metrics=metrics, scheduler=scheduler)
+        # Counted per request rather than per row, so deduplicated rows aren't billed twice
+        with write_lock:
+            counts["cost"] += metrics["cost"]
+        return {"response": response, **metrics}
+
+    def settle(key: str, future: Future):
+        with dedupe_lock:
+            in_flight.pop(key, None)
+            if future.exception() is None and not future.result()["error"]:
+                answered[key] = future.result()
+                if len(answered) > DEDUPE_WINDOW:
+                    answered.popitem(last=False)
+
+    def write(row_id: str, model: str, future: Future):
+        try:
+            result = future.result()
+            record = {
+                "id": row_id,
+                "model": model,
+                "response": None if result["error"] else result["response"],
+                "error": result["response"] if result["error"] else None,
+                "prompt_tokens": result.get("prompt_tokens"),
+                "completion_tokens": result["completion_tokens"],
+                "latency": round(result["total"], 4),
+                "cost": round(result["cost"], 6),
+            }
+        except Exception as e:
+            record = {"id": row_id, "model": model, "response": None, "error": str(e)}
+            result = None
+        with write_lock:
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            out.flush()
+            counts["written"] += 1
+            if record["error"]:
+                counts["failed"] += 1
+            elif result is not None:
+                latencies.append(result["total"])
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        for line_number, row in read_rows(args.input):
+            if isinstance(row, ValueError):
+                write(str(line_number), args.model, failed_future(row))
+                continue
+            row_id = str(row.get("id", line_number))
+            if row_id in done:
+                counts["skipped"] += 1
+                continue
+            try:
+                model, temperature, max_tokens, messages = row_request(row, args)
+                key = make_cache_key(model, temperature, max_tokens, messages)
+            except (ValueError, TypeError, AttributeError) as e:
+                write(row_id, args.model, failed_future(e))
+                continue
+            with dedupe_lock:
+                result = answered.get(key)
+                future: Optional[Future] = finished_future(result) if result is not None else in_flight.get(key)
+            if future is not None:
+                # Identical prompt already requested in this run; share its answer
+                counts["deduped"] += 1
+            else:
+                window.acquire()
+                future = executor.submit(complete, model, temperature, max_tokens, messages)
+                future.add_done_callback(lambda _: window.release())
+                with dedupe_lock:
+                    in_flight[key] = future
+                future.add_done_callback(lambda f, key=key: settle(key, f))
+            future.add_done_callback(lambda f, row_id=row_id, model=model: write(row_id, model, f))
+    elapsed = time.perf_counter() - start
+    out.close()
+
+    print("=" * 50, file=sys.stderr)
+    print(f"✅ Wrote {counts['written']} rows in {elapsed:.1f}s "
+          f"({counts['written'] / elapsed if elapsed > 0 else 0:.2f} rows/s)", file=sys.stderr)
+    print(f"   Skipped (already done): {counts['skipped']}  Deduplicated: {counts['deduped']}  "
+          f"Failed: {counts['failed']}", file=sys.stderr)
+    print(f"   Latency p50: {percentile(latencies, 50):.2f}s  p95: {percentile(latencies, 95):.2f}s",
+          file=sys.stderr)
+    stats = scheduler.stats()
+    print(f"   Retries: {stats['retries']}  Throttled: {stats['throttles']}", file=sys.stderr)
+    print(f"   Estimated cost: ${counts['cost']:.4f}", file=sys.stderr)
+    sys.exit(1 if counts["failed"] else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""
+Load and latency benchmark for the client code and the chat path
+
+Starts the local mock Moonshot server (or uses --base-url), then:
+
+- client: sends completions through the pooled client, request scheduler
+  and get_kimi_response/stream_kimi_response at each concurrency level
+- chat: runs full Streamlit script sessions (via streamlit.testing) in
+  worker processes that each send one chat message, and measures the
+  session state each one holds
+
+Reports throughput, TTFT and tail latency, and writes everything to a
+JSON file so runs can be compared over time.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import pickle
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Dict, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from mock_moonshot import MockConfig, MockServer
+
+from kimi_chat.clients import ClientPoolConfig, ClientRegistry
+from kimi_chat.completion import get_kimi_response, stream_kimi_response
+from kimi_chat.scheduler import RequestScheduler, SchedulerConfig
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(latencies: List[float], ttfts: List[float], errors: int, elapsed: float) -> Dict:
+    return {
+        "requests": len(latencies) + errors,
+        "errors": errors,
+        "elapsed": round(elapsed, 4),
+        "throughput_rps": round(len(latencies) / elapsed, 3) if elapsed > 0 else 0.0,
+        "ttft_p50": round(percentile(ttfts, 50), 4),
+        "ttft_p95": round(percentile(ttfts, 95), 4),
+        "latency_p50": round(percentile(latencies, 50), 4),
+        "latency_p95": round(percentile(latencies, 95), 4),
+        "latency_p99": round(percentile(latencies, 99), 4),
+    }
+
+
+def bench_client(base_url: str, concurrency: int, requests: int, stream: bool, max_tokens: int) -> Dict:
+    """Drive the client code directly at a fixed concurrency"""
+    pool_config = ClientPoolConfig(max_connections=max(concurrency, 20),
+                                   max_keepalive_connections=max(concurrency, 10))
+    client = ClientRegistry(pool_config).get("sk-benchmark", base_url)
+    scheduler = RequestScheduler(SchedulerConfig(requests_per_minute=1e9, tokens_per_minute=1e12,
+                                                 max_concurrency=concurrency, max_queue=requests))
+    messages = [{"role": "user", "content": "Explain what async/await means in programming"}]
+
+    def one(_):
+        metrics: Dict = {}
+        if stream:
+            for _delta in stream_kimi_response(client, messages, "kimi-k2-turbo-preview", 0.6, max_tokens,
+                                               metrics=metrics, scheduler=scheduler):
+                pass
+        else:
+            get_kimi_response(client, messages, "kimi-k2-turbo-preview", 0.6, max_tokens,
+                              metrics=metrics, scheduler=scheduler)
+        return metrics
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(one, range(requests)))
+    elapsed = time.perf_counter() - start
+    ok = [r for r in results if not r["error"]]
+    summary = summarize([r["total"] for r in ok], [r["ttft"] for r in ok], len(results) - len(ok), elapsed)
+    summary["retries"] = scheduler.stats()["retries"]
+    return summary
+
+
+def _run_chat_session(base_url: str, index: int):
+    from streamlit.testing.v1 import AppTest
+
+    os.environ["KIMI_BASE_URL"] = base_url
+    at = AppTest.from_file(os.path.join(ROOT, "kimi_chat_app.py"), default_timeout=120)
+    at.session_state["api_key"] = "sk-benchmark"
+    at.run()
+    start = time.perf_counter()
+    at.chat_input[0].set_value(f"Benchmark message {index}: explain async/await").run()
+    return at, time.perf_counter() - start
+
+
+def _warm_up_worker(base_url: str):
+    """Pay for imports and cached resources before any session is timed"""
+    _run_chat_session(base_url, -1)
+
+
+def _chat_session(job) -> Dict:
+    """Run one app session in a worker process"""
+    base_url, index = job
+    at, latency = _run_chat_session(base_url, index)
+    state = {key: at.session_state[key] for key in at.session_state}
+    metrics = state["turn_metrics"][-1] if state.get("turn_metrics") else {}
+    return {
+        "latency": latency,
+        "ttft": metrics.get("ttft"),
+        "error": bool(at.exception) or not metrics or metrics.get("error"),
+        # Everything the session keeps between reruns; shared caches aren't counted
+        "session_bytes": len(pickle.dumps(state)),
+    }
+
+
+def bench_chat(base_url: str, concurrency: int, sessions: int) -> Dict:
+    """Run full app sessions that each send one message
+
+    Streamlit's test runner is one runtime per process, so concurrent
+    sessions run in separate, pre-warmed worker processes.
+    """
+    # AppTest replaces __main__ in the workers, so hand them functions by module name
+    import bench_load
+
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(processes=concurrency, initializer=bench_load._warm_up_worker,
+                      initargs=(base_url,)) as pool:
+        # Wait for every worker to finish warming up before starting the clock
+        pool.map(time.sleep, [0.0] * concurrency)
+        start = time.perf_counter()
+        results = pool.map(bench_load._chat_session, [(base_url, index) for index in range(sessions)])
+        elapsed = time.perf_counter() - start
+
+    ok = [r for r in results if not r["error"]]
+    summary = summarize([r["latency"] for r in ok], [r["ttft"] for r in ok], len(results) - len(ok), elapsed)
+    summary["session_state_kb"] = round(percentile([r["session_bytes"] for r in results], 50) / 1024, 1)
+    return summary
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load and latency benchmark against the mock Moonshot API")
+    parser.add_argument("--base-url", help="Benchmark this endpoint instead of starting the mock server")
+    parser.add_argument("--concurrency", default="1,4,16", help="Comma-separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=64, help="Client requests per concurrency level")
+    parser.add_argument("--sessions", type=int, default=8, help="Chat sessions per concurrency level")
+    parser.add_argument("--max-tokens", type=int, default=100)
+    parser.add_argument("--ttft", type=float, default=0.05, help="Mock server time to first token")
+    parser.add_argument("--token-rate", type=float, default=500.0, help="Mock server tokens per second")
+    parser.add_argument("--error-429-rate", type=float, default=0.0)
+    parser.add_argument("--error-5xx-rate", type=float, default=0.0)
+    parser.add_argument("--skip-chat", action="store_true", help="Only benchmark the client code")
+    parser.add_argument("--output", help="JSON results file (default: benchmarks/results/load-<timestamp>.json)")
+    args = parser.parse_args()
+
+    server = None
+    base_url = args.base_url
+    if base_url is None:
+        server = MockServer(config=MockConfig(ttft=args.ttft, token_rate=args.token_rate,
+                                              response_tokens=args.max_tokens,
+                                              error_429_rate=args.error_429_rate,
+                                              error_5xx_rate=args.error_5xx_rate, retry_after=0.05))
+        server.start_background()
+        base_url = server.base_url
+
+    levels = [int(level) for level in args.concurrency.split(",")]
+    results = {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "base_url": base_url,
+        "config": vars(args),
+        "client": {"blocking": {}, "stream": {}},
+        "chat": {},
+    }
+
+    print(f"🧪 Benchmarking against {base_url}")
+    print(f"{'path':<16} {'conc':>5} {'req/s':>8} {'ttft p50':>9} {'p50':>8} {'p95':>8} {'p99':>8} {'errors':>7}")
+    for mode in ("blocking", "stream"):
+        for level in levels:
+            summary = bench_client(base_url, level, args.requests, mode == "stream", args.max_tokens)
+            results["client"][mode][str(level)] = summary
+            print(f"{'client/' + mode:<16} {level:>5} {summary['throughput_rps']:>8.2f} "
+                  f"{summary['ttft_p50']:>8.3f}s {summary['latency_p50']:>7.3f}s "
+                  f"{summary['latency_p95']:>7.3f}s {summary['latency_p99']:>7.3f}s {summary['errors']:>7}")
+    if not args.skip_chat:
+        for level in levels:
+            summary = bench_chat(base_url, level, args.sessions)
+            results["chat"][str(level)] = summary
+            print(f"{'chat':<16} {level:>5} {summary['throughput_rps']:>8.2f} "
+                  f"{summary['ttft_p50']:>8.3f}s {summary['latency_p50']:>7.3f}s "
+                  f"{summary['latency_p95']:>7.3f}s {summary['latency_p99']:>7.3f}s {summary['errors']:>7}"
+                  f"   {summary['session_state_kb']:.1f} KB/session")
+
+    if server is not None:
+        results["mock_server"] = server.stats.snapshot()
+        server.shutdown()
+
+    output = args.output or os.path.join(
+        ROOT, "benchmarks", "results", f"load-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"📄 Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
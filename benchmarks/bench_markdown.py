@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+Per-token cost of redrawing a streaming reply as escaped HTML
+
+Streams a markdown reply of --tokens tokens (about four characters each:
+paragraphs, nested lists, a table and fenced code blocks) into a
+MarkdownRenderer one token at a time, the way the app redraws a reply,
+and times each update. For comparison, converts the whole text so far
+from scratch every --full-every tokens, which is what a renderer without
+incremental state costs per redraw. Exits non-zero if the incremental
+cost over the last stretch of the reply is more than --flat-budget times
+its cost over the first, or if the reply with \r\n or bare \r line
+endings renders differently from the same reply with \n.
+
+    python benchmarks/bench_markdown.py --tokens 4000 --flat-budget 2
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+from typing import Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from kimi_chat.markdown import MarkdownRenderer, highlight_code, markdown_to_html
+
+CHARS_PER_TOKEN = 4
+
+SECTION = """## Step {n}: handling <input> safely
+
+Async code lets one thread **wait on many things at once**. While a request is in flight, the event loop runs \
+other tasks instead of blocking, so `await fetch(url)` costs nothing until the reply arrives. See \
+[the asyncio docs](https://docs.python.org/3/library/asyncio.html) for details.
+
+- Start every request with `asyncio.gather`
+- Bound concurrency with a *semaphore*:
+  - one per upstream host
+  - sized to the connection pool
+- Retry on `429` with ~~fixed~~ jittered backoff
+
+| Approach | Requests/s | Notes |
+|:---------|-----------:|-------|
+| Threads | 120 | one stack each |
+| asyncio | 950 | one loop |
+
+```python
+async def fetch_all(urls, limit={n}):
+    semaphore = asyncio.Semaphore(limit)
+
+    async def fetch(url):
+        async with semaphore:
+            return await client.get(url)
+
+    return await asyncio.gather(*(fetch(url) for url in urls))
+```
+
+> Note: a task that never awaits blocks the loop for everyone.
+
+"""
+
+
+def make_reply(tokens: int) -> str:
+    sections = []
+    while sum(len(section) for section in sections) < tokens * CHARS_PER_TOKEN:
+        sections.append(SECTION.format(n=len(sections) + 1))
+    return "".join(sections)[:tokens * CHARS_PER_TOKEN]
+
+
+def stream(reply: str, full_every: int) -> Dict[str, List]:
+    """Per-token seconds for the incremental renderer, and for a full conversion every ``full_every`` tokens"""
+    renderer = MarkdownRenderer()
+    incremental: List[float] = []
+    full: List[tuple] = []
+    for token in range(1, len(reply) // CHARS_PER_TOKEN + 1):
+        text = reply[:token * CHARS_PER_TOKEN] + " ▌"
+        start = time.perf_counter()
+        renderer.update(text)
+        incremental.append(time.perf_counter() - start)
+        if token % full_every == 0:
+            start = time.perf_counter()
+            markdown_to_html(text)
+            full.append((token, time.perf_counter() - start))
+    # The streamed HTML must match converting the finished reply in one go
+    if renderer.update(reply) != markdown_to_html(reply):
+        print("❌ Incremental HTML differs from a full conversion")
+        sys.exit(1)
+    return {"incremental": incremental, "full": full}
+
+
+def check_line_endings(reply: str):
+    """The reply with CRLF or CR-only line endings must render, streamed or whole, as it does with LF"""
+    expected = markdown_to_html(reply)
+    for ending in ("\r\n", "\r"):
+        text = reply.replace("\n", ending)
+        renderer = MarkdownRenderer()
+        for token in range(1, len(text) // CHARS_PER_TOKEN + 1):
+            renderer.update(text[:token * CHARS_PER_TOKEN])
+        for name, output in (("streamed", renderer.update(text)), ("whole", markdown_to_html(text))):
+            # A stray \r or a blank line would end st.markdown's raw HTML block early
+            if output != expected or "\r" in output or "\n\n" in output:
+                print(f"❌ {name} HTML for {ending!r} line endings differs from \\n line endings")
+                sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-token render cost of a streaming reply against its length")
+    parser.add_argument("--tokens", type=int, default=4000, help="Reply length in tokens")
+    parser.add_argument("--buckets", type=int, default=8, help="Stretches of the reply to report")
+    parser.add_argument("--full-every", type=int, default=20, help="Tokens between full conversions")
+    parser.add_argument("--flat-budget", type=float, default=2.0,
+                        help="Max ratio of the last stretch's median cost to the first's")
+    parser.add_argument("--output", help="Also write the results to this JSON file")
+    args = parser.parse_args()
+
+    reply = make_reply(args.tokens)
+    check_line_endings(reply[:8000])
+    check_line_endings("a\n\nb")
+    # Warm up regexes and Pygments, then time with a cold highlight cache
+    stream(reply[:2000], args.full_every)
+    highlight_code.cache_clear()
+    timings = stream(reply, args.full_every)
+
+    size = len(timings["incremental"]) // args.buckets
+    rows = []
+    print(f"{'tokens':>11} {'incremental p50':>16} {'incremental p99':>16} {'full p50':>10}")
+    for bucket in range(args.buckets):
+        first, last = bucket * size, (bucket + 1) * size
+        seconds = sorted(timings["incremental"][first:last])
+        full = [elapsed for token, elapsed in timings["full"] if first < token <= last]
+        row = {
+            "tokens": f"{first + 1}-{last}",
+            "incremental_p50_us": statistics.median(seconds) * 1e6,
+            "incremental_p99_us": seconds[int(len(seconds) * 0.99)] * 1e6,
+            "full_p50_us": statistics.median(full) * 1e6 if full else None,
+        }
+        rows.append(row)
+        print(f"{row['tokens']:>11} {row['incremental_p50_us']:>14.1f}µs {row['incremental_p99_us']:>14.1f}µs "
+              + (f"{row['full_p50_us'] / 1000:>8.2f}ms" if full else f"{'-':>10}"))
+
+    growth = rows[-1]["incremental_p50_us"] / rows[0]["incremental_p50_us"]
+    total = sum(timings["incremental"])
+    full_total = sum(elapsed for _, elapsed in timings["full"]) * args.full_every
+    print(f"📈 Incremental cost grew {growth:.2f}x from the first stretch to the last (budget {args.flat_budget:.1f}x)")
+    print(f"⏱️ Whole reply: {total * 1000:.1f}ms incremental vs ~{full_total * 1000:.0f}ms converting in full per token")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"config": vars(args), "buckets": rows, "growth": growth,
+                       "incremental_total": total, "full_total_estimate": full_total}, f, indent=2)
+    if growth > args.flat_budget:
+        print("❌ Per-token render cost grows with the reply")
+        sys.exit(1)
+    print("✅ Per-token render cost stays flat")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Benchmark chat history memory and per-turn CPU at large history sizes
+
+Compares a history of plain message dicts, sent through the SDK's
+chat.completions.create, with a ChatHistory of ChatMessage records sent
+through create_completion. Each turn appends a message, builds the API
+messages, fits them to the context window, counts tokens for the
+scheduler, sends the request and renders the visible page. Requests go
+to an in-process httpx mock transport, so only client-side work is timed.
+"""
+
+import argparse
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+from typing import Callable, Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+import openai
+
+from kimi_chat.completion import build_api_messages, create_completion
+from kimi_chat.context import ContextWindowManager, PinnedSystemPolicy, TokenCounter
+from kimi_chat.messages import ChatHistory, ChatMessage
+from kimi_chat.rendering import render_history_html, visible_history
+
+MODEL = "kimi-k2-turbo-preview"
+RECENT_MESSAGES = 40
+
+_COMPLETION = {
+    "id": "chatcmpl-bench",
+    "object": "chat.completion",
+    "created": 0,
+    "model": MODEL,
+    "choices": [{"index": 0, "finish_reason": "stop",
+                 "message": {"role": "assistant", "content": "ok"}}],
+    "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+}
+
+
+def make_contents(n: int) -> List[str]:
+    """Alternating short questions and longer answers"""
+    return [f"Message {i}: " + "The quick brown fox jumps over the lazy dog. " * (3 if i % 2 == 0 else 12)
+            for i in range(n)]
+
+
+def role_of(i: int) -> str:
+    return "user" if i % 2 == 0 else "assistant"
+
+
+def measure_memory(build: Callable[[], list]) -> int:
+    """Bytes allocated building a history from already existing content strings"""
+    gc.collect()
+    tracemalloc.start()
+    history = build()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del history
+    return size
+
+
+def make_client() -> openai.OpenAI:
+    body = json.dumps(_COMPLETION).encode("utf-8")
+    transport = httpx.MockTransport(lambda request: httpx.Response(
+        200, content=body, headers={"content-type": "application/json"}
+    ))
+    return openai.OpenAI(api_key="sk-bench", base_url="https://bench.invalid/v1",
+                         http_client=httpx.Client(transport=transport))
+
+
+def run_turn(messages: list, send: Callable[[List[Dict[str, str]]], None],
+             context_manager: ContextWindowManager) -> Dict[str, float]:
+    """One chat turn's client-side work, split into phases"""
+    start = time.perf_counter()
+    messages.append({"role": "user", "content": f"Follow-up question {len(messages)}"})
+    api_messages = context_manager.select(build_api_messages(messages), MODEL, 2000, PinnedSystemPolicy())
+    sum(context_manager.counter.count_all(api_messages))
+    built = time.perf_counter()
+    send(api_messages)
+    sent = time.perf_counter()
+    messages.append({"role": "assistant", "content": "ok"})
+    history, _ = visible_history(messages, RECENT_MESSAGES, 50, 0)
+    render_history_html(history)
+    end = time.perf_counter()
+    return {"build": built - start, "request": sent - built, "render": end - sent, "total": end - start}
+
+
+def time_turns(messages: list, send, turns: int) -> Dict[str, float]:
+    """Median of each phase over ``turns`` turns, after one warm-up turn"""
+    context_manager = ContextWindowManager(counter=TokenCounter())
+    run_turn(messages, send, context_manager)
+    samples = [run_turn(messages, send, context_manager) for _ in range(turns)]
+    return {phase: sorted(sample[phase] for sample in samples)[len(samples) // 2] for phase in samples[0]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--messages", type=int, default=10000, help="History length")
+    parser.add_argument("--turns", type=int, default=5, help="Turns timed per representation (median is reported)")
+    args = parser.parse_args()
+
+    contents = make_contents(args.messages)
+    content_bytes = sum(sys.getsizeof(content) for content in contents)
+    dict_bytes = measure_memory(lambda: [{"role": role_of(i), "content": content}
+                                         for i, content in enumerate(contents)])
+    record_bytes = measure_memory(lambda: ChatHistory(ChatMessage(role_of(i), content)
+                                                      for i, content in enumerate(contents)))
+    print(f"🧠 {args.messages:,} messages, {content_bytes / 1e6:.1f} MB of text")
+    print(f"   dicts:   {dict_bytes / 1e6:6.2f} MB on top of the text ({dict_bytes / args.messages:.0f} B/message)")
+    print(f"   records: {record_bytes / 1e6:6.2f} MB on top of the text ({record_bytes / args.messages:.0f} B/message)")
+
+    client = make_client()
+    sdk_send = lambda messages: client.chat.completions.create(
+        model=MODEL, messages=messages, temperature=0.6, max_tokens=2000, stream=False
+    )
+    record_send = lambda messages: create_completion(
+        client, None, messages, model=MODEL, temperature=0.6, max_tokens=2000, stream=False
+    )
+    results = {
+        "dicts": time_turns([{"role": role_of(i), "content": c} for i, c in enumerate(contents)],
+                            sdk_send, args.turns),
+        "records": time_turns(ChatHistory(ChatMessage(role_of(i), c) for i, c in enumerate(contents)),
+                              record_send, args.turns),
+    }
+    print(f"\n{'per turn':>9} {'build':>9} {'request':>9} {'render':>9} {'total':>9}")
+    for name, phases in results.items():
+        print(f"{name:>9} " + " ".join(f"{phases[phase] * 1000:>7.1f}ms"
+                                       for phase in ("build", "request", "render", "total")))
+    speedup = results["dicts"]["total"] / results["records"]["total"]
+    print(f"\n⚡ Records: {speedup:.1f}x less CPU per turn, "
+          f"{(dict_bytes - record_bytes) / 1e6:.2f} MB less memory at {args.messages:,} messages")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Benchmark chat history render time against history length
+
+Compares the original per-message rendering (one f-string and one
+st.markdown element per message, every rerun) with the memoized, batched
+renderer. Streamlit runs in bare mode, so element cost is the time to build
+and marshal each element without a browser attached.
+"""
+
+import argparse
+import os
+import sys
+import time
+from typing import Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import logging
+
+import streamlit as st
+
+from kimi_chat.rendering import render_history_html, render_message_html, visible_history
+
+# Silence the bare-mode "missing ScriptRunContext" warning logged on every element
+for _name in ("streamlit.runtime.scriptrunner_utils.script_run_context",
+              "streamlit.runtime.scriptrunner_utils.script_runner"):
+    logging.getLogger(_name).disabled = True
+
+RECENT_MESSAGES = 40
+PAGE_SIZE = 50
+
+
+def make_history(n: int) -> List[Dict[str, str]]:
+    """Alternating user/assistant messages of realistic length"""
+    return [
+        {
+            "role": "user" if i % 2 == 0 else "assistant",
+            "content": f"Message {i}: " + "The quick brown fox jumps over the lazy dog. " * (3 if i % 2 == 0 else 12),
+        }
+        for i in range(n)
+    ]
+
+
+def render_per_message(messages: List[Dict[str, str]]):
+    """The original history loop"""
+    for message in messages:
+        role_class = "user-message" if message["role"] == "user" else "assistant-message"
+        st.markdown(f"""
+            <div class="chat-message {role_class}">
+                <div class="message-header">
+                    <span>{'👤' if message["role"] == "user" else '🤖'}</span>
+                    <span>{'You' if message["role"] == "user" else 'Kimi AI'}</span>
+                </div>
+                <div class="message-content">{message["content"]}</div>
+            </div>
+        """, unsafe_allow_html=True)
+
+
+def render_batched(messages: List[Dict[str, str]], paged: bool):
+    """The memoized renderer, optionally limited to the newest page"""
+    if paged:
+        messages, _ = visible_history(messages, RECENT_MESSAGES, PAGE_SIZE, 0)
+    st.markdown(render_history_html(messages), unsafe_allow_html=True)
+
+
+def time_call(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", default="10,100,500,1000,5000",
+                        help="Comma-separated history lengths")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per measurement (best is reported)")
+    args = parser.parse_args()
+
+    print(f"{'messages':>9} {'per-message':>12} {'batched cold':>13} {'batched warm':>13} {'paged warm':>11}")
+    for n in [int(size) for size in args.sizes.split(",")]:
+        history = make_history(n)
+        per_message = time_call(lambda: render_per_message(history), args.repeat)
+        render_message_html.cache_clear()
+        cold = time_call(lambda: render_batched(history, paged=False), 1)
+        warm = time_call(lambda: render_batched(history, paged=False), args.repeat)
+        paged = time_call(lambda: render_batched(history, paged=True), args.repeat)
+        print(f"{n:>9} {per_message * 1000:>10.2f}ms {cold * 1000:>11.2f}ms "
+              f"{warm * 1000:>11.2f}ms {paged * 1000:>9.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+"""
+Soak test for several app replicas sharing one backend
+
+Starts the local mock Moonshot server (or uses --base-url), then for each
+replica count starts that many worker processes on one shared backend (a
+fresh SQLite file per level, or --shared-url). Each replica builds its
+response cache, request scheduler and conversation store on the backend
+the way the app does, and serves simulated chat sessions on threads:
+every turn looks up the cache, waits for a scheduler slot, streams the
+reply and writes both messages to the conversation store.
+
+One replica admits at most --replica-concurrency requests at a time,
+standing in for what one Streamlit process can serve, and every replica
+serves the same number of sessions, so throughput should grow with the
+replica count. An --rpm budget is shared by every replica: once its
+minute of burst is spent, it caps the total however many replicas run.
+Each session opens with a starter prompt; sessions that start after
+another replica has answered theirs are served from the shared cache.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Dict, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_load import git_commit, percentile
+from mock_moonshot import MockConfig, MockServer
+
+from kimi_chat.cache import ResponseCache, ResponseCacheConfig, response_key
+from kimi_chat.clients import ClientPoolConfig, ClientRegistry
+from kimi_chat.completion import stream_kimi_response
+from kimi_chat.prefetch import STARTER_PROMPTS
+from kimi_chat.scheduler import RequestScheduler, SchedulerConfig
+from kimi_chat.shared import backend_from_env
+from kimi_chat.store import make_title, owner_id, store_from_env
+
+MODEL = "kimi-k2-turbo-preview"
+TEMPERATURE = 0.3
+
+
+def run_session(job: Dict, index: int, cache: ResponseCache, scheduler: RequestScheduler, store, client,
+                latencies: List[float], counts: Dict[str, int], lock: threading.Lock):
+    """One user's chat: a starter prompt, then follow-ups only this session asks"""
+    rng = random.Random(f"{job['nonce']}-{job['replica']}-{index}")
+    time.sleep(rng.uniform(0, job["ramp"]))
+    history = []
+    conversation_id = None
+    for turn in range(job["turns"]):
+        if turn == 0:
+            prompt = f"[{job['nonce']}] {rng.choice(STARTER_PROMPTS)[1]}"
+        else:
+            prompt = f"[{job['nonce']}] Follow-up {turn} from replica {job['replica']} session {index}"
+        start = time.perf_counter()
+        history.append({"role": "user", "content": prompt})
+        key = response_key(job["api_key"], MODEL, TEMPERATURE, job["max_tokens"], history)
+        cached = cache.get(key)
+        if cached is not None:
+            reply = cached.content
+        else:
+            metrics: Dict = {}
+            reply = "".join(stream_kimi_response(client, history, MODEL, TEMPERATURE, job["max_tokens"],
+                                                 metrics=metrics, scheduler=scheduler))
+            if metrics.get("error"):
+                history.pop()
+                with lock:
+                    counts["errors"] += 1
+                continue
+            cache.put(key, reply, metrics["total"])
+        history.append({"role": "assistant", "content": reply})
+        if conversation_id is None:
+            conversation_id = store.create_conversation(owner_id(job["api_key"]), make_title(prompt))
+        store.append_message(conversation_id, "user", prompt)
+        store.append_message(conversation_id, "assistant", reply)
+        elapsed = time.perf_counter() - start
+        with lock:
+            latencies.append(elapsed)
+            counts["turns"] += 1
+            counts["cache_hits"] += cached is not None
+
+
+def run_replica(job: Dict, barrier, results):
+    """One replica process: its own cache, scheduler and clients, on the shared backend"""
+    os.environ["KIMI_SHARED_URL"] = job["shared_url"]
+    os.environ["KIMI_STORE"] = "shared"
+    backend = backend_from_env()
+    cache = ResponseCache(ResponseCacheConfig(), backend)
+    scheduler = RequestScheduler(SchedulerConfig(
+        requests_per_minute=job["rpm"], tokens_per_minute=1e12, max_concurrency=job["concurrency"],
+        max_queue=job["sessions"], queue_timeout=600.0,
+    ), backend)
+    store = store_from_env(backend)
+    pool_config = ClientPoolConfig(max_connections=job["concurrency"] + 4,
+                                   max_keepalive_connections=job["concurrency"])
+    registry = ClientRegistry(pool_config)
+    client = registry.get(job["api_key"], job["base_url"])
+    latencies: List[float] = []
+    counts = {"turns": 0, "errors": 0, "cache_hits": 0}
+    lock = threading.Lock()
+    threads = [
+        threading.Thread(target=run_session,
+                         args=(job, index, cache, scheduler, store, client, latencies, counts, lock))
+        for index in range(job["sessions"])
+    ]
+    # Every replica is built before the clock starts
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    registry.close_all()
+    results.put({
+        "replica": job["replica"],
+        "elapsed": elapsed,
+        "latencies": latencies,
+        "upstream_requests": scheduler.stats()["requests"],
+        "throttles": scheduler.stats()["throttles"],
+        "shared_hits": cache.stats()["shared_hits"],
+        "backend": backend.stats(),
+        **counts,
+    })
+
+
+def bench_replicas(base_url: str, shared_url: str, replicas: int, args) -> Dict:
+    """Run ``replicas`` worker processes on one backend and add up what they served"""
+    nonce = uuid.uuid4().hex[:8]
+    # A key of its own per level, so no level starts with another's rate budget spent
+    api_key = f"sk-soak-{nonce}"
+    context = multiprocessing.get_context("spawn")
+    barrier = context.Barrier(replicas + 1)
+    results = context.Queue()
+    processes = [context.Process(target=run_replica, args=({
+        "base_url": base_url, "shared_url": shared_url, "api_key": api_key, "nonce": nonce,
+        "replica": replica, "sessions": args.sessions, "turns": args.turns, "ramp": args.ramp,
+        "concurrency": args.replica_concurrency, "rpm": args.rpm, "max_tokens": args.max_tokens,
+    }, barrier, results)) for replica in range(replicas)]
+    for process in processes:
+        process.start()
+    barrier.wait()
+    start = time.perf_counter()
+    rows = [results.get() for _ in processes]
+    elapsed = time.perf_counter() - start
+    for process in processes:
+        process.join()
+
+    latencies = [latency for row in rows for latency in row["latencies"]]
+    turns = sum(row["turns"] for row in rows)
+    upstream = sum(row["upstream_requests"] for row in rows)
+    backend_ops = sum(row["backend"]["operations"] for row in rows)
+    stored = store_from_env(backend_from_env()).list_conversations(owner_id(api_key), limit=10 ** 6)
+    return {
+        "replicas": replicas,
+        "sessions": replicas * args.sessions,
+        "turns": turns,
+        "errors": sum(row["errors"] for row in rows),
+        "elapsed": round(elapsed, 4),
+        "throughput_tps": round(turns / elapsed, 3) if elapsed > 0 else 0.0,
+        "upstream_rps": round(upstream / elapsed, 3) if elapsed > 0 else 0.0,
+        "latency_p50": round(percentile(latencies, 50), 4),
+        "latency_p95": round(percentile(latencies, 95), 4),
+        "latency_p99": round(percentile(latencies, 99), 4),
+        "cache_hits": sum(row["cache_hits"] for row in rows),
+        "cross_replica_hits": sum(row["shared_hits"] for row in rows),
+        "throttles": sum(row["throttles"] for row in rows),
+        "backend_ops": backend_ops,
+        "backend_avg_ms": round(sum(row["backend"]["avg_ms"] * row["backend"]["operations"] for row in rows)
+                                / backend_ops, 3) if backend_ops else 0.0,
+        "conversations_stored": len(stored),
+        "messages_stored": sum(summary.message_count for summary in stored),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Throughput of 1..N app replicas sharing one backend")
+    parser.add_argument("--base-url", help="Benchmark this endpoint instead of starting the mock server")
+    parser.add_argument("--shared-url", help="Shared backend for every level, e.g. redis://localhost:6379/0 "
+                                             "(default: a fresh SQLite file per level)")
+    parser.add_argument("--replicas", default="1,2,4", help="Comma-separated replica counts")
+    parser.add_argument("--sessions", type=int, default=8, help="Chat sessions per replica")
+    parser.add_argument("--turns", type=int, default=4, help="Turns per session")
+    parser.add_argument("--replica-concurrency", type=int, default=4,
+                        help="Requests one replica sends at once")
+    parser.add_argument("--rpm", type=float, default=1e9, help="Requests per minute shared by every replica, with a minute's worth as burst")
+    parser.add_argument("--ramp", type=float, default=1.0, help="Seconds over which sessions start")
+    parser.add_argument("--max-tokens", type=int, default=20)
+    parser.add_argument("--ttft", type=float, default=0.4, help="Mock server time to first token")
+    parser.add_argument("--token-rate", type=float, default=100.0, help="Mock server tokens per second")
+    parser.add_argument("--output", help="JSON results file (default: benchmarks/results/replicas-<timestamp>.json)")
+    args = parser.parse_args()
+
+    server = None
+    base_url = args.base_url
+    if base_url is None:
+        server = MockServer(config=MockConfig(ttft=args.ttft, token_rate=args.token_rate,
+                                              response_tokens=args.max_tokens))
+        server.start_background()
+        base_url = server.base_url
+
+    results = {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "base_url": base_url,
+        "config": vars(args),
+        "levels": {},
+    }
+
+    print(f"🧪 Soak testing replicas against {base_url}")
+    print(f"{'replicas':>8} {'turns/s':>8} {'scaling':>8} {'upstream/s':>11} {'p50':>8} {'p95':>8} "
+          f"{'hits':>5} {'shared':>7} {'stored':>7} {'errors':>7}")
+    baseline = None
+    with tempfile.TemporaryDirectory() as directory:
+        for level in [int(level) for level in args.replicas.split(",")]:
+            shared_url = args.shared_url or f"sqlite:///{os.path.join(directory, f'shared-{level}.db')}"
+            os.environ["KIMI_SHARED_URL"] = shared_url
+            summary = bench_replicas(base_url, shared_url, level, args)
+            baseline = baseline or summary["throughput_tps"] / level
+            summary["scaling"] = round(summary["throughput_tps"] / baseline, 2) if baseline else 0.0
+            results["levels"][str(level)] = summary
+            print(f"{level:>8} {summary['throughput_tps']:>8.2f} {summary['scaling']:>7.2f}x "
+                  f"{summary['upstream_rps']:>11.2f} {summary['latency_p50']:>7.3f}s {summary['latency_p95']:>7.3f}s "
+                  f"{summary['cache_hits']:>5} {summary['cross_replica_hits']:>7} "
+                  f"{summary['conversations_stored']:>7} {summary['errors']:>7}")
+
+    if server is not None:
+        results["mock_server"] = server.stats.snapshot()
+        server.shutdown()
+
+    output = args.output or os.path.join(
+        ROOT, "benchmarks", "results", f"replicas-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"📄 Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Benchmark document retrieval against pasting the whole document into the chat
+
+Builds a synthetic document with facts planted at known places, indexes
+it with each index type, and asks about every fact. Reports index build
+time, the time to open an index, query latency, how often the planted
+fact is among the excerpts sent, and the prompt tokens of a conversation
+about the document: with the document pasted into the first message,
+every turn resends it; with retrieval, each turn sends its excerpts.
+"""
+
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from typing import List, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from kimi_chat.completion import SYSTEM_MESSAGE
+from kimi_chat.context import TokenCounter
+from kimi_chat.documents import INDEX_TYPES, DocumentLibrary, RetrievalConfig, with_excerpts
+from kimi_chat.messages import ChatMessage, Role
+
+WORDS = ("system latency request model token budget cache window chunk index query session memory stream "
+         "summary router endpoint retry throughput document excerpt policy vector score network").split()
+
+# Reply length assumed for every assistant turn in the conversation
+REPLY_TOKENS = 150
+
+
+def make_document(tokens: int, facts: int, seed: int = 7) -> Tuple[str, List[Tuple[str, str]]]:
+    """About ``tokens`` tokens of filler paragraphs, with ``facts`` (question, answer) pairs planted in them"""
+    rng = random.Random(seed)
+    paragraphs = []
+    for _ in range(max(tokens // 80, facts)):
+        sentences = [" ".join(rng.choice(WORDS) for _ in range(12)).capitalize() + "." for _ in range(5)]
+        paragraphs.append(" ".join(sentences))
+    planted = []
+    for i, position in enumerate(sorted(rng.sample(range(len(paragraphs)), facts))):
+        answer = f"{rng.randint(1000, 9999)}-{rng.choice(WORDS)}"
+        paragraphs[position] += f" The release code of the project codenamed falcon{i} is {answer}."
+        planted.append((f"What is the release code of the project codenamed falcon{i}?", answer))
+    return "\n\n".join(paragraphs), planted
+
+
+def percentile(samples: List[float], fraction: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+def conversation_tokens(counter: TokenCounter, first: ChatMessage, questions: List[str],
+                        library: DocumentLibrary = None, documents=None) -> List[int]:
+    """Prompt tokens of each turn of a conversation asking ``questions`` in a row"""
+    history = [SYSTEM_MESSAGE, first] if first is not None else [SYSTEM_MESSAGE]
+    per_turn = []
+    for question in questions:
+        history.append(ChatMessage(Role.USER, question))
+        messages = history
+        if library is not None:
+            messages = with_excerpts(history, library.search(documents, question))
+        per_turn.append(sum(counter.count_all(messages)))
+        history.append(ChatMessage(Role.ASSISTANT, "word " * REPLY_TOKENS))
+    return per_turn
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--tokens", type=int, default=200000, help="Document length in tokens")
+    parser.add_argument("--facts", type=int, default=200, help="Facts planted, one query each")
+    parser.add_argument("--turns", type=int, default=10, help="Turns in the conversation compared for prompt tokens")
+    parser.add_argument("--top-k", type=int, default=4, help="Excerpts sent per turn")
+    args = parser.parse_args()
+
+    text, facts = make_document(args.tokens, args.facts)
+    counter = TokenCounter()
+    document_tokens = counter.count(ChatMessage(Role.USER, text))
+    print(f"📄 Document: {document_tokens:,} tokens, {len(text.encode('utf-8')) / 1e6:.1f} MB, "
+          f"{len(facts)} planted facts")
+
+    root = tempfile.mkdtemp(prefix="kimi-bench-retrieval-")
+    questions = [question for question, _ in facts[:args.turns]]
+    try:
+        print(f"\n{'index':>7} {'build':>9} {'open':>9} {'p50':>9} {'p95':>9} {'recall@' + str(args.top_k):>10}")
+        retrieval_turns = None
+        for name in INDEX_TYPES:
+            # Every index type gets its own directory, so each one chunks the text from scratch
+            config = RetrievalConfig(path=os.path.join(root, name), index=name, top_k=args.top_k)
+            library = DocumentLibrary(config)
+            start = time.perf_counter()
+            document = library.add("bench.txt", text)
+            build = time.perf_counter() - start
+
+            reopened = DocumentLibrary(config)
+            start = time.perf_counter()
+            reopened.search([document], "warm up")
+            opened = time.perf_counter() - start
+
+            latencies, found = [], 0
+            for question, answer in facts:
+                start = time.perf_counter()
+                excerpts = reopened.search([document], question)
+                latencies.append(time.perf_counter() - start)
+                found += any(answer in excerpt.text for excerpt in excerpts)
+            print(f"{name:>7} {build * 1000:>7.0f}ms {opened * 1000:>7.1f}ms "
+                  f"{percentile(latencies, 0.5) * 1000:>7.2f}ms {percentile(latencies, 0.95) * 1000:>7.2f}ms "
+                  f"{found / len(facts):>10.0%}")
+            if retrieval_turns is None:
+                retrieval_turns = conversation_tokens(counter, None, questions, reopened, [document])
+                retrieval_index = name
+
+        pasted_turns = conversation_tokens(counter, ChatMessage(Role.USER, text), questions)
+        print(f"\n💬 Prompt tokens over a {len(questions)}-turn conversation about the document:")
+        print(f"   pasted:    {pasted_turns[0]:>9,} first turn, {sum(pasted_turns):>11,} total")
+        print(f"   retrieval: {retrieval_turns[0]:>9,} first turn, {sum(retrieval_turns):>11,} total "
+              f"({retrieval_index}, top {args.top_k})")
+        print(f"\n📉 Retrieval sends {sum(pasted_turns) / sum(retrieval_turns):.0f}x fewer prompt tokens")
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
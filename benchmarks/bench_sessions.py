@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Session memory soak test for the Streamlit script
+
+Runs many app sessions one after another in one process, against the mock
+Moonshot server, each sending a few chat messages. The newest --open
+sessions are kept open like browser tabs, older ones are closed. The idle
+timeout is shortened so the sweeper trims sessions during the run.
+Process RSS is sampled as sessions accumulate. The script exits non-zero
+when RSS keeps growing over the second half of the run by more than the
+budget per 100 sessions.
+
+    python benchmarks/bench_sessions.py --sessions 1000 --growth-budget 3
+"""
+
+import argparse
+import gc
+import json
+import os
+import sys
+import tempfile
+import time
+from collections import deque
+from typing import Dict, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from mock_moonshot import MockConfig, MockServer
+
+from kimi_chat.sessions import message_bytes, process_rss_bytes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that worker memory stays flat as sessions come and go")
+    parser.add_argument("--sessions", type=int, default=1000, help="Sessions to run in total")
+    parser.add_argument("--open", type=int, default=100, help="Sessions kept open at once")
+    parser.add_argument("--messages", type=int, default=6, help="Chat messages sent per session")
+    parser.add_argument("--reply-tokens", type=int, default=400, help="Mock reply length")
+    parser.add_argument("--store", default="sqlite", help="KIMI_STORE for the run")
+    parser.add_argument("--idle-timeout", type=float, default=2.0, help="KIMI_SESSION_IDLE_TIMEOUT for the run")
+    parser.add_argument("--idle-keep", type=int, default=2, help="KIMI_SESSION_IDLE_KEEP for the run")
+    parser.add_argument("--sample-every", type=int, default=100, help="Sessions between RSS samples")
+    parser.add_argument("--growth-budget", type=float, default=3.0,
+                        help="Max RSS growth in MB per 100 sessions over the second half")
+    parser.add_argument("--output", help="Also write the results to this JSON file")
+    args = parser.parse_args()
+
+    # Large chunks keep the test runner's per-delta overhead out of the way
+    server = MockServer(config=MockConfig(ttft=0.0, token_rate=1_000_000, chunk_tokens=100,
+                                          response_tokens=args.reply_tokens))
+    server.start_background()
+    store_dir = tempfile.mkdtemp(prefix="kimi-soak-")
+    os.environ.update(
+        KIMI_BASE_URL=server.base_url,
+        KIMI_STORE=args.store,
+        KIMI_STORE_PATH=os.path.join(store_dir, "conversations.db" if args.store == "sqlite" else "conversations"),
+        KIMI_SESSION_IDLE_TIMEOUT=str(args.idle_timeout),
+        KIMI_SESSION_IDLE_KEEP=str(args.idle_keep),
+        KIMI_SESSION_SWEEP_INTERVAL=str(min(args.idle_timeout / 2, 1.0)),
+        KIMI_PREFETCH="0",
+        KIMI_METRICS_PORT="0",
+    )
+
+    from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+    import streamlit.testing.v1.app_test as app_test
+    import streamlit.testing.v1.local_script_runner as local_script_runner
+    from streamlit.testing.v1 import AppTest
+
+    # The server compiles the script and scans for components once; the test runner would per session
+    shared_cache = ScriptCache()
+    app_test.ScriptCache = local_script_runner.ScriptCache = lambda: shared_cache
+    shared_components = app_test.BidiComponentManager()
+    shared_components.discover_and_register_components(start_file_watching=False)
+    shared_components.discover_and_register_components = lambda **kwargs: None
+    app_test.BidiComponentManager = lambda: shared_components
+
+    open_sessions: deque = deque()
+    samples: List[Dict] = []
+    errors = 0
+    start = time.perf_counter()
+    for index in range(1, args.sessions + 1):
+        at = AppTest.from_file(os.path.join(ROOT, "kimi_chat_app.py"), default_timeout=60)
+        at.session_state["api_key"] = "sk-soak"
+        at.run()
+        for turn in range(args.messages):
+            at.chat_input[0].set_value(f"Session {index} message {turn}: tell me about memory").run()
+        errors += bool(at.exception)
+        # Only the session's state outlives its runs, as with an open browser tab
+        open_sessions.append(at.session_state)
+        del at
+        if len(open_sessions) > args.open:
+            open_sessions.popleft()
+        if index % args.sample_every == 0:
+            gc.collect()
+            held = sum(message_bytes(message) for state in open_sessions for message in state["messages"])
+            samples.append({"sessions": index, "rss_mb": process_rss_bytes() / 1e6, "held_kb": held / 1024})
+            print(f"👥 {index:>5} sessions: RSS {samples[-1]['rss_mb']:.1f} MB, "
+                  f"messages held by open sessions {samples[-1]['held_kb']:.0f} KB", flush=True)
+
+    half = samples[len(samples) // 2] if len(samples) > 1 else samples[0]
+    last = samples[-1]
+    span = max(last["sessions"] - half["sessions"], 1)
+    growth = (last["rss_mb"] - half["rss_mb"]) / span * 100
+    results = {
+        "sessions": args.sessions,
+        "elapsed": time.perf_counter() - start,
+        "errors": errors,
+        "samples": samples,
+        "growth_mb_per_100_sessions": growth,
+        "budget": args.growth_budget,
+    }
+    print(f"📈 Second-half growth: {growth:.2f} MB per 100 sessions (budget {args.growth_budget:.2f} MB)")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+    failures = []
+    if growth > args.growth_budget:
+        failures.append("memory keeps growing")
+    if errors:
+        failures.append(f"{errors} sessions raised an exception")
+    if failures:
+        print("❌ " + "; ".join(failures))
+        sys.exit(1)
+    print("✅ Memory is flat")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Cold-start and rerun budget check for the Streamlit script
+
+Each cold sample is a fresh Python process that imports Streamlit (as the
+server already has) and times the first script run, so it pays for the
+app's own imports, .env loading and first-run setup. Rerun samples time
+further runs in the same session, which is what every click and message
+costs. The script exits non-zero when either median is over budget, or
+when the first run imports the OpenAI SDK, which should wait for the first
+API call.
+
+    python benchmarks/bench_startup.py --cold-budget 0.4 --rerun-budget 0.03
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from typing import Dict, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in a fresh interpreter per cold sample and prints its timings as JSON
+SAMPLE_SCRIPT = """
+import json, os, sys, time
+from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+from streamlit.runtime.scriptrunner.script_runner import ScriptRunner
+import streamlit.testing.v1.app_test as app_test
+import streamlit.testing.v1.local_script_runner as local_script_runner
+from streamlit.testing.v1 import AppTest
+
+# The server compiles the script once; the test runner would recompile every run
+shared_cache = ScriptCache()
+app_test.ScriptCache = local_script_runner.ScriptCache = lambda: shared_cache
+
+# Time the script run itself rather than the test runner's polling around it
+script_times = []
+run_script = ScriptRunner._run_script
+def timed_run_script(self, rerun_data):
+    start = time.perf_counter()
+    try:
+        return run_script(self, rerun_data)
+    finally:
+        script_times.append(time.perf_counter() - start)
+ScriptRunner._run_script = timed_run_script
+
+at = AppTest.from_file(os.path.join({root!r}, "kimi_chat_app.py"), default_timeout=60)
+at.session_state["api_key"] = "sk-benchmark"
+at.session_state["messages"] = [
+    {{"role": "user" if i % 2 == 0 else "assistant", "content": f"Message {{i}} " + "lorem ipsum " * 40}}
+    for i in range({history})
+]
+at.run()
+openai_loaded = "openai" in sys.modules
+for _ in range({reruns}):
+    at.run()
+print(json.dumps({{"cold": script_times[0], "reruns": script_times[1:], "openai_loaded": openai_loaded,
+                   "exception": bool(at.exception)}}))
+"""
+
+
+def run_sample(history: int, reruns: int) -> Dict:
+    env = dict(os.environ, KIMI_STORE="none", KIMI_METRICS_PORT="0")
+    output = subprocess.run(
+        [sys.executable, "-c", SAMPLE_SCRIPT.format(root=ROOT, history=history, reruns=reruns)],
+        cwd=ROOT, env=env, capture_output=True, text=True, check=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure app cold start and rerun time against a budget")
+    parser.add_argument("--samples", type=int, default=5, help="Fresh processes to start")
+    parser.add_argument("--reruns", type=int, default=20, help="Reruns timed in each process")
+    parser.add_argument("--history", type=int, default=40, help="Chat messages in the session")
+    parser.add_argument("--cold-budget", type=float, default=0.4, help="Max median first-run seconds")
+    parser.add_argument("--rerun-budget", type=float, default=0.03, help="Max median rerun seconds")
+    parser.add_argument("--output", help="Also write the results to this JSON file")
+    args = parser.parse_args()
+
+    samples = [run_sample(args.history, args.reruns) for _ in range(args.samples)]
+    cold: List[float] = [sample["cold"] for sample in samples]
+    reruns: List[float] = sorted(t for sample in samples for t in sample["reruns"])
+    results = {
+        "cold_median": statistics.median(cold),
+        "cold_max": max(cold),
+        "rerun_median": statistics.median(reruns),
+        "rerun_p95": reruns[min(len(reruns) - 1, round(0.95 * (len(reruns) - 1)))],
+        "openai_loaded_on_first_run": any(sample["openai_loaded"] for sample in samples),
+        "exceptions": sum(sample["exception"] for sample in samples),
+        "budget": {"cold": args.cold_budget, "rerun": args.rerun_budget},
+    }
+
+    print(f"🧊 Cold start: median {results['cold_median'] * 1000:.0f}ms, "
+          f"max {results['cold_max'] * 1000:.0f}ms (budget {args.cold_budget * 1000:.0f}ms)")
+    print(f"🔁 Rerun:      median {results['rerun_median'] * 1000:.1f}ms, "
+          f"p95 {results['rerun_p95'] * 1000:.1f}ms (budget {args.rerun_budget * 1000:.1f}ms)")
+    print(f"📦 OpenAI SDK imported before the first API call: "
+          f"{'yes' if results['openai_loaded_on_first_run'] else 'no'}")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+    failures = []
+    if results["cold_median"] > args.cold_budget:
+        failures.append("cold start over budget")
+    if results["rerun_median"] > args.rerun_budget:
+        failures.append("rerun over budget")
+    if results["openai_loaded_on_first_run"]:
+        failures.append("OpenAI SDK imported on first run")
+    if results["exceptions"]:
+        failures.append("script raised an exception")
+    if failures:
+        print("❌ " + "; ".join(failures))
+        sys.exit(1)
+    print("✅ Within budget")
+
+
+if __name__ == "__main__":
+    main()
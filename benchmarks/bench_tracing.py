@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Overhead of the tracing hooks on the streaming chat path
+
+Streams replies through Generation and stream_kimi_response against the
+local mock Moonshot server three ways: with tracing off, with spans on,
+and with spans and every turn profiled, then with two sessions' profiled
+turns running at once. Also times one span call site while tracing is
+off. Exits non-zero if any traced turn's reply comes back incomplete
+(from Python 3.12 a second cProfile profiler can't start while one is
+running), or if the hooks a turn passes through cost more than
+--off-budget of the turn while tracing is off.
+
+    python benchmarks/bench_tracing.py --turns 30 --off-budget 0.001
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import timeit
+from typing import Dict, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from mock_moonshot import MockConfig, MockServer
+
+from kimi_chat.clients import ClientRegistry
+from kimi_chat.completion import stream_kimi_response
+from kimi_chat.generation import Generation
+from kimi_chat.scheduler import RequestScheduler
+from kimi_chat.tracing import TracingConfig, default_tracer
+
+MESSAGES = [{"role": "user", "content": "Explain what async/await means in programming"}]
+
+
+def run_turns(base_url: str, turns: int, max_tokens: int, incomplete: List[str]) -> List[float]:
+    """Seconds per turn, each a streamed reply read to the end on a worker thread
+
+    Turns whose reply comes back empty or with an error are added to ``incomplete``.
+    """
+    client = ClientRegistry().get("sk-benchmark", base_url)
+    scheduler = RequestScheduler()
+    seconds = []
+    for _ in range(turns):
+        start = time.perf_counter()
+        with default_tracer.turn(action="benchmark"):
+            generation = Generation(lambda metrics: stream_kimi_response(
+                client, MESSAGES, "kimi-k2-turbo-preview", 0.6, max_tokens, metrics=metrics, scheduler=scheduler
+            ))
+            generation.wait()
+        seconds.append(time.perf_counter() - start)
+        if not generation.text or generation.metrics.get("error"):
+            incomplete.append(threading.current_thread().name)
+    return seconds
+
+
+def run_concurrent_turns(base_url: str, sessions: int, turns: int, max_tokens: int,
+                         incomplete: List[str]) -> List[float]:
+    """Seconds per turn with ``sessions`` threads running traced turns at once, like concurrent sessions"""
+    seconds: List[float] = []
+    threads = [threading.Thread(target=lambda: seconds.extend(run_turns(base_url, turns, max_tokens, incomplete)),
+                                name=f"session-{session}") for session in range(sessions)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return seconds
+
+
+def span_cost_off(samples: int = 200_000) -> float:
+    """Seconds one ``with tracer.span(...)`` block costs while tracing is off"""
+    def traced():
+        with default_tracer.span("benchmark", size=1):
+            pass
+
+    def untraced():
+        pass
+
+    return (timeit.timeit(traced, number=samples) - timeit.timeit(untraced, number=samples)) / samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure tracing overhead on the streaming chat path")
+    parser.add_argument("--turns", type=int, default=30, help="Turns per mode")
+    parser.add_argument("--max-tokens", type=int, default=50)
+    parser.add_argument("--ttft", type=float, default=0.02, help="Mock server time to first token")
+    parser.add_argument("--token-rate", type=float, default=2000.0, help="Mock server tokens per second")
+    parser.add_argument("--off-budget", type=float, default=0.001,
+                        help="Max share of a turn the hooks may cost while tracing is off")
+    parser.add_argument("--output", help="Also write the results to this JSON file")
+    args = parser.parse_args()
+
+    server = MockServer(config=MockConfig(ttft=args.ttft, token_rate=args.token_rate,
+                                          response_tokens=args.max_tokens))
+    server.start_background()
+    results: Dict = {"config": vars(args), "modes": {}}
+    incomplete: List[str] = []
+    with tempfile.TemporaryDirectory() as directory:
+        # Warm up imports and the connection before anything is timed
+        run_turns(server.base_url, 2, args.max_tokens, incomplete)
+        for mode, config in (
+            ("off", TracingConfig()),
+            ("spans", TracingConfig(enabled=True, directory=directory, profile_percent=0)),
+            ("profiled", TracingConfig(enabled=True, directory=directory, profile_percent=100)),
+        ):
+            default_tracer.configure(config)
+            seconds = run_turns(server.base_url, args.turns, args.max_tokens, incomplete)
+            results["modes"][mode] = {
+                "turn_median": statistics.median(seconds),
+                "events_per_turn": default_tracer.stats()["spans"] / args.turns,
+            }
+        default_tracer.configure(TracingConfig(enabled=True, directory=directory, profile_percent=100))
+        seconds = run_concurrent_turns(server.base_url, 2, args.turns // 2 or 1, args.max_tokens, incomplete)
+        results["modes"]["profiled, 2 sessions"] = {
+            "turn_median": statistics.median(seconds),
+            "profiles_written": default_tracer.stats()["profiles_written"],
+        }
+    server.shutdown()
+    results["incomplete_turns"] = len(incomplete)
+    default_tracer.configure(TracingConfig())
+
+    off = results["modes"]["off"]["turn_median"]
+    # Every event written with tracing on is a hook the turn also passes with it off
+    hooks = results["modes"]["spans"]["events_per_turn"]
+    results["span_cost_off"] = span_cost_off()
+    results["off_overhead"] = hooks * results["span_cost_off"] / off
+    print(f"🧵 Turn median: off {off * 1000:.1f}ms · spans "
+          f"{results['modes']['spans']['turn_median'] * 1000:.1f}ms · profiled "
+          f"{results['modes']['profiled']['turn_median'] * 1000:.1f}ms · profiled, 2 sessions "
+          f"{results['modes']['profiled, 2 sessions']['turn_median'] * 1000:.1f}ms")
+    print(f"🔕 Tracing off: {results['span_cost_off'] * 1e9:.0f}ns per hook × {hooks:.0f} hooks per turn = "
+          f"{results['off_overhead']:.4%} of a turn (budget {args.off_budget:.2%})")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    if incomplete:
+        print(f"❌ {len(incomplete)} traced turns came back without a complete reply")
+        sys.exit(1)
+    if results["off_overhead"] > args.off_budget:
+        print("❌ Tracing hooks cost too much while tracing is off")
+        sys.exit(1)
+    print("✅ Within budget")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+"""
+Local OpenAI-compatible stand-in for the Moonshot AI API
+
+Serves /v1/chat/completions (blocking and SSE streaming) and /v1/models
+with configurable latency, token rate, chunking and injected 429/5xx
+errors, so the app and benchmarks can run without spending credits:
+
+    python benchmarks/mock_moonshot.py --port 8765 --ttft 0.3 --token-rate 80
+    KIMI_BASE_URL=http://127.0.0.1:8765/v1 streamlit run kimi_chat_app.py
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+FILLER_WORDS = (
+    "Kimi is a helpful assistant that answers questions clearly and concisely "
+    "with practical examples and step by step explanations where they help"
+).split()
+
+
+@dataclass
+class MockConfig:
+    """Behavior of the mock server"""
+    ttft: float = 0.2
+    token_rate: float = 100.0
+    chunk_tokens: int = 1
+    response_tokens: int = 200
+    error_429_rate: float = 0.0
+    error_5xx_rate: float = 0.0
+    retry_after: float = 1.0
+
+
+class MockStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors_429 = 0
+        self.errors_5xx = 0
+        self.tokens_streamed = 0
+        self.streams_cancelled = 0
+
+    def snapshot(self) -> Dict[str, int]:
+        with self.lock:
+            return {"requests": self.requests, "errors_429": self.errors_429, "errors_5xx": self.errors_5xx,
+                    "tokens_streamed": self.tokens_streamed, "streams_cancelled": self.streams_cancelled}
+
+
+def _estimate_tokens(messages: List[Dict]) -> int:
+    return sum(len(str(m.get("content", ""))) // 4 + 4 for m in messages)
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    server_version = "MockMoonshot/1.0"
+    protocol_version = "HTTP/1.1"
+
+    @property
+    def config(self) -> MockConfig:
+        return self.server.config
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _send_json(self, status: int, payload: Dict, headers: Optional[Dict[str, str]] = None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/models"):
+            models = ["kimi-k2-turbo-preview", "kimi-k2-0711-preview", "kimi-k2-0905-preview",
+                      "moonshot-v1-8k", "moonshot-v1-32k", "moonshot-v1-128k"]
+            self._send_json(200, {"object": "list", "data": [
+                {"id": model, "object": "model", "owned_by": "moonshot"} for model in models
+            ]})
+        else:
+            self._send_json(404, {"error": {"message": "Not found", "type": "not_found"}})
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": "Not found", "type": "not_found"}})
+            return
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        stats = self.server.stats
+        with stats.lock:
+            stats.requests += 1
+
+        roll = random.random()
+        if roll < self.config.error_429_rate:
+            with stats.lock:
+                stats.errors_429 += 1
+            self._send_json(429, {"error": {"message": "Rate limit reached (mock)",
+                                            "type": "rate_limit_reached_error"}},
+                            {"Retry-After": f"{self.config.retry_after:g}"})
+            return
+        if roll < self.config.error_429_rate + self.config.error_5xx_rate:
+            with stats.lock:
+                stats.errors_5xx += 1
+            self._send_json(503, {"error": {"message": "Service unavailable (mock)",
+                                            "type": "server_error"}})
+            return
+
+        model = request.get("model", "kimi-k2-turbo-preview")
+        completion_tokens = min(int(request.get("max_tokens") or self.config.response_tokens),
+                                self.config.response_tokens)
+        prompt_tokens = _estimate_tokens(request.get("messages", []))
+        words = [FILLER_WORDS[i % len(FILLER_WORDS)] for i in range(completion_tokens)]
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                 "total_tokens": prompt_tokens + completion_tokens}
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+        created = int(time.time())
+
+        time.sleep(self.config.ttft)
+        if not request.get("stream"):
+            if self.config.token_rate > 0:
+                time.sleep(completion_tokens / self.config.token_rate)
+            self._send_json(200, {
+                "id": completion_id, "object": "chat.completion", "created": created, "model": model,
+                "choices": [{"index": 0, "finish_reason": "length" if completion_tokens else "stop",
+                             "message": {"role": "assistant", "content": " ".join(words)}}],
+                "usage": usage,
+            })
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        chunk_tokens = max(1, self.config.chunk_tokens)
+        delay = chunk_tokens / self.config.token_rate if self.config.token_rate > 0 else 0.0
+        try:
+            for start in range(0, completion_tokens, chunk_tokens):
+                if start:
+                    time.sleep(delay)
+                text = " ".join(words[start:start + chunk_tokens])
+                self._send_event({
+                    "id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                    "choices": [{"index": 0, "delta": {"content": (" " if start else "") + text},
+                                 "finish_reason": None}],
+                })
+                with self.server.stats.lock:
+                    self.server.stats.tokens_streamed += len(words[start:start + chunk_tokens])
+            # Moonshot puts usage on the final choice rather than the chunk
+            self._send_event({
+                "id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                "choices": [{"index": 0, "delta": {}, "finish_reason": "length", "usage": usage}],
+            })
+            self._send_raw(b"data: [DONE]\n\n")
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            # Client cancelled the stream
+            with self.server.stats.lock:
+                self.server.stats.streams_cancelled += 1
+
+    def _send_event(self, payload: Dict):
+        self._send_raw(f"data: {json.dumps(payload)}\n\n".encode("utf-8"))
+
+    def _send_raw(self, data: bytes):
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+
+class MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0,
+                 config: Optional[MockConfig] = None, verbose: bool = False):
+        super().__init__((host, port), MockHandler)
+        self.config = config or MockConfig()
+        self.stats = MockStats()
+        self.verbose = verbose
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start_background(self) -> threading.Thread:
+        """Serve from a daemon thread; call ``shutdown()`` to stop"""
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local mock of the Moonshot AI chat API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--ttft", type=float, default=0.2, help="Seconds before the first token")
+    parser.add_argument("--token-rate", type=float, default=100.0, help="Tokens per second after the first")
+    parser.add_argument("--chunk-tokens", type=int, default=1, help="Tokens per streamed chunk")
+    parser.add_argument("--response-tokens", type=int, default=200, help="Tokens per response (capped by max_tokens)")
+    parser.add_argument("--error-429-rate", type=float, default=0.0, help="Fraction of requests answered with 429")
+    parser.add_argument("--error-5xx-rate", type=float, default=0.0, help="Fraction of requests answered with 503")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After seconds sent with 429s")
+    parser.add_argument("--verbose", action="store_true", help="Log every request")
+    args = parser.parse_args()
+
+    config = MockConfig(
+        ttft=args.ttft,
+        token_rate=args.token_rate,
+        chunk_tokens=args.chunk_tokens,
+        response_tokens=args.response_tokens,
+        error_429_rate=args.error_429_rate,
+        error_5xx_rate=args.error_5xx_rate,
+        retry_after=args.retry_after,
+    )
+    server = MockServer(args.host, args.port, config, verbose=args.verbose)
+    print(f"🧪 Mock Moonshot API listening on {server.base_url}")
+    print(f"   Use it with: KIMI_BASE_URL={server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1 @@
+"""Backend helpers for the Kimi AI Chat app"""
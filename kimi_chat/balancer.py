@@ -0,0 +1,191 @@
+"""Spread requests for one pooled client across several API keys and endpoints"""
+
+import os
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Mapping, Optional
+from urllib.parse import urlparse
+
+from kimi_chat.clients import default_base_url
+
+BALANCE_STRATEGIES = ("least_outstanding", "quota")
+
+
+@dataclass
+class Upstream:
+    """One API key at one endpoint"""
+    api_key: str
+    base_url: str
+
+    @property
+    def name(self) -> str:
+        # Enough to tell upstreams apart in stats without showing the key
+        return f"{urlparse(self.base_url).netloc or self.base_url} …{self.api_key[-4:]}"
+
+
+def parse_upstreams(spec: str) -> List[Upstream]:
+    """Parse ``key@base_url`` entries separated by commas; a bare key uses the default endpoint"""
+    upstreams = []
+    for entry in spec.split(","):
+        entry = entry.strip()
+        if not entry:
+            continue
+        api_key, _, base_url = entry.partition("@")
+        upstreams.append(Upstream(api_key.strip(), base_url.strip() or default_base_url()))
+    return upstreams
+
+
+@dataclass
+class BalancerConfig:
+    """Upstreams to balance across and when to take one out of rotation"""
+    upstreams: List[Upstream] = field(default_factory=list)
+    pool_key: str = ""
+    strategy: str = "least_outstanding"
+    requests_per_minute: float = 200.0
+    eject_after: int = 3
+    health_interval: float = 15.0
+
+    @classmethod
+    def from_env(cls) -> "BalancerConfig":
+        """Read KIMI_UPSTREAMS, e.g. 'sk-a@https://api.moonshot.ai/v1,sk-b@https://api.moonshot.cn/v1'"""
+        upstreams = parse_upstreams(os.getenv("KIMI_UPSTREAMS", ""))
+        strategy = os.getenv("KIMI_BALANCE_STRATEGY", cls.strategy)
+        if strategy not in BALANCE_STRATEGIES:
+            raise ValueError(f"KIMI_BALANCE_STRATEGY must be one of {', '.join(BALANCE_STRATEGIES)}")
+        return cls(
+            upstreams=upstreams,
+            # Sessions using this key are served by the pool
+            pool_key=os.getenv("KIMI_API_KEY") or (upstreams[0].api_key if upstreams else ""),
+            strategy=strategy,
+            requests_per_minute=float(os.getenv("KIMI_RATE_RPM", cls.requests_per_minute)),
+            eject_after=int(os.getenv("KIMI_EJECT_AFTER", cls.eject_after)),
+            health_interval=float(os.getenv("KIMI_HEALTH_INTERVAL", cls.health_interval)),
+        )
+
+
+class UpstreamState:
+    """Counters for one upstream, guarded by the balancer's lock"""
+
+    def __init__(self, upstream: Upstream):
+        self.upstream = upstream
+        self.in_flight = 0
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.ejected_at: Optional[float] = None
+        self.quota_remaining: Optional[float] = None
+        self.recent: deque = deque()
+
+    def requests_last_minute(self, now: float) -> int:
+        while self.recent and now - self.recent[0] > 60.0:
+            self.recent.popleft()
+        return len(self.recent)
+
+
+def quota_remaining(headers: Mapping[str, str]) -> Optional[float]:
+    """Fraction of the request quota left, from x-ratelimit-* headers when the server sends them"""
+    try:
+        remaining = float(headers["x-ratelimit-remaining-requests"])
+        limit = float(headers["x-ratelimit-limit-requests"])
+    except (KeyError, ValueError):
+        return None
+    return remaining / limit if limit > 0 else None
+
+
+class LoadBalancer:
+    """Pick an upstream per request and track its health
+
+    ``least_outstanding`` sends each request to the upstream with the fewest
+    requests in flight; ``quota`` sends it to the one with the most request
+    quota left, read from rate-limit headers or, without them, estimated
+    from requests sent in the last minute. Upstreams with recent failures
+    are picked last until a request or health check to them succeeds.
+    After ``eject_after`` failures in a row an upstream is taken out of
+    rotation until a health check against it succeeds. If every upstream
+    is out, requests still go to all of them rather than failing outright.
+    """
+
+    def __init__(self, config: BalancerConfig, health_check: Optional[Callable[[Upstream], bool]] = None):
+        if not config.upstreams:
+            raise ValueError("LoadBalancer needs at least one upstream")
+        self.config = config
+        self.health_check = health_check
+        self._states = [UpstreamState(upstream) for upstream in config.upstreams]
+        self._lock = threading.Lock()
+        self._next = 0
+        self._stop = threading.Event()
+        threading.Thread(target=self._health_loop, name="kimi-balancer-health", daemon=True).start()
+
+    @property
+    def upstreams(self) -> List[Upstream]:
+        return self.config.upstreams
+
+    def _headroom(self, state: UpstreamState, now: float) -> float:
+        if state.quota_remaining is not None:
+            return state.quota_remaining
+        return 1.0 - state.requests_last_minute(now) / self.config.requests_per_minute
+
+    def acquire(self) -> UpstreamState:
+        """Choose an upstream for one request and count it as in flight"""
+        now = time.monotonic()
+        with self._lock:
+            candidates = [state for state in self._states if state.ejected_at is None] or self._states
+            # Rotate the starting point so ties are spread round-robin
+            self._next = (self._next + 1) % len(candidates)
+            candidates = candidates[self._next:] + candidates[:self._next]
+            if self.config.strategy == "quota":
+                rank = lambda state: (state.consecutive_failures > 0, -self._headroom(state, now), state.in_flight)
+            else:
+                rank = lambda state: (state.consecutive_failures > 0, state.in_flight, -self._headroom(state, now))
+            state = min(candidates, key=rank)
+            state.in_flight += 1
+            state.requests += 1
+            state.recent.append(now)
+            return state
+
+    def release(self, state: UpstreamState, ok: bool, headers: Optional[Mapping[str, str]] = None):
+        """Record how a request to ``state`` ended"""
+        with self._lock:
+            state.in_flight -= 1
+            if headers is not None:
+                state.quota_remaining = quota_remaining(headers)
+            if ok:
+                state.consecutive_failures = 0
+                return
+            state.failures += 1
+            state.consecutive_failures += 1
+            if state.consecutive_failures >= self.config.eject_after and state.ejected_at is None:
+                state.ejected_at = time.monotonic()
+
+    def _health_loop(self):
+        while not self._stop.wait(self.config.health_interval):
+            with self._lock:
+                failing = [state for state in self._states if state.consecutive_failures]
+            for state in failing:
+                try:
+                    healthy = self.health_check is not None and self.health_check(state.upstream)
+                except Exception:
+                    healthy = False
+                if healthy:
+                    with self._lock:
+                        state.ejected_at = None
+                        state.consecutive_failures = 0
+
+    def close(self):
+        self._stop.set()
+
+    def stats(self) -> List[Dict]:
+        """Per-upstream health and utilization, in configured order"""
+        now = time.monotonic()
+        with self._lock:
+            return [{
+                "name": state.upstream.name,
+                "healthy": state.ejected_at is None,
+                "in_flight": state.in_flight,
+                "requests": state.requests,
+                "failures": state.failures,
+                "requests_last_minute": state.requests_last_minute(now),
+                "utilization": 1.0 - self._headroom(state, now),
+            } for state in self._states]
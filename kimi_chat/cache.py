@@ -0,0 +1,208 @@
+"""Response cache in front of the chat completion call"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Dict, List, Optional
+
+if TYPE_CHECKING:
+    from .shared import SharedBackend
+
+# Namespace of cached responses in a shared backend
+SHARED_PREFIX = "response:"
+
+
+@dataclass
+class ResponseCacheConfig:
+    """Size, lifetime and persistence settings for the response cache"""
+    max_entries: int = 1000
+    ttl: float = 24 * 3600.0
+    max_temperature: float = 0.6
+    path: Optional[str] = None
+
+    @classmethod
+    def from_env(cls) -> "ResponseCacheConfig":
+        """Build a config from KIMI_CACHE_* environment variables"""
+        defaults = cls()
+        return cls(
+            max_entries=int(os.getenv("KIMI_CACHE_MAX_ENTRIES", defaults.max_entries)),
+            ttl=float(os.getenv("KIMI_CACHE_TTL", defaults.ttl)),
+            max_temperature=float(os.getenv("KIMI_CACHE_MAX_TEMPERATURE", defaults.max_temperature)),
+            path=os.getenv("KIMI_CACHE_PATH") or defaults.path,
+        )
+
+
+@dataclass
+class CachedResponse:
+    content: str
+    latency: float
+    created_at: float
+
+
+def normalize_text(text: str) -> str:
+    """A message as it is keyed: its exact text, less leading and trailing whitespace
+
+    Case and indentation can change what a prompt means (code, identifiers),
+    so only the whitespace around a message is ignored.
+    """
+    return text.strip()
+
+
+def owner_digest(api_key: str) -> str:
+    """Who pays for a request, kept as a digest rather than the raw key"""
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:32]
+
+
+def make_cache_key(model: str, temperature: float, max_tokens: int,
+                   messages: List[Dict[str, str]]) -> str:
+    """Stable hash of the request parameters and normalized messages"""
+    payload = {
+        "model": model,
+        "temperature": round(float(temperature), 2),
+        "max_tokens": int(max_tokens),
+        "messages": [[m.get("role", ""), normalize_text(m.get("content") or "")] for m in messages],
+    }
+    encoded = json.dumps(payload, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+def response_key(api_key: str, model: str, temperature: float, max_tokens: int,
+                 messages: List[Dict[str, str]]) -> str:
+    """Cache key for a response, scoped to the API key that paid for it
+
+    The cache can be a file or a backend shared by replicas, so one key's
+    answers are never served to another.
+    """
+    return owner_digest(api_key) + ":" + make_cache_key(model, temperature, max_tokens, messages)
+
+
+class ResponseCache:
+    """LRU + TTL cache of completions, optionally persisted to SQLite
+
+    Lookups check memory first, then the SQLite file if one is configured,
+    or the shared backend that replicas hold in common if one is given; it
+    expires entries by the TTL and doesn't count toward ``max_entries``.
+    Only requests at or below ``max_temperature`` are served from or stored
+    in the cache, since higher temperatures are expected to vary.
+    """
+
+    def __init__(self, config: Optional[ResponseCacheConfig] = None,
+                 backend: Optional["SharedBackend"] = None):
+        self.config = config or ResponseCacheConfig()
+        self.backend = backend
+        self._entries: "OrderedDict[str, CachedResponse]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        self.hits = 0
+        self.misses = 0
+        self.shared_hits = 0
+        self.latency_saved = 0.0
+        if self.config.path and backend is None:
+            self._db = sqlite3.connect(self.config.path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, content TEXT NOT NULL, latency REAL NOT NULL, "
+                "created_at REAL NOT NULL, last_used REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+            self._db.commit()
+
+    def cacheable(self, temperature: float) -> bool:
+        return temperature <= self.config.max_temperature
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        """Return the cached response for ``key`` if present and not expired"""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None and self._db is not None:
+                entry = self._load(key, now)
+                if entry is not None:
+                    self._remember(key, entry)
+            elif entry is None and self.backend is not None:
+                entry = self._load_shared(key)
+                if entry is not None:
+                    self.shared_hits += 1
+                    self._remember(key, entry)
+            if entry is not None and now - entry.created_at > self.config.ttl:
+                self._entries.pop(key, None)
+                if self._db is not None:
+                    self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    self._db.commit()
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            self.latency_saved += entry.latency
+            return entry
+
+    def put(self, key: str, content: str, latency: float):
+        """Store a successful response and how long it took to generate"""
+        now = time.time()
+        entry = CachedResponse(content=content, latency=latency, created_at=now)
+        with self._lock:
+            self._remember(key, entry)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO responses (key, content, latency, created_at, last_used) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (key, content, latency, now, now),
+                )
+                self._db.execute(
+                    "DELETE FROM responses WHERE key IN (SELECT key FROM responses "
+                    "ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                    (self.config.max_entries,),
+                )
+                self._db.commit()
+            if self.backend is not None:
+                self.backend.set(SHARED_PREFIX + key, json.dumps(
+                    {"content": content, "latency": latency, "created_at": now}, ensure_ascii=False
+                ), ttl=self.config.ttl)
+
+    def _remember(self, key: str, entry: CachedResponse):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.config.max_entries:
+            self._entries.popitem(last=False)
+
+    def _load(self, key: str, now: float) -> Optional[CachedResponse]:
+        row = self._db.execute(
+            "SELECT content, latency, created_at FROM responses WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        self._db.execute("UPDATE responses SET last_used = ? WHERE key = ?", (now, key))
+        self._db.commit()
+        return CachedResponse(content=row[0], latency=row[1], created_at=row[2])
+
+    def _load_shared(self, key: str) -> Optional[CachedResponse]:
+        value = self.backend.get(SHARED_PREFIX + key)
+        return CachedResponse(**json.loads(value)) if value is not None else None
+
+    def clear(self):
+        """Forget every entry; a shared backend's entries are left to expire"""
+        with self._lock:
+            self._entries.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM responses")
+                self._db.commit()
+
+    def stats(self) -> Dict[str, float]:
+        """Hit ratio and total latency saved across all sessions"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "shared_hits": self.shared_hits,
+                "latency_saved": self.latency_saved,
+                "size": len(self._entries),
+            }
@@ -0,0 +1,177 @@
+"""Process-wide registry of pooled Kimi API clients"""
+
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Dict, Optional, Tuple
+
+from kimi_chat.tracing import trace_http_request
+
+if TYPE_CHECKING:
+    import openai
+
+    from kimi_chat.balancer import LoadBalancer
+
+DEFAULT_BASE_URL = "https://api.moonshot.ai/v1"
+
+
+def default_base_url() -> str:
+    """API endpoint from KIMI_BASE_URL, e.g. a local mock server or api.moonshot.cn"""
+    return os.getenv("KIMI_BASE_URL") or DEFAULT_BASE_URL
+
+
+@dataclass
+class ClientPoolConfig:
+    """Connection pool limits, timeouts and registry size"""
+    max_clients: int = 32
+    idle_ttl: float = 600.0
+    max_connections: int = 20
+    max_keepalive_connections: int = 10
+    keepalive_expiry: float = 30.0
+    timeout: float = 60.0
+    connect_timeout: float = 10.0
+
+    @classmethod
+    def from_env(cls) -> "ClientPoolConfig":
+        """Build a config from KIMI_POOL_* / KIMI_*_TIMEOUT environment variables"""
+        defaults = cls()
+        return cls(
+            max_clients=int(os.getenv("KIMI_POOL_MAX_CLIENTS", defaults.max_clients)),
+            idle_ttl=float(os.getenv("KIMI_POOL_IDLE_TTL", defaults.idle_ttl)),
+            max_connections=int(os.getenv("KIMI_POOL_MAX_CONNECTIONS", defaults.max_connections)),
+            max_keepalive_connections=int(os.getenv("KIMI_POOL_MAX_KEEPALIVE", defaults.max_keepalive_connections)),
+            keepalive_expiry=float(os.getenv("KIMI_POOL_KEEPALIVE_EXPIRY", defaults.keepalive_expiry)),
+            timeout=float(os.getenv("KIMI_REQUEST_TIMEOUT", defaults.timeout)),
+            connect_timeout=float(os.getenv("KIMI_CONNECT_TIMEOUT", defaults.connect_timeout)),
+        )
+
+
+class ClientRegistry:
+    """Share one keep-alive OpenAI client per (api_key, base_url) across sessions
+
+    Clients are kept in LRU order. When the registry grows past
+    ``max_clients``, or a client hasn't been used for ``idle_ttl`` seconds,
+    it is evicted and its connection pool is closed.
+
+    With a load balancer, the balancer's pool key at the default endpoint
+    gets a single client whose requests are spread across its upstreams.
+    """
+
+    def __init__(self, config: Optional[ClientPoolConfig] = None, balancer: Optional["LoadBalancer"] = None):
+        self.config = config or ClientPoolConfig()
+        self.balancer = balancer
+        self._balanced_client: Optional["openai.OpenAI"] = None
+        self._clients: "OrderedDict[Tuple[str, str], Tuple[openai.OpenAI, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _key(api_key: str, base_url: str) -> Tuple[str, str]:
+        # Store a digest rather than the raw key in the registry index
+        return hashlib.sha256(api_key.encode("utf-8")).hexdigest(), base_url.rstrip("/")
+
+    def _build_client(self, api_key: str, base_url: str) -> "openai.OpenAI":
+        # Imported with the first client rather than at start-up, since the SDK is slow to import
+        import httpx
+        import openai
+
+        config = self.config
+        http_client = openai.DefaultHttpxClient(
+            limits=httpx.Limits(
+                max_connections=config.max_connections,
+                max_keepalive_connections=config.max_keepalive_connections,
+                keepalive_expiry=config.keepalive_expiry,
+            ),
+            timeout=httpx.Timeout(config.timeout, connect=config.connect_timeout),
+            event_hooks={"request": [trace_http_request]},
+        )
+        return openai.OpenAI(api_key=api_key, base_url=base_url, http_client=http_client)
+
+    def _build_balanced_client(self, base_url: str) -> "openai.OpenAI":
+        import httpx
+        import openai
+
+        from kimi_chat.transport import BalancedTransport
+
+        config = self.config
+        # Connection limits apply per endpoint, inside the balanced transport
+        transport = BalancedTransport(self.balancer, base_url, httpx.Limits(
+            max_connections=config.max_connections,
+            max_keepalive_connections=config.max_keepalive_connections,
+            keepalive_expiry=config.keepalive_expiry,
+        ))
+        http_client = openai.DefaultHttpxClient(
+            transport=transport,
+            timeout=httpx.Timeout(config.timeout, connect=config.connect_timeout),
+            event_hooks={"request": [trace_http_request]},
+        )
+        return openai.OpenAI(api_key=self.balancer.config.pool_key, base_url=base_url, http_client=http_client)
+
+    def get(self, api_key: str, base_url: Optional[str] = None) -> "openai.OpenAI":
+        """Return the pooled client for this key and endpoint, creating it on a miss"""
+        if self.balancer is not None and api_key == self.balancer.config.pool_key and base_url is None:
+            with self._lock:
+                self.hits += self._balanced_client is not None
+                if self._balanced_client is None:
+                    self.misses += 1
+                    self._balanced_client = self._build_balanced_client(default_base_url())
+                return self._balanced_client
+        base_url = base_url or default_base_url()
+        key = self._key(api_key, base_url)
+        now = time.monotonic()
+        with self._lock:
+            self._evict_idle(now)
+            entry = self._clients.get(key)
+            if entry is not None:
+                self.hits += 1
+                self._clients[key] = (entry[0], now)
+                self._clients.move_to_end(key)
+                return entry[0]
+            self.misses += 1
+            client = self._build_client(api_key, base_url)
+            self._clients[key] = (client, now)
+            while len(self._clients) > self.config.max_clients:
+                _, (evicted, _) = self._clients.popitem(last=False)
+                self._close(evicted)
+            return client
+
+    def _evict_idle(self, now: float):
+        # Entries are in LRU order, so stop at the first one still fresh
+        while self._clients:
+            key, (client, last_used) = next(iter(self._clients.items()))
+            if now - last_used < self.config.idle_ttl:
+                break
+            del self._clients[key]
+            self._close(client)
+
+    def _close(self, client: "openai.OpenAI"):
+        self.evictions += 1
+        try:
+            client.close()
+        except Exception:
+            pass
+
+    def close_all(self):
+        """Close every pooled client"""
+        with self._lock:
+            while self._clients:
+                _, (client, _) = self._clients.popitem()
+                self._close(client)
+            if self._balanced_client is not None:
+                self._close(self._balanced_client)
+                self._balanced_client = None
+
+    def stats(self) -> Dict[str, int]:
+        """Hit/miss counts and current registry size"""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "size": len(self._clients),
+            }
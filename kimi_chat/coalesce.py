@@ -0,0 +1,187 @@
+"""Single-flight sharing of identical in-flight completions across sessions"""
+
+import contextvars
+import os
+import threading
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterator, List, Optional
+
+from kimi_chat.cache import response_key
+from kimi_chat.tracing import default_tracer
+
+# Starts the shared call; fills the given metrics dict as record_turn_metrics does
+Producer = Callable[[Dict], Iterator[str]]
+
+
+class CoalescedTimeout(Exception):
+    """Raised to a waiter when the shared call makes no progress in time"""
+
+
+@dataclass
+class CoalescerConfig:
+    """Whether identical requests are shared and how long a waiter waits for progress"""
+    enabled: bool = True
+    wait_timeout: float = 120.0
+
+    @classmethod
+    def from_env(cls) -> "CoalescerConfig":
+        return cls(
+            enabled=os.getenv("KIMI_COALESCE", "1").lower() not in ("0", "false", "no", "off"),
+            wait_timeout=float(os.getenv("KIMI_COALESCE_TIMEOUT", cls.wait_timeout)),
+        )
+
+
+def coalesce_key(api_key: str, model: str, temperature: float, max_tokens: int,
+                 api_messages: List[Dict[str, str]]) -> str:
+    """Requests share a call only when they would also share the bill"""
+    return response_key(api_key, model, temperature, max_tokens, api_messages)
+
+
+class _Flight:
+    """One upstream call and every delta it has produced so far"""
+
+    def __init__(self):
+        self.changed = threading.Condition()
+        self.chunks: List[str] = []
+        self.metrics: Dict = {}
+        self.error: Optional[Exception] = None
+        self.done = False
+        self.cancelled = False
+        self.waiters = 0
+
+
+class Subscription:
+    """One caller's view of a shared call; iterate it for the deltas
+
+    Every subscriber, including the one that started the call, reads from
+    the flight's buffer, so a late joiner still gets the whole response.
+    ``metrics`` holds the producer's turn metrics once iteration finishes.
+    """
+
+    def __init__(self, coalescer: "RequestCoalescer", key: str, flight: _Flight, leader: bool):
+        self._coalescer = coalescer
+        self._key = key
+        self._flight = flight
+        self.leader = leader
+
+    @property
+    def metrics(self) -> Dict:
+        return self._flight.metrics
+
+    @property
+    def cancelled(self) -> bool:
+        """Whether the shared call was cancelled because everyone left"""
+        return self._flight.cancelled
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Wait for the shared call to finish; returns whether it has"""
+        with self._flight.changed:
+            return self._flight.changed.wait_for(lambda: self._flight.done, timeout)
+
+    def __iter__(self) -> Iterator[str]:
+        flight = self._flight
+        index = 0
+        try:
+            while True:
+                with flight.changed:
+                    if not flight.changed.wait_for(lambda: index < len(flight.chunks) or flight.done,
+                                                   timeout=self._coalescer.config.wait_timeout):
+                        self._coalescer._count("timeouts")
+                        raise CoalescedTimeout("The response stopped arriving; please try again.")
+                    new_chunks = flight.chunks[index:]
+                    index = len(flight.chunks)
+                    done = flight.done
+                yield from new_chunks
+                if done:
+                    if flight.error is not None:
+                        raise flight.error
+                    return
+        finally:
+            self._coalescer._leave(self._key, flight)
+
+
+class RequestCoalescer:
+    """Share one upstream call between concurrent identical requests
+
+    The first request for a key starts the call on its own thread; requests
+    for the same key that arrive before it finishes subscribe to it instead
+    of calling the API. Each subscriber has its own progress timeout and
+    can leave at any time; when the last one leaves an unfinished call, the
+    call is cancelled so nobody pays for tokens no one will read.
+    """
+
+    def __init__(self, config: Optional[CoalescerConfig] = None):
+        self.config = config or CoalescerConfig()
+        self._flights: Dict[str, _Flight] = {}
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.coalesced = 0
+        self.cancelled = 0
+        self.timeouts = 0
+
+    def subscribe(self, key: str, produce: Producer) -> Subscription:
+        """Join the in-flight call for ``key``, or start one with ``produce``"""
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self.calls += 1
+            else:
+                self.coalesced += 1
+            flight.waiters += 1
+        if leader:
+            # The call runs in the leader's context, so it is traced as part of the leader's turn
+            threading.Thread(target=contextvars.copy_context().run, args=(self._run, key, flight, produce),
+                             name="kimi-coalesce", daemon=True).start()
+        return Subscription(self, key, flight, leader)
+
+    def _run(self, key: str, flight: _Flight, produce: Producer):
+        deltas = None
+        try:
+            with default_tracer.thread_profile():
+                deltas = produce(flight.metrics)
+                for delta in deltas:
+                    with flight.changed:
+                        flight.chunks.append(delta)
+                        flight.changed.notify_all()
+                        if flight.cancelled:
+                            break
+        except Exception as e:
+            flight.error = e
+        finally:
+            if deltas is not None and hasattr(deltas, "close"):
+                # Stops a cancelled stream and lets it record its metrics
+                deltas.close()
+            with self._lock:
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+            with flight.changed:
+                flight.done = True
+                flight.changed.notify_all()
+
+    def _leave(self, key: str, flight: _Flight):
+        with self._lock:
+            flight.waiters -= 1
+            if flight.waiters or flight.done:
+                return
+            # Nobody is reading any more; stop the call and let new requests start afresh
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+            self.cancelled += 1
+        with flight.changed:
+            flight.cancelled = True
+
+    def _count(self, name: str):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "coalesced": self.coalesced,
+                "cancelled": self.cancelled,
+                "timeouts": self.timeouts,
+                "in_flight": len(self._flights),
+            }
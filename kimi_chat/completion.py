@@ -0,0 +1,328 @@
+"""Chat completion calls shared by the app and the command-line tools"""
+
+import json
+import time
+from contextlib import nullcontext
+from typing import TYPE_CHECKING, Callable, Dict, Iterable, Iterator, List, Mapping, Optional, Tuple
+
+from kimi_chat.coalesce import CoalescedTimeout, RequestCoalescer, coalesce_key
+from kimi_chat.context import default_counter
+from kimi_chat.messages import ChatMessage, Role, encode_messages
+from kimi_chat.scheduler import RequestScheduler, SchedulerBusyError
+from kimi_chat.telemetry import estimate_cost
+from kimi_chat.tracing import default_tracer
+
+if TYPE_CHECKING:
+    import openai
+
+
+# Seconds a stopped reply waits for a shared call it cancelled to report its usage
+STOP_METRICS_TIMEOUT = 5.0
+
+# One shared record, so its token count and encoding are worked out once per process
+SYSTEM_MESSAGE = ChatMessage(Role.SYSTEM, "You are Kimi, an AI assistant created by Moonshot AI.")
+
+
+def build_api_messages(messages: List[Dict[str, str]]) -> List[Dict[str, str]]:
+    """Prepend the Kimi system message if the conversation doesn't have one"""
+    if not messages or messages[0].get("role") != "system":
+        messages = [SYSTEM_MESSAGE] + messages
+    return messages
+
+
+def chat_request_body(messages: Iterable[Mapping[str, str]], **params) -> bytes:
+    """JSON body for /chat/completions, with the messages encoded straight from the records
+
+    Given a dict body, the SDK checks and copies every message against its
+    request types first, which takes longer than the rest of the turn once
+    a chat runs to thousands of messages. The SDK sends bytes as they are.
+    """
+    encoded_params = json.dumps(params, ensure_ascii=False, separators=(",", ":"))
+    return ('{"messages":' + encode_messages(messages) + "," + encoded_params[1:]).encode("utf-8")
+
+
+def format_api_error(e: Exception) -> str:
+    """Turn an API exception into a markdown error message for the chat"""
+    import openai
+
+    if isinstance(e, openai.AuthenticationError):
+        error_msg = "**Authentication Error** ❌\n\n"
+        error_msg += "Your API key is invalid or not activated.\n\n"
+        error_msg += "**Troubleshooting Steps:**\n"
+        error_msg += "1. Verify your API key at [platform.moonshot.ai](https://platform.moonshot.ai)\n"
+        error_msg += "2. Ensure your account has credits (minimum $1)\n"
+        error_msg += "3. Check if the API key is active and not expired\n"
+        error_msg += "4. Try generating a new API key\n\n"
+        error_msg += f"_Error details: {str(e)}_"
+        return error_msg
+    if isinstance(e, SchedulerBusyError):
+        return f"**Server Busy** ⏳\n\n{str(e)}\n\nLots of people are chatting right now."
+    if isinstance(e, CoalescedTimeout):
+        return f"**Timed Out** ⏳\n\n{str(e)}"
+    # Connection and rate limit errors are APIError subclasses, so check them first
+    if isinstance(e, openai.APIConnectionError):
+        return f"**Connection Error** ❌\n\nCouldn't connect to Kimi AI servers.\n\n{str(e)}"
+    if isinstance(e, openai.RateLimitError):
+        return f"**Rate Limit Error** ❌\n\nYou've exceeded the rate limit.\n\n{str(e)}"
+    if isinstance(e, openai.APIError):
+        return f"**API Error** ❌\n\n{str(e)}\n\nPlease try again or contact support."
+    return f"**Unexpected Error** ❌\n\n{str(e)}"
+
+
+def chunk_usage(chunk) -> Optional[Tuple[Optional[int], Optional[int]]]:
+    """(prompt_tokens, completion_tokens) from a stream chunk, if it carries usage
+
+    Moonshot reports usage on the final choice of the stream rather than on
+    the chunk itself, so both places are checked.
+    """
+    usage = getattr(chunk, "usage", None)
+    if usage is None and chunk.choices:
+        usage = getattr(chunk.choices[0], "usage", None)
+    if isinstance(usage, dict):
+        return usage.get("prompt_tokens"), usage.get("completion_tokens")
+    if usage is not None:
+        return usage.prompt_tokens, usage.completion_tokens
+    return None
+
+
+def record_turn_metrics(metrics: Dict, mode: str, model: str, start: float,
+                        first_token_at: Optional[float], completion_tokens: int,
+                        error: bool = False, prompt_tokens: Optional[int] = None,
+                        built_at: Optional[float] = None, sent_at: Optional[float] = None):
+    """Fill in timing, token and cost metrics for a single chat turn
+
+    ``built_at`` is when the request was ready and ``sent_at`` when it got a
+    scheduler slot and went out, splitting the turn into build, queue and
+    network time. Network time is None for turns that never reached the API.
+    """
+    end = time.perf_counter()
+    built_at = built_at if built_at is not None else start
+    queued_from = sent_at if sent_at is not None else built_at
+    total = end - start
+    if first_token_at is None:
+        # Blocking responses arrive all at once, so the first token is the last one
+        first_token_at = end
+        generation_time = total
+    else:
+        generation_time = end - first_token_at
+    metrics.update({
+        "mode": mode,
+        "model": model,
+        "ttft": first_token_at - start,
+        "total": total,
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "tokens_per_sec": completion_tokens / generation_time if generation_time > 0 else 0.0,
+        "build": built_at - start,
+        "queue": queued_from - built_at,
+        "network": end - sent_at if sent_at is not None else None,
+        "cost": estimate_cost(model, prompt_tokens, completion_tokens),
+        "error": error,
+    })
+
+
+def schedule_request(scheduler: Optional[RequestScheduler], client: "openai.OpenAI",
+                     api_messages: List[Dict[str, str]], max_tokens: int):
+    """Admission slot for one request, or a no-op when unscheduled"""
+    if scheduler is None:
+        return nullcontext()
+    tokens = sum(default_counter.count_all(api_messages)) + max_tokens
+    return scheduler.slot(client.api_key, tokens)
+
+
+def post_completion(client: "openai.OpenAI", body: bytes, stream: bool):
+    """Send a prepared request body; returns what chat.completions.create would"""
+    import openai
+    from openai.types.chat import ChatCompletion, ChatCompletionChunk
+
+    return client.post("/chat/completions", body=body, cast_to=ChatCompletion, stream=stream,
+                       stream_cls=openai.Stream[ChatCompletionChunk])
+
+
+def create_completion(client: "openai.OpenAI", scheduler: Optional[RequestScheduler],
+                      messages: Iterable[Mapping[str, str]], **params):
+    """Create a chat completion, retried by the scheduler when one is given
+
+    The request body is encoded once, however many times it is retried.
+    """
+    with default_tracer.span("encode request"):
+        body = chat_request_body(messages, **params)
+    stream = params.get("stream", False)
+    if scheduler is None:
+        return post_completion(client, body, stream)
+    # The scheduler does its own backoff, so turn off the SDK's retries
+    unretried = client.with_options(max_retries=0)
+    return scheduler.call(lambda: post_completion(unretried, body, stream))
+
+
+def coalesced_deltas(coalescer: RequestCoalescer, client: "openai.OpenAI", messages: List[Dict[str, str]],
+                     model: str, temperature: float, max_tokens: int, metrics: Optional[Dict],
+                     produce: Callable[[Dict], Iterator[str]]) -> Iterator[str]:
+    """Deltas of the shared call for this request, starting it with ``produce`` if none is in flight
+
+    The session that started the call gets the call's own metrics; sessions
+    that joined it get "coalesced" metrics timed from when they joined, with
+    no cost, since they added no tokens.
+    """
+    start = time.perf_counter()
+    first_token_at = None
+    failed = False
+    stopped = False
+    key = coalesce_key(client.api_key, model, temperature, max_tokens, build_api_messages(messages))
+    subscription = coalescer.subscribe(key, produce)
+    deltas = iter(subscription)
+    try:
+        for delta in deltas:
+            if first_token_at is None:
+                first_token_at = time.perf_counter()
+            yield delta
+    except GeneratorExit:
+        stopped = True
+        raise
+    except Exception as e:
+        failed = True
+        yield format_api_error(e)
+    finally:
+        deltas.close()
+        if stopped and subscription.leader and subscription.cancelled:
+            # Stopping cancelled the shared call; let it wind down so its usage is still counted
+            subscription.wait(STOP_METRICS_TIMEOUT)
+        if metrics is not None:
+            shared = subscription.metrics
+            if subscription.leader and not failed and shared:
+                metrics.update(shared)
+            else:
+                record_turn_metrics(metrics, "coalesced", model, start, first_token_at,
+                                    shared.get("completion_tokens") or 0,
+                                    error=failed or (not stopped and shared.get("error", True)))
+                metrics["cost"] = 0.0
+            metrics["stopped"] = stopped
+
+
+def get_kimi_response(client: "openai.OpenAI", messages: List[Dict[str, str]], 
+                     model: str, temperature: float, max_tokens: int,
+                     metrics: Optional[Dict] = None,
+                     scheduler: Optional[RequestScheduler] = None,
+                     coalescer: Optional[RequestCoalescer] = None) -> str:
+    """Get response from Kimi AI API
+
+    With a coalescer, identical requests already in flight share one call.
+    """
+    if coalescer is not None:
+        produce = lambda shared_metrics: iter([
+            get_kimi_response(client, messages, model, temperature, max_tokens, shared_metrics, scheduler)
+        ])
+        return "".join(coalesced_deltas(coalescer, client, messages, model, temperature, max_tokens,
+                                        metrics, produce))
+    start = time.perf_counter()
+    built_at = sent_at = None
+    try:
+        api_messages = build_api_messages(messages)
+        built_at = time.perf_counter()
+        with schedule_request(scheduler, client, api_messages, max_tokens):
+            sent_at = time.perf_counter()
+            default_tracer.complete("wait for slot", built_at, sent_at)
+            response = create_completion(
+                client,
+                scheduler,
+                api_messages,
+                model=model,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                stream=False
+            )
+        content = response.choices[0].message.content
+        default_tracer.complete("completion", start, model=model, stream=False)
+        if metrics is not None:
+            usage = response.usage
+            record_turn_metrics(metrics, "blocking", model, start, None,
+                                usage.completion_tokens if usage else 0,
+                                prompt_tokens=usage.prompt_tokens if usage else None,
+                                built_at=built_at, sent_at=sent_at)
+        return content
+    except Exception as e:
+        default_tracer.complete("completion", start, model=model, stream=False, error=type(e).__name__)
+        if metrics is not None:
+            record_turn_metrics(metrics, "blocking", model, start, None, 0, error=True,
+                                built_at=built_at, sent_at=sent_at)
+        return format_api_error(e)
+
+
+def stream_kimi_response(client: "openai.OpenAI", messages: List[Dict[str, str]],
+                         model: str, temperature: float, max_tokens: int,
+                         metrics: Optional[Dict] = None,
+                         scheduler: Optional[RequestScheduler] = None,
+                         coalescer: Optional[RequestCoalescer] = None) -> Iterator[str]:
+    """Stream response deltas from Kimi AI API as they arrive
+
+    Errors raised before or during the stream are yielded as a markdown error
+    message, so the caller always ends up with displayable text. With a
+    coalescer, identical requests already in flight share one stream.
+    """
+    if coalescer is not None:
+        produce = lambda shared_metrics: stream_kimi_response(
+            client, messages, model, temperature, max_tokens, shared_metrics, scheduler
+        )
+        yield from coalesced_deltas(coalescer, client, messages, model, temperature, max_tokens,
+                                    metrics, produce)
+        return
+    start = time.perf_counter()
+    first_token_at = None
+    chunk_count = 0
+    usage = None
+    received_text = False
+    failed = False
+    stopped = False
+    built_at = sent_at = None
+    try:
+        api_messages = build_api_messages(messages)
+        built_at = time.perf_counter()
+        # The slot is held until the stream is drained; only opening it is retried
+        with schedule_request(scheduler, client, api_messages, max_tokens):
+            sent_at = time.perf_counter()
+            default_tracer.complete("wait for slot", built_at, sent_at)
+            stream = create_completion(
+                client,
+                scheduler,
+                api_messages,
+                model=model,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                stream=True
+            )
+            # Closing the response when the caller stops reading early stops the rest being generated
+            with stream:
+                for chunk in stream:
+                    usage = chunk_usage(chunk) or usage
+                    if not chunk.choices or not chunk.choices[0].delta:
+                        continue
+                    delta = chunk.choices[0].delta.content
+                    if not delta:
+                        continue
+                    if first_token_at is None:
+                        first_token_at = time.perf_counter()
+                        default_tracer.instant("first token")
+                    chunk_count += 1
+                    received_text = True
+                    yield delta
+    except GeneratorExit:
+        stopped = True
+        raise
+    except Exception as e:
+        failed = True
+        error_msg = format_api_error(e)
+        if received_text:
+            error_msg = "\n\n---\n\n_Response interrupted._\n\n" + error_msg
+        yield error_msg
+    finally:
+        default_tracer.complete("completion", start, model=model, stream=True, chunks=chunk_count,
+                                stopped=stopped, failed=failed)
+        if metrics is not None:
+            # Fall back to one token per chunk when the server didn't report usage
+            prompt_tokens, completion_tokens = usage or (None, None)
+            if completion_tokens is None:
+                completion_tokens = chunk_count
+            record_turn_metrics(metrics, "stream", model, start, first_token_at, completion_tokens,
+                                error=failed, prompt_tokens=prompt_tokens,
+                                built_at=built_at, sent_at=sent_at)
+            metrics["stopped"] = stopped
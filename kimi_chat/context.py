@@ -0,0 +1,233 @@
+"""Token-budgeted context window selection for long conversations"""
+
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from kimi_chat.messages import ChatMessage, Role
+
+Message = Dict[str, str]
+
+# Context window sizes in tokens for the models offered in the app
+MODEL_CONTEXT_WINDOWS = {
+    "kimi-k2-turbo-preview": 262144,
+    "kimi-k2-0711-preview": 131072,
+    "kimi-k2-0905-preview": 262144,
+    "moonshot-v1-8k": 8192,
+    "moonshot-v1-32k": 32768,
+    "moonshot-v1-128k": 131072,
+}
+DEFAULT_CONTEXT_WINDOW = 8192
+
+# Role markers and separators the API adds around every message
+MESSAGE_OVERHEAD_TOKENS = 4
+
+_CJK_PATTERN = re.compile(r"[\u3000-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uff00-\uffef]")
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token estimate without a tokenizer
+
+    CJK characters are about one token each, everything else about four
+    characters per token.
+    """
+    cjk = len(_CJK_PATTERN.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+class TokenCounter:
+    """Count message tokens once and remember the result
+
+    Counts are cached by role and a SHA-1 digest of the content, so a
+    message is only tokenized the first time it is seen, no matter how many
+    turns it is resent on. Unlike hash(), the digest doesn't let two
+    different messages share a count, and the cache doesn't keep message
+    text alive after a session lets go of it. With the default estimate, ChatMessage records
+    keep their own count instead, skipping the lookup altogether.
+    """
+
+    def __init__(self, tokenize: Callable[[str], int] = estimate_tokens, max_entries: int = 50000):
+        self.tokenize = tokenize
+        self.max_entries = max_entries
+        self._cache: "OrderedDict[Tuple[str, bytes], int]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def count(self, message: Message) -> int:
+        if isinstance(message, ChatMessage) and self.tokenize is estimate_tokens:
+            # The estimate depends only on the content, which a record never changes
+            if message.tokens is None:
+                message.tokens = estimate_tokens(message.content) + MESSAGE_OVERHEAD_TOKENS
+            return message.tokens
+        content = message.get("content") or ""
+        key = (message.get("role", ""), hashlib.sha1(content.encode("utf-8", "surrogatepass")).digest())
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                return cached
+        tokens = self.tokenize(content) + MESSAGE_OVERHEAD_TOKENS
+        with self._lock:
+            self._cache[key] = tokens
+            if len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+        return tokens
+
+    def count_all(self, messages: Sequence[Message]) -> List[int]:
+        return [self.count(message) for message in messages]
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"entries": len(self._cache)}
+
+
+class ContextPolicy:
+    """Chooses which messages to send when the conversation exceeds the budget"""
+
+    name = "base"
+
+    def select(self, messages: List[Message], counts: List[int], budget: int,
+               counter: TokenCounter) -> List[Message]:
+        raise NotImplementedError
+
+
+def _newest_that_fit(messages: List[Message], counts: List[int], budget: int) -> int:
+    """Index of the oldest message in the longest suffix that fits the budget
+
+    The final message is always kept, even if it alone exceeds the budget.
+    """
+    used = 0
+    start = len(messages)
+    for i in range(len(messages) - 1, -1, -1):
+        if used + counts[i] > budget and start < len(messages):
+            break
+        used += counts[i]
+        start = i
+    return start
+
+
+class SlidingWindowPolicy(ContextPolicy):
+    """Keep only the newest messages that fit"""
+
+    name = "sliding_window"
+
+    def select(self, messages, counts, budget, counter):
+        return messages[_newest_that_fit(messages, counts, budget):]
+
+
+class PinnedSystemPolicy(ContextPolicy):
+    """Always keep the system prompt, then the newest messages that fit"""
+
+    name = "pinned_system"
+
+    def select(self, messages, counts, budget, counter):
+        if not messages or messages[0].get("role") != "system":
+            return SlidingWindowPolicy().select(messages, counts, budget, counter)
+        rest = messages[1:]
+        start = _newest_that_fit(rest, counts[1:], budget - counts[0])
+        return [messages[0]] + rest[start:]
+
+
+def truncate_summary(messages: List[Message], max_chars_per_message: int = 200) -> str:
+    """Cheap extractive summary: the start of each dropped message"""
+    lines = []
+    for message in messages:
+        content = " ".join((message.get("content") or "").split())
+        if len(content) > max_chars_per_message:
+            content = content[:max_chars_per_message].rstrip() + "…"
+        lines.append(f"{message.get('role', 'user')}: {content}")
+    return "\n".join(lines)
+
+
+class SummarizedPrefixPolicy(ContextPolicy):
+    """Replace the messages that don't fit with a single summary message
+
+    ``summarize`` takes the dropped messages and returns summary text. The
+    summary is kept to ``summary_ratio`` of the budget so the recent turns
+    still get most of the window.
+    """
+
+    name = "summarized_prefix"
+
+    def __init__(self, summarize: Callable[[List[Message]], str] = truncate_summary,
+                 summary_ratio: float = 0.25):
+        self.summarize = summarize
+        self.summary_ratio = summary_ratio
+
+    def select(self, messages, counts, budget, counter):
+        system: List[Message] = []
+        if messages and messages[0].get("role") == "system":
+            system = [messages[0]]
+            budget -= counts[0]
+            messages, counts = messages[1:], counts[1:]
+        summary_budget = int(budget * self.summary_ratio)
+        start = _newest_that_fit(messages, counts, budget - summary_budget)
+        if start == 0:
+            return system + messages
+        header = "Summary of the earlier conversation:"
+        # Keep the most recent summary lines that fit the summary's share
+        lines = self.summarize(messages[:start]).splitlines()
+        used = counter.tokenize(header) + MESSAGE_OVERHEAD_TOKENS
+        kept: List[str] = []
+        for line in reversed(lines):
+            used += counter.tokenize(line) + 1
+            if used > summary_budget:
+                break
+            kept.append(line)
+        if not kept:
+            return system + messages[start:]
+        summary = ChatMessage(Role.SYSTEM, "\n".join([header] + kept[::-1]))
+        return system + [summary] + messages[start:]
+
+
+# Shared by everything in the process, so a message is only counted once
+default_counter = TokenCounter()
+
+
+CONTEXT_POLICIES = {
+    "pinned_system": PinnedSystemPolicy,
+    "sliding_window": SlidingWindowPolicy,
+    "summarized_prefix": SummarizedPrefixPolicy,
+}
+
+CONTEXT_POLICY_LABELS = {
+    "pinned_system": "Keep system prompt + newest messages",
+    "sliding_window": "Newest messages only",
+    "summarized_prefix": "Summarize older messages",
+}
+
+
+class ContextWindowManager:
+    """Pick the messages that fit a model's context window minus max_tokens"""
+
+    def __init__(self, counter: Optional[TokenCounter] = None,
+                 context_windows: Optional[Dict[str, int]] = None,
+                 safety_margin: int = 256):
+        self.counter = counter or default_counter
+        self.context_windows = context_windows or MODEL_CONTEXT_WINDOWS
+        self.safety_margin = safety_margin
+
+    def budget(self, model: str, max_tokens: int) -> int:
+        window = self.context_windows.get(model, DEFAULT_CONTEXT_WINDOW)
+        return max(window - max_tokens - self.safety_margin, 0)
+
+    def select(self, messages: List[Message], model: str, max_tokens: int,
+               policy: Optional[ContextPolicy] = None,
+               stats: Optional[Dict] = None) -> List[Message]:
+        """Return the messages to send, never mutating ``messages``"""
+        policy = policy or PinnedSystemPolicy()
+        counts = self.counter.count_all(messages)
+        budget = self.budget(model, max_tokens)
+        total = sum(counts)
+        selected = messages if total <= budget else policy.select(messages, counts, budget, self.counter)
+        if stats is not None:
+            original_ids = {id(message) for message in messages}
+            stats.update({
+                "policy": policy.name,
+                "budget": budget,
+                "history_tokens": total,
+                "prompt_tokens": sum(self.counter.count_all(selected)),
+                "dropped_messages": len(messages) - sum(id(m) in original_ids for m in selected),
+            })
+        return selected
@@ -0,0 +1,454 @@
+"""Attached documents: chunking, memory-mapped search indexes and per-turn excerpts"""
+
+import hashlib
+import json
+import math
+import os
+import re
+import shutil
+import threading
+import uuid
+import zlib
+from collections import Counter, OrderedDict
+from dataclasses import dataclass
+from itertools import chain
+from typing import TYPE_CHECKING, Dict, List, Optional, Sequence, Tuple, Type
+
+from kimi_chat.context import estimate_tokens
+from kimi_chat.messages import ChatMessage, Role
+
+if TYPE_CHECKING:
+    import numpy as np
+
+Message = Dict[str, str]
+
+# File types the uploader accepts; anything else would need a parser
+DOCUMENT_TYPES = ["txt", "md", "markdown", "rst", "csv", "tsv", "json", "log", "html", "xml", "yaml", "yml",
+                  "py", "js", "ts", "java", "c", "cpp", "go", "rs", "sql"]
+
+EXCERPTS_PREAMBLE = (
+    "Excerpts from documents the user attached, most relevant first. Use them to answer when "
+    "they apply, and say so when they don't cover the question."
+)
+
+_PARAGRAPH_SPLIT = re.compile(r"\n\s*\n")
+_SENTENCE_SPLIT = re.compile(r"(?<=[.!?。！？])\s+")
+_TERM_PATTERN = re.compile(r"[a-z0-9]+|[\u3400-\u4dbf\u4e00-\u9fff]")
+
+
+@dataclass
+class RetrievalConfig:
+    """Where document indexes live and how much of a document each turn sends"""
+    path: str = os.path.join(".kimi", "documents")
+    index: str = "bm25"
+    top_k: int = 4
+    chunk_tokens: int = 300
+    chunk_overlap: int = 40
+    max_document_bytes: int = 20_000_000
+    max_open: int = 64
+
+    @classmethod
+    def from_env(cls) -> "RetrievalConfig":
+        return cls(
+            path=os.getenv("KIMI_DOCUMENTS_PATH", cls.path),
+            index=os.getenv("KIMI_RETRIEVAL_INDEX", cls.index).lower(),
+            top_k=int(os.getenv("KIMI_RETRIEVAL_TOP_K", cls.top_k)),
+            chunk_tokens=int(os.getenv("KIMI_CHUNK_TOKENS", cls.chunk_tokens)),
+            chunk_overlap=int(os.getenv("KIMI_CHUNK_OVERLAP", cls.chunk_overlap)),
+            max_document_bytes=int(os.getenv("KIMI_DOCUMENT_MAX_BYTES", cls.max_document_bytes)),
+            max_open=int(os.getenv("KIMI_DOCUMENTS_OPEN", cls.max_open)),
+        )
+
+
+def terms(text: str) -> List[str]:
+    """Lowercase words and digits, with each CJK character as its own term"""
+    return _TERM_PATTERN.findall(text.lower())
+
+
+def _split_long(text: str, max_tokens: int) -> List[str]:
+    """Cut text with no sentence breaks into pieces of at most about max_tokens"""
+    pieces = []
+    while estimate_tokens(text) > max_tokens:
+        cut = max(len(text) * max_tokens // estimate_tokens(text), 1)
+        pieces.append(text[:cut])
+        text = text[cut:]
+    return pieces + [text] if text else pieces
+
+
+def chunk_text(text: str, chunk_tokens: int = 300, overlap_tokens: int = 40) -> List[str]:
+    """Split a document into chunks of about ``chunk_tokens``
+
+    Chunks break between paragraphs where they can, then between sentences.
+    Each chunk starts with up to ``overlap_tokens`` from the end of the one
+    before, so a passage cut at a boundary is still found whole in one.
+    """
+    pieces: List[Tuple[str, int]] = []
+    for paragraph in _PARAGRAPH_SPLIT.split(text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if estimate_tokens(paragraph) <= chunk_tokens:
+            pieces.append((paragraph, estimate_tokens(paragraph)))
+            continue
+        for sentence in _SENTENCE_SPLIT.split(paragraph):
+            pieces += [(piece, estimate_tokens(piece)) for piece in _split_long(sentence, chunk_tokens)]
+
+    chunks = []
+    current: List[Tuple[str, int]] = []
+    used = 0
+    for piece, tokens in pieces:
+        if current and used + tokens > chunk_tokens:
+            chunks.append("\n".join(text for text, _ in current))
+            carried: List[Tuple[str, int]] = []
+            carried_tokens = 0
+            for previous in reversed(current):
+                if carried_tokens + previous[1] > overlap_tokens:
+                    break
+                carried.insert(0, previous)
+                carried_tokens += previous[1]
+            current, used = carried, carried_tokens
+        current.append((piece, tokens))
+        used += tokens
+    if current:
+        chunks.append("\n".join(text for text, _ in current))
+    return chunks
+
+
+class SearchIndex:
+    """Finds the chunks of one document that best match a query
+
+    ``build()`` runs once per document and writes the index into its own
+    directory as .npy arrays; opening it memory-maps them, so a query only
+    reads the pages it touches and an open index costs little memory.
+    """
+
+    name = "base"
+
+    @classmethod
+    def build(cls, chunks: Sequence[str], directory: str):
+        raise NotImplementedError
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def search(self, query: str, k: int) -> List[Tuple[int, float]]:
+        """Up to k (chunk number, score) pairs, best first; chunks sharing no terms are left out"""
+        raise NotImplementedError
+
+
+def _top_k(scores: "np.ndarray", k: int) -> List[Tuple[int, float]]:
+    import numpy as np
+
+    k = min(k, len(scores))
+    if k <= 0:
+        return []
+    best = np.argpartition(-scores, k - 1)[:k]
+    best = best[np.argsort(-scores[best], kind="stable")]
+    return [(int(i), float(scores[i])) for i in best if scores[i] > 0]
+
+
+class BM25Index(SearchIndex):
+    """Okapi BM25 over an inverted index
+
+    Postings are stored term by term: ``postings_ptr[t]`` to
+    ``postings_ptr[t + 1]`` are the chunks containing term t and how often.
+    A query touches only the postings of its own terms.
+    """
+
+    name = "bm25"
+    k1 = 1.2
+    b = 0.75
+
+    @classmethod
+    def build(cls, chunks, directory):
+        import numpy as np
+
+        vocab: Dict[str, int] = {}
+        chunk_ids: List[List[int]] = []
+        frequencies: List[List[int]] = []
+        lengths = np.empty(len(chunks), dtype=np.float32)
+        for chunk_id, chunk in enumerate(chunks):
+            counts = Counter(terms(chunk))
+            lengths[chunk_id] = sum(counts.values())
+            for term, count in counts.items():
+                term_id = vocab.setdefault(term, len(vocab))
+                if term_id == len(chunk_ids):
+                    chunk_ids.append([])
+                    frequencies.append([])
+                chunk_ids[term_id].append(chunk_id)
+                frequencies[term_id].append(count)
+        ptr = np.zeros(len(vocab) + 1, dtype=np.int64)
+        np.cumsum([len(ids) for ids in chunk_ids], out=ptr[1:])
+        np.save(os.path.join(directory, "postings_ptr.npy"), ptr)
+        np.save(os.path.join(directory, "postings_chunk.npy"),
+                np.fromiter(chain.from_iterable(chunk_ids), dtype=np.int32, count=int(ptr[-1])))
+        np.save(os.path.join(directory, "postings_tf.npy"),
+                np.fromiter(chain.from_iterable(frequencies), dtype=np.float32, count=int(ptr[-1])))
+        np.save(os.path.join(directory, "lengths.npy"), lengths)
+        with open(os.path.join(directory, "vocab.json"), "w", encoding="utf-8") as f:
+            json.dump(vocab, f, ensure_ascii=False)
+
+    def __init__(self, directory):
+        import numpy as np
+
+        super().__init__(directory)
+        with open(os.path.join(directory, "vocab.json"), encoding="utf-8") as f:
+            self.vocab: Dict[str, int] = json.load(f)
+        self.ptr = np.load(os.path.join(directory, "postings_ptr.npy"), mmap_mode="r")
+        self.chunk_ids = np.load(os.path.join(directory, "postings_chunk.npy"), mmap_mode="r")
+        self.frequencies = np.load(os.path.join(directory, "postings_tf.npy"), mmap_mode="r")
+        self.lengths = np.load(os.path.join(directory, "lengths.npy"), mmap_mode="r")
+        self.average_length = float(self.lengths.mean()) if len(self.lengths) else 0.0
+
+    def search(self, query, k):
+        import numpy as np
+
+        count = len(self.lengths)
+        scores = np.zeros(count, dtype=np.float32)
+        for term in set(terms(query)):
+            term_id = self.vocab.get(term)
+            if term_id is None:
+                continue
+            start, end = int(self.ptr[term_id]), int(self.ptr[term_id + 1])
+            chunk_ids = self.chunk_ids[start:end]
+            frequency = self.frequencies[start:end]
+            idf = math.log(1 + (count - (end - start) + 0.5) / (end - start + 0.5))
+            norm = self.k1 * (1 - self.b + self.b * self.lengths[chunk_ids] / self.average_length)
+            scores[chunk_ids] += idf * frequency * (self.k1 + 1) / (frequency + norm)
+        return _top_k(scores, k)
+
+
+def hashed_embeddings(texts: Sequence[str], dimensions: int = 1024) -> "np.ndarray":
+    """Log-scaled term counts hashed into a fixed number of dimensions; needs no model
+
+    Terms are hashed with CRC32 rather than hash(), which changes between
+    processes, so vectors saved by one process match queries in another.
+    """
+    import numpy as np
+
+    vectors = np.zeros((len(texts), dimensions), dtype=np.float32)
+    for row, text in enumerate(texts):
+        for term, count in Counter(terms(text)).items():
+            bucket = zlib.crc32(term.encode("utf-8"))
+            vectors[row, bucket % dimensions] += (1.0 + math.log(count)) * (1 if bucket & 0x80000000 else -1)
+    return vectors
+
+
+def _unit(vectors: "np.ndarray") -> "np.ndarray":
+    import numpy as np
+
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+class VectorIndex(SearchIndex):
+    """Cosine similarity over one embedding per chunk, in a memory-mapped matrix
+
+    ``embed`` turns texts into vectors. The default hashes term counts and
+    needs no model; with ``idf_weighting`` each dimension is then weighted
+    by how rare it is among the chunks, as in TF-IDF, so words found all
+    over the document stop deciding the ranking. To use an embedding
+    model, subclass, override ``embed``, turn ``idf_weighting`` off and
+    register the subclass in INDEX_TYPES under its own ``name``.
+    """
+
+    name = "vector"
+    idf_weighting = True
+
+    @staticmethod
+    def embed(texts: Sequence[str]) -> "np.ndarray":
+        return hashed_embeddings(texts)
+
+    @classmethod
+    def build(cls, chunks, directory):
+        import numpy as np
+
+        vectors = np.asarray(cls.embed(chunks), dtype=np.float32)
+        weights = np.ones(vectors.shape[1], dtype=np.float32)
+        if cls.idf_weighting:
+            weights = np.log((1 + len(chunks)) / (1 + np.count_nonzero(vectors, axis=0))).astype(np.float32)
+        np.save(os.path.join(directory, "weights.npy"), weights)
+        np.save(os.path.join(directory, "vectors.npy"), _unit(vectors * weights))
+
+    def __init__(self, directory):
+        import numpy as np
+
+        super().__init__(directory)
+        self.weights = np.load(os.path.join(directory, "weights.npy"))
+        self.vectors = np.load(os.path.join(directory, "vectors.npy"), mmap_mode="r")
+
+    def search(self, query, k):
+        return _top_k(self.vectors @ _unit(self.embed([query])[0] * self.weights), k)
+
+
+INDEX_TYPES: Dict[str, Type[SearchIndex]] = {index.name: index for index in (BM25Index, VectorIndex)}
+
+
+@dataclass
+class Document:
+    """An attached document, as indexed on disk"""
+    id: str
+    name: str
+    chunks: int
+    tokens: int
+
+
+@dataclass
+class Excerpt:
+    """One chunk of a document picked for a turn"""
+    document: str
+    chunk: int
+    score: float
+    text: str
+
+
+class _OpenDocument:
+    """A document's chunk text and search index, memory-mapped"""
+
+    def __init__(self, directory: str, index: SearchIndex):
+        import numpy as np
+
+        self.offsets = np.load(os.path.join(directory, "offsets.npy"), mmap_mode="r")
+        self.text = np.memmap(os.path.join(directory, "text.bin"), dtype=np.uint8, mode="r")
+        self.index = index
+
+    def chunk(self, number: int) -> str:
+        start, end = int(self.offsets[number]), int(self.offsets[number + 1])
+        return self.text[start:end].tobytes().decode("utf-8")
+
+
+class DocumentLibrary:
+    """Documents attached to chats, indexed once and shared by every session
+
+    Each document is stored under a hash of its text, so the same document
+    attached twice, by any session, is chunked and indexed once; its
+    indexes outlive the process. Up to ``max_open`` documents are kept open
+    at a time, least recently searched closed first.
+    """
+
+    def __init__(self, config: Optional[RetrievalConfig] = None,
+                 index_types: Optional[Dict[str, Type[SearchIndex]]] = None):
+        self.config = config or RetrievalConfig()
+        self.index_types = index_types or INDEX_TYPES
+        if self.config.index not in self.index_types:
+            raise ValueError(f"Unknown KIMI_RETRIEVAL_INDEX '{self.config.index}'; "
+                             f"use {' or '.join(self.index_types)}")
+        self.index_type = self.index_types[self.config.index]
+        os.makedirs(self.config.path, exist_ok=True)
+        self._open: "OrderedDict[str, _OpenDocument]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self.built = 0
+        self.reused = 0
+        self.searches = 0
+
+    def _directory(self, document_id: str) -> str:
+        return os.path.join(self.config.path, document_id)
+
+    def add(self, name: str, text: str) -> Document:
+        """Chunk and index a document, or pick up the index already built for the same text"""
+        data = text.encode("utf-8")
+        if len(data) > self.config.max_document_bytes:
+            raise ValueError(f"{name} is larger than {self.config.max_document_bytes:,} bytes")
+        document_id = hashlib.sha256(data).hexdigest()[:32]
+        directory = self._directory(document_id)
+        with self._build_lock:
+            if not os.path.exists(os.path.join(directory, "document.json")):
+                self._build_text(document_id, name, text)
+            index_directory = os.path.join(directory, self.index_type.name)
+            if os.path.isdir(index_directory):
+                self.reused += 1
+            else:
+                self._build_index(document_id, index_directory)
+                self.built += 1
+        with open(os.path.join(directory, "document.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        return Document(document_id, name, meta["chunks"], meta["tokens"])
+
+    def _build_text(self, document_id: str, name: str, text: str):
+        import numpy as np
+
+        chunks = chunk_text(text, self.config.chunk_tokens, self.config.chunk_overlap)
+        if not chunks:
+            raise ValueError(f"{name} has no text to search")
+        # Written under a temporary name and renamed, so a half-built document is never opened
+        building = self._directory(f"{document_id}.{uuid.uuid4().hex}.tmp")
+        os.makedirs(building)
+        encoded = [chunk.encode("utf-8") for chunk in chunks]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(chunk) for chunk in encoded], out=offsets[1:])
+        with open(os.path.join(building, "text.bin"), "wb") as f:
+            f.writelines(encoded)
+        np.save(os.path.join(building, "offsets.npy"), offsets)
+        with open(os.path.join(building, "document.json"), "w", encoding="utf-8") as f:
+            json.dump({"name": name, "chunks": len(chunks), "tokens": estimate_tokens(text)}, f)
+        try:
+            os.replace(building, self._directory(document_id))
+        except OSError:
+            # Another process built the same document first
+            shutil.rmtree(building, ignore_errors=True)
+            if not os.path.isdir(self._directory(document_id)):
+                raise
+
+    def _build_index(self, document_id: str, index_directory: str):
+        document = self._load(document_id)
+        building = f"{index_directory}.{uuid.uuid4().hex}.tmp"
+        os.makedirs(building)
+        try:
+            self.index_type.build([document.chunk(i) for i in range(len(document.offsets) - 1)], building)
+            os.replace(building, index_directory)
+        except OSError:
+            if not os.path.isdir(index_directory):
+                raise
+        finally:
+            shutil.rmtree(building, ignore_errors=True)
+
+    def _load(self, document_id: str, index: Optional[SearchIndex] = None) -> _OpenDocument:
+        return _OpenDocument(self._directory(document_id), index)
+
+    def _get_open(self, document_id: str) -> _OpenDocument:
+        with self._lock:
+            document = self._open.get(document_id)
+            if document is not None:
+                self._open.move_to_end(document_id)
+                return document
+        index = self.index_type(os.path.join(self._directory(document_id), self.index_type.name))
+        document = self._load(document_id, index)
+        with self._lock:
+            self._open[document_id] = document
+            while len(self._open) > self.config.max_open:
+                self._open.popitem(last=False)
+        return document
+
+    def search(self, documents: Sequence[Document], query: str, k: Optional[int] = None) -> List[Excerpt]:
+        """The k chunks across ``documents`` that best match the query, best first"""
+        k = k or self.config.top_k
+        found = []
+        for document in documents:
+            opened = self._get_open(document.id)
+            found += [(score, document.name, number, opened) for number, score in opened.index.search(query, k)]
+        found.sort(key=lambda hit: hit[0], reverse=True)
+        with self._lock:
+            self.searches += 1
+        return [Excerpt(name, number, score, opened.chunk(number)) for score, name, number, opened in found[:k]]
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"open": len(self._open), "built": self.built, "reused": self.reused, "searches": self.searches}
+
+
+def excerpts_message(excerpts: Sequence[Excerpt]) -> ChatMessage:
+    """One system message carrying the excerpts, labelled with where each came from"""
+    parts = [f"[{excerpt.document}, part {excerpt.chunk + 1}]\n{excerpt.text}" for excerpt in excerpts]
+    return ChatMessage(Role.SYSTEM, "\n\n".join([EXCERPTS_PREAMBLE] + parts))
+
+
+def with_excerpts(messages: List[Message], excerpts: Sequence[Excerpt]) -> List[Message]:
+    """The messages with the excerpts placed just before the latest one
+
+    There they are among the newest messages, which every context policy
+    keeps, and they never enter the stored chat history.
+    """
+    if not excerpts:
+        return messages
+    return list(messages[:-1]) + [excerpts_message(excerpts)] + list(messages[-1:])
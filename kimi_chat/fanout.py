@@ -0,0 +1,87 @@
+"""Sends one prompt to several models at once, each streaming on its own worker thread"""
+
+import contextvars
+import queue
+import threading
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Tuple
+
+from kimi_chat.completion import stream_kimi_response
+from kimi_chat.scheduler import RequestScheduler
+from kimi_chat.tracing import default_tracer
+
+if TYPE_CHECKING:
+    import openai
+
+Message = Dict[str, str]
+DeltaCallback = Callable[[str, str], None]
+
+
+@dataclass
+class ModelResult:
+    """Outcome of one model's completion in a fan-out
+
+    ``content`` ends with a markdown error message if the call failed, as a
+    streamed reply does; ``metrics`` are filled in by record_turn_metrics.
+    """
+    model: str
+    content: str = ""
+    metrics: Dict = field(default_factory=dict)
+
+    @property
+    def latency(self) -> float:
+        return self.metrics.get("total", 0.0)
+
+    @property
+    def completion_tokens(self) -> int:
+        return self.metrics.get("completion_tokens") or 0
+
+
+def fan_out(client: "openai.OpenAI", models: List[str], messages: List[Message],
+            temperature: float, max_tokens: int,
+            on_delta: Optional[DeltaCallback] = None,
+            scheduler: Optional[RequestScheduler] = None) -> List[ModelResult]:
+    """Query every model concurrently; results are in the order of ``models``
+
+    Each model's call goes through ``stream_kimi_response`` on the pooled
+    client, so it waits for a scheduler slot and is retried like any other
+    request. ``on_delta(model, text_so_far)`` runs on the calling thread,
+    which the Streamlit script needs to redraw; if it raises, the remaining
+    streams are closed, so the server stops generating them.
+    """
+    results = [ModelResult(model=model) for model in models]
+    # (model, text so far) as each model's reply grows, then None once it has finished
+    updates: "queue.Queue[Optional[Tuple[str, str]]]" = queue.Queue()
+    stop = threading.Event()
+
+    def run(result: ModelResult):
+        deltas = None
+        try:
+            with default_tracer.thread_profile():
+                deltas = stream_kimi_response(client, messages, result.model, temperature, max_tokens,
+                                              metrics=result.metrics, scheduler=scheduler)
+                for delta in deltas:
+                    if stop.is_set():
+                        break
+                    result.content += delta
+                    updates.put((result.model, result.content))
+        finally:
+            if deltas is not None:
+                deltas.close()
+            updates.put(None)
+
+    for index, result in enumerate(results):
+        # Each worker carries the caller's context, so its spans and profile join the caller's turn
+        context = contextvars.copy_context()
+        threading.Thread(target=context.run, args=(run, result), name=f"kimi-fan-out-{index}", daemon=True).start()
+    try:
+        running = len(results)
+        while running:
+            update = updates.get()
+            if update is None:
+                running -= 1
+            elif on_delta is not None:
+                on_delta(*update)
+    finally:
+        stop.set()
+    return results
@@ -0,0 +1,75 @@
+"""Replies generated on a worker thread, so the UI can stop them early"""
+
+import contextvars
+import threading
+from typing import Callable, Dict, Iterator, List, Optional
+
+from kimi_chat.tracing import default_tracer
+
+# Starts the reply; fills the given metrics dict as record_turn_metrics does
+DeltaSource = Callable[[Dict], Iterator[str]]
+
+
+class Generation:
+    """One reply being streamed on its own thread
+
+    The Streamlit script polls ``text`` to show progress and can move on to
+    other runs while the reply is produced. ``cancel()`` freezes the text
+    at what has arrived so far; the worker then stops reading and closes
+    the delta iterator, which closes the HTTP stream so the server stops
+    generating. ``metrics`` is filled in by the source once the worker has
+    finished, including after a cancel.
+    """
+
+    def __init__(self, source: DeltaSource):
+        self.metrics: Dict = {}
+        self._parts: List[str] = []
+        self._lock = threading.Lock()
+        self._cancelled = False
+        self._done = threading.Event()
+        # The worker carries the caller's context, so its spans and profile join the caller's turn
+        context = contextvars.copy_context()
+        threading.Thread(target=context.run, args=(self._run, source), name="kimi-generation", daemon=True).start()
+
+    def _run(self, source: DeltaSource):
+        try:
+            with default_tracer.thread_profile():
+                self._read(source)
+        finally:
+            self._done.set()
+
+    def _read(self, source: DeltaSource):
+        deltas = None
+        try:
+            deltas = source(self.metrics)
+            for delta in deltas:
+                with self._lock:
+                    if self._cancelled:
+                        break
+                    self._parts.append(delta)
+        finally:
+            if deltas is not None and hasattr(deltas, "close"):
+                deltas.close()
+
+    @property
+    def text(self) -> str:
+        with self._lock:
+            return "".join(self._parts)
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled
+
+    @property
+    def done(self) -> bool:
+        return self._done.is_set()
+
+    def cancel(self) -> str:
+        """Stop the reply; returns the text it stopped at"""
+        with self._lock:
+            self._cancelled = True
+            return "".join(self._parts)
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Wait for the worker to finish; returns whether it has"""
+        return self._done.wait(timeout)
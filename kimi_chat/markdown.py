@@ -0,0 +1,357 @@
+"""Markdown to escaped HTML for chat messages, converted a line at a time as a reply streams in"""
+
+import html
+import re
+from functools import lru_cache
+from typing import List, Optional, Tuple
+
+_FENCE = re.compile(r"[ \t]*(`{3,}|~{3,})[ \t]*([\w+#.-]*)")
+_RULE = re.compile(r" {0,3}([-*_])(?:[ \t]*\1){2,}[ \t]*$")
+_HEADING = re.compile(r" {0,3}(#{1,6})(?:[ \t]+(.*?))?[ \t]*$")
+_QUOTE = re.compile(r" {0,3}> ?(.*)$")
+_ITEM = re.compile(r"([ \t]*)([-*+]|(\d{1,9})[.)])(?:[ \t]+(.*))?$")
+_TABLE_DIVIDER = re.compile(r"[ \t]*\|?(?:[ \t]*:?-+:?[ \t]*\|)*[ \t]*:?-+:?[ \t]*\|?[ \t]*$")
+
+_CODE_SPAN = re.compile(r"(`+)(.+?)\1")
+_LINK = re.compile(r"\[([^\]\n]+)\]\(\s*<?([^\s()<>]+(?:\([^\s()<>]*\))?)>?(?:\s+\"[^\"]*\")?\s*\)")
+_AUTOLINK = re.compile(r"<?(https?://[^\s<>\x00]*[^\s<>\x00.,:;\"')\]!?])>?")
+_STRONG = re.compile(r"\*\*(?=\S)(.+?)(?<=\S)\*\*|(?<!\w)__(?=\S)(.+?)(?<=\S)__(?!\w)")
+_EMPHASIS = re.compile(r"(?<![\w*])\*(?=[^\s*])(.+?)(?<=[^\s*])\*(?![\w*])|(?<!\w)_(?=[^\s_])(.+?)(?<=[^\s_])_(?!\w)")
+_STRIKE = re.compile(r"~~(?=\S)(.+?)(?<=\S)~~")
+_STASHED = re.compile(r"\x00(\d+)\x00")
+
+# Links to anything else (javascript:, data:, ...) are shown as their text
+SAFE_URL_SCHEMES = ("http://", "https://", "mailto:")
+
+_CLOSING_TAGS = {"p": "</p>", "quote": "</blockquote>", "table": "</tbody></table>", "code": "</code></pre>"}
+
+# Newlines inside <pre> are written as character references, so a message's HTML never has
+# a blank line: st.markdown ends a raw HTML block at the first one and parses the rest as markdown
+_NEWLINE = "&#10;"
+
+# Line endings as markdown counts them; a bare \r ends a line too, so none reaches the HTML
+_LINE_BREAK = re.compile(r"\r\n|\r|\n")
+
+
+def _link(url: str, label: str) -> str:
+    if not url.lower().startswith(SAFE_URL_SCHEMES):
+        return label
+    return f'<a href="{html.escape(url)}" target="_blank" rel="noopener noreferrer">{label}</a>'
+
+
+def _emphasis(text: str) -> str:
+    text = _STRONG.sub(lambda m: f"<strong>{m.group(1) or m.group(2)}</strong>", text)
+    text = _EMPHASIS.sub(lambda m: f"<em>{m.group(1) or m.group(2)}</em>", text)
+    return _STRIKE.sub(r"<del>\1</del>", text)
+
+
+def render_inline(text: str) -> str:
+    """Escaped HTML for one line of text: code spans, links, emphasis and strikethrough"""
+    stash: List[str] = []
+
+    def keep(fragment: str) -> str:
+        stash.append(fragment)
+        return f"\x00{len(stash) - 1}\x00"
+
+    # Code spans and links are set aside first, so their text is escaped but not formatted
+    text = text.replace("\x00", "")
+    text = _CODE_SPAN.sub(lambda m: keep(f"<code>{html.escape(m.group(2))}</code>"), text)
+    text = _LINK.sub(lambda m: keep(_link(m.group(2), _emphasis(html.escape(m.group(1))))), text)
+    text = _AUTOLINK.sub(lambda m: keep(_link(m.group(1), html.escape(m.group(1)))), text)
+    text = _emphasis(html.escape(text))
+    # A link's label can hold a stashed code span, so restore until none are left
+    while "\x00" in text:
+        text = _STASHED.sub(lambda m: stash[int(m.group(1))], text)
+    return text
+
+
+@lru_cache(maxsize=1)
+def _formatter():
+    from pygments.formatters import HtmlFormatter
+
+    # Inline styles, so highlighted blocks need nothing from the stylesheet
+    return HtmlFormatter(nowrap=True, noclasses=True, style="default")
+
+
+@lru_cache(maxsize=512)
+def highlight_code(code: str, language: str) -> str:
+    """Escaped HTML for a finished code block, syntax-highlighted when Pygments knows the language
+
+    Cached by (code, language): a block is highlighted once when its fence
+    closes, and again never, however often the message is redrawn.
+    """
+    if language:
+        try:
+            from pygments import highlight
+            from pygments.lexers import get_lexer_by_name
+            from pygments.util import ClassNotFound
+        except ImportError:
+            pass
+        else:
+            try:
+                lexer = get_lexer_by_name(language, stripnl=False)
+            except ClassNotFound:
+                pass
+            else:
+                return highlight(code, lexer, _formatter()).rstrip("\n").replace("\n", _NEWLINE)
+    return html.escape(code).replace("\n", _NEWLINE)
+
+
+def _cells(row: str) -> List[str]:
+    row = row.strip()
+    if row.startswith("|"):
+        row = row[1:]
+    if row.endswith("|") and not row.endswith("\\|"):
+        row = row[:-1]
+    return [cell.strip().replace("\\|", "|") for cell in re.split(r"(?<!\\)\|", row)]
+
+
+class MarkdownRenderer:
+    """Markdown to escaped HTML for one message, fed its text as it grows
+
+    Handles what chat replies use: paragraphs, headings, nested lists,
+    block quotes, pipe tables, rules and fenced code, plus inline code,
+    emphasis and links. Every character of the text is escaped, so HTML in
+    a message shows as text, and links only keep safe schemes.
+
+    Text is converted a line at a time. Once a line ends, its HTML is final
+    and kept; each ``update`` converts only the lines that ended since the
+    last one, plus the unfinished last line as a preview. Redrawing a reply
+    on every token therefore costs about the same at its 4,000th token as
+    at its 10th. A code block is shown escaped while it streams, then
+    replaced by its highlighted HTML when its closing fence arrives.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """Forget everything converted so far"""
+        # HTML of finished lines; the last block's part may still be replaced (code, tables)
+        self._parts: List[str] = []
+        # The first _joined parts, joined; no later line can change them
+        self._done = ""
+        self._joined = 0
+        self._consumed = 0
+        # Innermost open block: "p", "quote", "table", "code", "item" (a list item's text) or None
+        self._block: Optional[str] = None
+        # Open lists, outermost first, as (tag, indent)
+        self._lists: List[Tuple[str, int]] = []
+        # Marker, language and indent of the open code fence, and its lines so far
+        self._fence: Optional[Tuple[str, str, int]] = None
+        self._code: List[str] = []
+        # Where the open block's HTML starts in _parts
+        self._mark = 0
+        # First line of the open paragraph and its line count, to spot a table header
+        self._paragraph: Tuple[str, int] = ("", 0)
+        self._align: List[str] = []
+
+    def update(self, text: str) -> str:
+        """HTML for ``text``, which extends the text of the previous call (or starts over when shorter)"""
+        if len(text) < self._consumed:
+            self.reset()
+        # A \r at the very end may be the first half of \r\n, so its line waits for the next character
+        end = max(text.rfind("\n", self._consumed), text.rfind("\r", self._consumed, len(text) - 1)) + 1
+        if end > self._consumed:
+            for line in _LINE_BREAK.split(text[self._consumed:end])[:-1]:
+                self._line(line)
+            self._consumed = end
+        return self._preview(text[self._consumed:])
+
+    def render(self, text: str) -> str:
+        """HTML for a finished message, from scratch; a code block left open is highlighted too"""
+        self.reset()
+        lines = _LINE_BREAK.split(text)
+        if not lines[-1]:
+            lines.pop()
+        for line in lines:
+            self._line(line)
+        self._close_all()
+        return "".join(self._parts)
+
+    def _html(self) -> str:
+        return self._done + "".join(self._parts[self._joined:]) + self._closing_tags()
+
+    def _preview(self, tail: str) -> str:
+        # Only an open paragraph, table or code block can still be replaced, from its start
+        stable = self._mark if self._block in ("p", "table", "code") else len(self._parts)
+        if stable > self._joined:
+            self._done += "".join(self._parts[self._joined:stable])
+            self._joined = stable
+        if not tail:
+            return self._html()
+        # Convert the unfinished line as if it had ended, then put every piece of state back
+        saved = (self._block, list(self._lists), self._fence, self._code, len(self._code), self._mark,
+                 self._parts[self._mark:], self._paragraph, self._align)
+        try:
+            self._line(tail)
+            return self._html()
+        finally:
+            (self._block, self._lists, self._fence, code, code_lines, mark,
+             block_parts, self._paragraph, self._align) = saved
+            del code[code_lines:]
+            self._code = code
+            del self._parts[mark:]
+            self._parts.extend(block_parts)
+            self._mark = mark
+
+    def _closing_tags(self) -> str:
+        return _CLOSING_TAGS.get(self._block, "") + "".join(f"</li></{tag}>" for tag, _ in reversed(self._lists))
+
+    def _close_block(self):
+        if self._block == "code":
+            self._end_code()
+        elif self._block is not None and self._block != "item":
+            self._parts.append(_CLOSING_TAGS[self._block])
+        self._block = "item" if self._lists else None
+
+    def _close_all(self):
+        self._close_block()
+        self._parts.extend(f"</li></{tag}>" for tag, _ in reversed(self._lists))
+        self._lists = []
+        self._block = None
+
+    def _open(self, block: str, html_start: str):
+        self._mark = len(self._parts)
+        self._parts.append(html_start)
+        self._block = block
+
+    def _line(self, line: str):
+        line = line.rstrip("\r")
+        if self._fence is not None:
+            self._code_line(line)
+            return
+        if not line.strip():
+            # A blank line ends a block, but a list carries on if the next line belongs to it
+            if self._lists:
+                self._close_block()
+            else:
+                self._close_all()
+            return
+        fence = _FENCE.match(line)
+        # A backtick fence's info string has no backticks; ```x``` on one line is a code span
+        if fence and not (fence.group(1)[0] == "`" and "`" in line[fence.end(1):]):
+            indent = len(line) - len(line.lstrip())
+            if self._lists and indent > 0:
+                self._close_block()
+            else:
+                self._close_all()
+                indent = 0
+            language = fence.group(2)
+            self._fence = (fence.group(1), language, indent)
+            self._code = []
+            self._open("code", f'<pre><code class="language-{language}">' if language else "<pre><code>")
+            return
+        if _RULE.match(line):
+            self._close_all()
+            self._parts.append("<hr>")
+            return
+        item = _ITEM.match(line)
+        if self._lists:
+            if item:
+                self._list_item(item)
+                return
+            if line[:1] in " \t":
+                self._close_block()
+                self._parts.append("<br>" + render_inline(line.strip()))
+                return
+            self._close_all()
+        heading = _HEADING.match(line)
+        if heading:
+            self._close_all()
+            level = len(heading.group(1))
+            text = re.sub(r"[ \t]+#+$", "", heading.group(2) or "")
+            self._parts.append(f"<h{level}>{render_inline(text)}</h{level}>")
+            return
+        quote = _QUOTE.match(line)
+        if quote:
+            if self._block == "quote":
+                self._parts.append("<br>" + render_inline(quote.group(1)))
+            else:
+                self._close_all()
+                self._open("quote", "<blockquote>" + render_inline(quote.group(1)))
+            return
+        if item:
+            self._close_all()
+            self._list_item(item)
+            return
+        if self._block == "table":
+            if "|" in line:
+                self._table_row(line, "td")
+                return
+            self._close_all()
+        if (self._block == "p" and self._paragraph[1] == 1 and "|" in line and "|" in self._paragraph[0]
+                and _TABLE_DIVIDER.match(line)):
+            self._start_table(line)
+            return
+        if self._block == "p":
+            self._paragraph = (self._paragraph[0], self._paragraph[1] + 1)
+            self._parts.append(" " + render_inline(line.strip()))
+            return
+        self._close_all()
+        self._paragraph = (line, 1)
+        self._open("p", "<p>" + render_inline(line.strip()))
+
+    def _list_item(self, item: re.Match):
+        self._close_block()
+        indent = len(item.group(1).expandtabs(4))
+        tag = "ol" if item.group(3) else "ul"
+        lists = self._lists
+        while lists and indent < lists[-1][1]:
+            self._parts.append(f"</li></{lists.pop()[0]}>")
+        if lists and indent == lists[-1][1] and tag != lists[-1][0]:
+            self._parts.append(f"</li></{lists.pop()[0]}>")
+        if lists and indent == lists[-1][1]:
+            self._parts.append("</li>")
+        else:
+            start = int(item.group(3)) if item.group(3) else 1
+            self._parts.append(f'<{tag} start="{start}">' if start != 1 else f"<{tag}>")
+            lists.append((tag, indent))
+        self._parts.append("<li>" + render_inline(item.group(4) or ""))
+        self._block = "item"
+
+    def _code_line(self, line: str):
+        marker, _, indent = self._fence
+        stripped = line.strip()
+        if len(stripped) >= len(marker) and stripped == marker[0] * len(stripped):
+            self._end_code()
+            self._block = "item" if self._lists else None
+            return
+        if indent and line[:indent].isspace():
+            line = line[indent:]
+        self._parts.append((_NEWLINE if self._code else "") + html.escape(line))
+        self._code.append(line)
+
+    def _end_code(self):
+        _, language, _ = self._fence
+        del self._parts[self._mark + 1:]
+        self._parts.append(highlight_code("\n".join(self._code), language) + "</code></pre>")
+        self._fence = None
+        self._code = []
+
+    def _start_table(self, divider: str):
+        header = self._paragraph[0]
+        self._align = []
+        for cell in _cells(divider):
+            if cell.startswith(":") and cell.endswith(":"):
+                self._align.append(' style="text-align: center"')
+            elif cell.endswith(":"):
+                self._align.append(' style="text-align: right"')
+            else:
+                self._align.append("")
+        del self._parts[self._mark:]
+        self._open("table", "<table><thead>")
+        self._table_row(header, "th")
+        self._parts.append("</thead><tbody>")
+
+    def _table_row(self, row: str, cell_tag: str):
+        cells = "".join(
+            f"<{cell_tag}{self._align[i] if i < len(self._align) else ''}>{render_inline(cell)}</{cell_tag}>"
+            for i, cell in enumerate(_cells(row))
+        )
+        self._parts.append(f"<tr>{cells}</tr>")
+
+
+def markdown_to_html(text: str) -> str:
+    """Escaped HTML for a finished message"""
+    return MarkdownRenderer().render(text)
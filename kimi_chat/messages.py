@@ -0,0 +1,123 @@
+"""Compact chat message records and the history list that holds them"""
+
+from collections.abc import Mapping
+from enum import Enum
+from json.encoder import encode_basestring
+from typing import Iterable, Iterator, Optional, Union
+
+
+class Role(Enum):
+    SYSTEM = "system"
+    USER = "user"
+    ASSISTANT = "assistant"
+
+
+_ROLES = {role.value: role for role in Role}
+_KEYS = ("role", "content")
+
+
+class ChatMessage(Mapping):
+    """One chat message, in four slots instead of a dict
+
+    Reads like the ``{"role": ..., "content": ...}`` dict it replaces, so
+    code that takes message dicts takes it unchanged. The role is a shared
+    ``Role`` member rather than a string per message. ``tokens`` and
+    ``html`` start empty and are filled in by the token counter and the
+    renderer the first time they need them; records aren't edited after
+    they are created, so neither goes stale.
+    """
+
+    __slots__ = ("role", "content", "tokens", "html")
+
+    def __init__(self, role: Union[Role, str], content: str):
+        if not isinstance(role, Role):
+            try:
+                role = _ROLES[role]
+            except KeyError:
+                raise ValueError(f"Unknown message role {role!r}") from None
+        self.role = role
+        self.content = content
+        self.tokens: Optional[int] = None
+        self.html: Optional[str] = None
+
+    @classmethod
+    def of(cls, message: Mapping) -> "ChatMessage":
+        """``message`` itself if it is already a record, otherwise a record copied from the dict"""
+        return message if isinstance(message, cls) else cls(message["role"], message["content"])
+
+    def __getitem__(self, key: str) -> str:
+        if key == "content":
+            return self.content
+        if key == "role":
+            return self.role.value
+        raise KeyError(key)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(_KEYS)
+
+    def __len__(self) -> int:
+        return 2
+
+    def __reduce__(self):
+        # Pickle just the message; the cached values are rebuilt on demand
+        return ChatMessage, (self.role.value, self.content)
+
+    def __repr__(self) -> str:
+        return f"ChatMessage({self.role.value!r}, {self.content!r})"
+
+
+class ChatHistory(list):
+    """A chat's messages, held as ChatMessage records
+
+    A plain list underneath, so appending, indexing and slicing cost what
+    they do on a list. Messages added in any form are stored as records,
+    and slices are ChatHistory too, so a trimmed history stays compact.
+    """
+
+    __slots__ = ()
+
+    def __init__(self, messages: Iterable[Mapping] = ()):
+        super().__init__(map(ChatMessage.of, messages))
+
+    @classmethod
+    def _wrap(cls, records: list) -> "ChatHistory":
+        history = cls()
+        list.extend(history, records)
+        return history
+
+    def __getitem__(self, index):
+        item = super().__getitem__(index)
+        return self._wrap(item) if isinstance(index, slice) else item
+
+    def __setitem__(self, index, value):
+        if isinstance(index, slice):
+            value = map(ChatMessage.of, value)
+        else:
+            value = ChatMessage.of(value)
+        super().__setitem__(index, value)
+
+    def __iadd__(self, messages: Iterable[Mapping]) -> "ChatHistory":
+        self.extend(messages)
+        return self
+
+    def append(self, message: Mapping):
+        super().append(ChatMessage.of(message))
+
+    def extend(self, messages: Iterable[Mapping]):
+        super().extend(map(ChatMessage.of, messages))
+
+    def insert(self, index: int, message: Mapping):
+        super().insert(index, ChatMessage.of(message))
+
+    def copy(self) -> "ChatHistory":
+        return self._wrap(self)
+
+
+def encode_messages(messages: Iterable[Mapping]) -> str:
+    """The messages as the API's JSON array, written in one pass with no per-message dicts"""
+    # encode_basestring is what json.dumps uses for a str with ensure_ascii=False
+    return "[" + ",".join(
+        '{"role":' + encode_basestring(message["role"]) + ',"content":'
+        + encode_basestring(message["content"] or "") + "}"
+        for message in messages
+    ) + "]"
@@ -0,0 +1,28 @@
+"""Catalog of the Kimi AI models offered in the app"""
+
+DEFAULT_MODEL = "kimi-k2-turbo-preview"
+
+# Sidebar labels, in the order the models are offered
+MODEL_DESCRIPTIONS = {
+    "kimi-k2-turbo-preview": "⚡ Fastest - Best for quick responses (kimi-k2-turbo-preview)",
+    "kimi-k2-0711-preview": "🎯 Latest - Enhanced capabilities (kimi-k2-0711-preview)",
+    "kimi-k2-0905-preview": "🧠 Advanced - Superior reasoning (kimi-k2-0905-preview)",
+    "moonshot-v1-8k": "📝 Standard - 8K context (moonshot-v1-8k)",
+    "moonshot-v1-32k": "📚 Extended - 32K context (moonshot-v1-32k)",
+    "moonshot-v1-128k": "📖 Maximum - 128K context (moonshot-v1-128k)",
+}
+
+# Sidebar choice that lets the router pick a model for each request
+AUTO_MODEL = "auto"
+AUTO_DESCRIPTION = "✨ Auto - Picks the model for each message"
+
+# Quality tiers for routing, following the descriptions above: 1 is enough
+# for simple questions, 3 for hard reasoning and code
+MODEL_TIERS = {
+    "kimi-k2-turbo-preview": 2,
+    "kimi-k2-0711-preview": 2,
+    "kimi-k2-0905-preview": 3,
+    "moonshot-v1-8k": 1,
+    "moonshot-v1-32k": 1,
+    "moonshot-v1-128k": 1,
+}
@@ -0,0 +1,215 @@
+"""Connection warm-up and prefetched answers for the starter prompt buttons"""
+
+import hashlib
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Tuple
+
+from kimi_chat.cache import make_cache_key
+from kimi_chat.completion import get_kimi_response
+from kimi_chat.scheduler import RequestScheduler
+
+if TYPE_CHECKING:
+    import openai
+
+ClientFactory = Callable[[], "openai.OpenAI"]
+
+# (button label, prompt) for the buttons shown on an empty chat
+STARTER_PROMPTS: List[Tuple[str, str]] = [
+    ("📝 Write an email", "Help me write a professional email"),
+    ("💻 Explain code", "Explain what async/await means in programming"),
+    ("🎨 Creative ideas", "Give me creative project ideas"),
+]
+
+
+def temperature_bucket(temperature: float) -> float:
+    """Temperatures within 0.05 of each other share prefetched answers"""
+    return round(temperature * 10) / 10
+
+
+@dataclass
+class PrefetchConfig:
+    """What gets prefetched and how often it is refreshed; off unless asked for, since it spends tokens"""
+    enabled: bool = False
+    ttl: float = 6 * 3600.0
+    refresh_interval: float = 3600.0
+    check_interval: float = 60.0
+    workers: int = 2
+
+    @classmethod
+    def from_env(cls) -> "PrefetchConfig":
+        return cls(
+            enabled=os.getenv("KIMI_PREFETCH", "0").lower() not in ("0", "false", "no", "off"),
+            ttl=float(os.getenv("KIMI_PREFETCH_TTL", cls.ttl)),
+            refresh_interval=float(os.getenv("KIMI_PREFETCH_REFRESH", cls.refresh_interval)),
+        )
+
+
+@dataclass
+class PrefetchedAnswer:
+    content: str
+    latency: float
+    created_at: float
+
+
+@dataclass
+class _Target:
+    """A (key, model, temperature bucket, max tokens) combination someone is using"""
+    owner: str
+    model: str
+    temperature: float
+    max_tokens: int
+    client_factory: ClientFactory
+    last_seen: float
+
+
+class Prefetcher:
+    """Answers the starter prompts before anyone clicks them
+
+    ``warm()`` is called when a session shows the starter buttons. On a
+    worker thread it opens the pooled client's connection to the API, which
+    costs nothing and is always done. Only when prefetching is enabled does
+    it also generate any starter answers that are missing or due for a
+    refresh, and a background thread keeps refreshing answers for
+    combinations used within the last ``refresh_interval``. Answers are
+    scoped to the API key that paid for them.
+    """
+
+    def __init__(self, config: Optional[PrefetchConfig] = None,
+                 scheduler: Optional[RequestScheduler] = None,
+                 prompts: Optional[List[Tuple[str, str]]] = None):
+        self.config = config or PrefetchConfig()
+        self.scheduler = scheduler
+        self.prompts = [prompt for _, prompt in (prompts or STARTER_PROMPTS)]
+        self._executor = ThreadPoolExecutor(max_workers=self.config.workers, thread_name_prefix="kimi-prefetch")
+        self._answers: Dict[str, PrefetchedAnswer] = {}
+        self._pending = set()
+        self._targets: Dict[Tuple[str, str, float, int], _Target] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self.generated = 0
+        self.failures = 0
+        self.cost_usd = 0.0
+        self.hits = 0
+        self.misses = 0
+        # Also forgets stale combinations when prefetching is off, so their warmed connections can be reopened
+        threading.Thread(target=self._refresh_loop, name="kimi-prefetch-refresh", daemon=True).start()
+
+    @staticmethod
+    def _owner(api_key: str) -> str:
+        return hashlib.sha256(api_key.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _key(owner: str, prompt: str, model: str, temperature: float, max_tokens: int) -> str:
+        messages = [{"role": "user", "content": prompt}]
+        return owner + ":" + make_cache_key(model, temperature_bucket(temperature), max_tokens, messages)
+
+    def warm(self, api_key: str, client_factory: ClientFactory, model: str, temperature: float, max_tokens: int):
+        """Open a connection and, if enabled, fill in missing answers for this combination, without blocking"""
+        owner = self._owner(api_key)
+        target_key = (owner, model, temperature_bucket(temperature), max_tokens)
+        target = _Target(owner, model, temperature_bucket(temperature), max_tokens, client_factory, time.time())
+        with self._lock:
+            is_new = target_key not in self._targets
+            self._targets[target_key] = target
+        if is_new:
+            self._executor.submit(self._open_connection, client_factory)
+        if self.config.enabled:
+            self._fill(target)
+
+    def take(self, api_key: str, prompt: str, model: str, temperature: float,
+             max_tokens: int) -> Optional[PrefetchedAnswer]:
+        """The prefetched answer for a starter prompt click, if one is ready and fresh"""
+        if not self.config.enabled:
+            return None
+        key = self._key(self._owner(api_key), prompt, model, temperature, max_tokens)
+        with self._lock:
+            answer = self._answers.get(key)
+            if answer is not None and time.time() - answer.created_at > self.config.ttl:
+                answer = None
+            if answer is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return answer
+
+    def _open_connection(self, client_factory: ClientFactory):
+        # Builds the pooled client (importing the SDK) and completes TCP + TLS with the API
+        try:
+            client_factory().models.list()
+        except Exception:
+            pass
+
+    def _fill(self, target: _Target, older_than: Optional[float] = None):
+        """Queue generation of the target's answers that are missing or older than ``older_than`` seconds"""
+        now = time.time()
+        for prompt in self.prompts:
+            key = self._key(target.owner, prompt, target.model, target.temperature, target.max_tokens)
+            with self._lock:
+                answer = self._answers.get(key)
+                fresh = answer is not None and (older_than is None or now - answer.created_at < older_than)
+                if fresh or key in self._pending:
+                    continue
+                self._pending.add(key)
+            self._executor.submit(self._generate, key, target, prompt)
+
+    def _generate(self, key: str, target: _Target, prompt: str):
+        try:
+            metrics: Dict = {}
+            content = get_kimi_response(target.client_factory(), [{"role": "user", "content": prompt}],
+                                        target.model, target.temperature, target.max_tokens,
+                                        metrics=metrics, scheduler=self.scheduler)
+            with self._lock:
+                self.cost_usd += metrics["cost"]
+                if metrics["error"]:
+                    self.failures += 1
+                else:
+                    self.generated += 1
+                    self._answers[key] = PrefetchedAnswer(content, metrics["total"], time.time())
+        except Exception:
+            # Client construction failed; the click falls back to a live request
+            with self._lock:
+                self.failures += 1
+        finally:
+            with self._lock:
+                self._pending.discard(key)
+
+    def _refresh_loop(self):
+        while not self._stop.wait(self.config.check_interval):
+            now = time.time()
+            with self._lock:
+                # Forget combinations nobody has shown the starter buttons for lately
+                for target_key in [k for k, t in self._targets.items()
+                                   if now - t.last_seen > self.config.refresh_interval]:
+                    del self._targets[target_key]
+                active = list(self._targets.values())
+                live_owners = {target.owner for target in active}
+                for key in [k for k, a in self._answers.items()
+                            if now - a.created_at > self.config.ttl or k.split(":", 1)[0] not in live_owners]:
+                    del self._answers[key]
+            if not self.config.enabled:
+                continue
+            for target in active:
+                self._fill(target, older_than=self.config.refresh_interval)
+
+    def close(self):
+        self._stop.set()
+        self._executor.shutdown(wait=False)
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            clicks = self.hits + self.misses
+            return {
+                "enabled": self.config.enabled,
+                "answers": len(self._answers),
+                "pending": len(self._pending),
+                "generated": self.generated,
+                "failures": self.failures,
+                "cost_usd": self.cost_usd,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / clicks if clicks else 0.0,
+            }
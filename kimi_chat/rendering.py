@@ -0,0 +1,84 @@
+"""Memoized HTML rendering for chat messages, escaped and converted from markdown"""
+
+import os
+from functools import lru_cache
+from typing import Dict, List, Mapping, Sequence, Tuple
+
+from kimi_chat.markdown import MarkdownRenderer, markdown_to_html
+from kimi_chat.messages import ChatMessage
+
+_STYLES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "styles.css")
+
+_USER_TEMPLATE = """<div class="chat-message user-message">
+<div class="message-header">
+<span>👤</span>
+<span>You</span>
+</div>
+<div class="message-content">{content}</div>
+</div>"""
+
+_ASSISTANT_TEMPLATE = """<div class="chat-message assistant-message">
+<div class="message-header">
+<span>🤖</span>
+<span>Kimi AI</span>
+</div>
+<div class="message-content">{content}</div>
+</div>"""
+
+
+@lru_cache(maxsize=1)
+def page_styles() -> str:
+    """The app's stylesheet as a <style> block, read once per process"""
+    with open(_STYLES_PATH, encoding="utf-8") as f:
+        return f"<style>\n{f.read()}</style>"
+
+
+def _format_message(role: str, content: str) -> str:
+    template = _USER_TEMPLATE if role == "user" else _ASSISTANT_TEMPLATE
+    return template.format(content=markdown_to_html(content))
+
+
+@lru_cache(maxsize=8192)
+def render_message_html(role: str, content: str) -> str:
+    """Build the HTML block for a chat message
+
+    Results are cached by (role, content); Python caches string hashes, so a
+    repeat lookup for an unchanged message costs a dict probe.
+    """
+    return _format_message(role, content)
+
+
+def render_streaming_html(renderer: MarkdownRenderer, content: str) -> str:
+    """Build the HTML block for a reply still arriving, converting only what changed since the last redraw"""
+    return _ASSISTANT_TEMPLATE.format(content=renderer.update(content))
+
+
+def message_html(message: Mapping[str, str]) -> str:
+    """HTML block for one history message
+
+    A ChatMessage record keeps its own HTML, built the first time it is
+    shown, so records stay out of the shared cache.
+    """
+    if isinstance(message, ChatMessage):
+        if message.html is None:
+            message.html = _format_message(message["role"], message.content)
+        return message.html
+    return render_message_html(message["role"], message["content"])
+
+
+def render_history_html(messages: Sequence[Mapping[str, str]]) -> str:
+    """Render several messages as one HTML block for a single markdown element"""
+    return "\n\n".join(message_html(message) for message in messages)
+
+
+def visible_history(messages: List[Dict[str, str]], recent: int, page_size: int,
+                    pages_loaded: int) -> Tuple[List[Dict[str, str]], int]:
+    """Split history into the messages to render and the number still hidden
+
+    The last ``recent`` messages are always shown; each loaded page reveals
+    ``page_size`` older ones.
+    """
+    shown = recent + page_size * pages_loaded
+    if len(messages) <= shown:
+        return messages, 0
+    return messages[-shown:], len(messages) - shown
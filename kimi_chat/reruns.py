@@ -0,0 +1,81 @@
+"""Script runs and script time per user action, to keep Streamlit rerun churn measurable"""
+
+import threading
+from dataclasses import dataclass
+from typing import Dict, List
+
+# Name of the action behind a run that no widget callback claimed, such as opening the page
+PAGE_LOAD = "page load"
+
+
+@dataclass
+class ActionRuns:
+    """The script runs one user action caused
+
+    A full run executes the whole script; a partial run only the fragment
+    the action happened in. ``script_time`` covers every run, including
+    the time a reply spent streaming inside one.
+    """
+    action: str
+    full_runs: int = 0
+    partial_runs: int = 0
+    script_time: float = 0.0
+
+    @property
+    def runs(self) -> int:
+        return self.full_runs + self.partial_runs
+
+    def add(self, partial: bool, seconds: float):
+        if partial:
+            self.partial_runs += 1
+        else:
+            self.full_runs += 1
+        self.script_time += seconds
+
+
+class RunTracker:
+    """Process-wide script runs by the action that caused them
+
+    Sessions keep their own recent ``ActionRuns``; this adds every
+    session's into totals per action name, so operators can see what each
+    kind of click or message costs on average.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._actions: Dict[str, Dict[str, float]] = {}
+
+    def _totals(self, action: str) -> Dict[str, float]:
+        return self._actions.setdefault(action, {"actions": 0, "full_runs": 0, "partial_runs": 0, "script_time": 0.0})
+
+    def begin(self, action: str):
+        """Count a new user action; its runs follow through ``record()``"""
+        with self._lock:
+            self._totals(action)["actions"] += 1
+
+    def record(self, action: str, partial: bool, seconds: float):
+        with self._lock:
+            totals = self._totals(action)
+            totals["partial_runs" if partial else "full_runs"] += 1
+            totals["script_time"] += seconds
+
+    def action_stats(self) -> List[Dict]:
+        """Average runs and script time per action, most frequent action first"""
+        with self._lock:
+            rows = [{
+                "action": action,
+                "count": totals["actions"],
+                "full_runs": totals["full_runs"] / max(totals["actions"], 1),
+                "partial_runs": totals["partial_runs"] / max(totals["actions"], 1),
+                "script_time": totals["script_time"] / max(totals["actions"], 1),
+            } for action, totals in self._actions.items()]
+        return sorted(rows, key=lambda row: row["count"], reverse=True)
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                "actions": sum(totals["actions"] for totals in self._actions.values()),
+                "full_runs": sum(totals["full_runs"] for totals in self._actions.values()),
+                "partial_runs": sum(totals["partial_runs"] for totals in self._actions.values()),
+                "script_time": sum(totals["script_time"] for totals in self._actions.values()),
+            }
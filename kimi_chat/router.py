@@ -0,0 +1,321 @@
+"""Per-request model routing on live latency stats, behind the "Auto" model choice"""
+
+import logging
+import os
+import re
+import threading
+from collections import deque
+from dataclasses import dataclass
+from typing import Deque, Dict, List, Optional, Sequence, Tuple
+
+from kimi_chat.context import MODEL_CONTEXT_WINDOWS, TokenCounter, default_counter, estimate_tokens
+from kimi_chat.models import MODEL_TIERS
+from kimi_chat.telemetry import estimate_cost
+
+Message = Dict[str, str]
+
+logger = logging.getLogger(__name__)
+
+# (seconds to first token, tokens per second) assumed for a model until it has been measured
+LATENCY_PRIORS: Dict[str, Tuple[float, float]] = {
+    "kimi-k2-turbo-preview": (0.6, 60.0),
+    "kimi-k2-0711-preview": (1.2, 20.0),
+    "kimi-k2-0905-preview": (1.2, 20.0),
+    "moonshot-v1-8k": (0.5, 40.0),
+    "moonshot-v1-32k": (0.7, 35.0),
+    "moonshot-v1-128k": (1.0, 30.0),
+}
+DEFAULT_LATENCY_PRIOR = (1.5, 20.0)
+
+# Reply length expected for each class of request, in tokens, before max_tokens caps it
+EXPECTED_OUTPUT_TOKENS = {"simple": 200, "moderate": 600, "complex": 1500}
+
+# Lowest model tier (see MODEL_TIERS) that answers each class of request well
+REQUIRED_TIERS = {"simple": 1, "moderate": 2, "complex": 3}
+
+# Turn modes whose timings measure the model itself, rather than a cache or another session's call
+MEASURED_MODES = ("stream", "blocking", "compare")
+
+_CODE_BLOCK_PATTERN = re.compile(r"```")
+_CODE_PATTERN = re.compile(r"\b(def|class|function|return|import|SELECT|const|void)\b|[{};]\s*$", re.MULTILINE)
+_REASONING_PATTERN = re.compile(
+    r"\b(why|explain|analy[sz]e|compare|design|architect\w*|prove|derive|debug|refactor|optimi[sz]e|"
+    r"implement|algorithm|step[- ]by[- ]step|trade-?offs?)\b|为什么|分析|解释|比较|设计|证明|推导|优化",
+    re.IGNORECASE
+)
+
+
+@dataclass
+class RouterConfig:
+    """What the "Auto" model choice optimizes for
+
+    ``latency_target`` is the expected time for a whole reply; the cheapest
+    model good enough for the request that meets it is used, or the
+    fastest one when none does. Savings are measured against
+    ``baseline_model``, the model a user would pick to be safe.
+    """
+    latency_target: float = 15.0
+    baseline_model: str = "kimi-k2-0905-preview"
+    window: int = 50
+    min_samples: int = 3
+    log_decisions: bool = True
+
+    @classmethod
+    def from_env(cls) -> "RouterConfig":
+        return cls(
+            latency_target=float(os.getenv("KIMI_ROUTER_LATENCY_TARGET", cls.latency_target)),
+            baseline_model=os.getenv("KIMI_ROUTER_BASELINE", cls.baseline_model),
+            window=int(os.getenv("KIMI_ROUTER_WINDOW", cls.window)),
+            min_samples=int(os.getenv("KIMI_ROUTER_MIN_SAMPLES", cls.min_samples)),
+            log_decisions=os.getenv("KIMI_ROUTER_LOG", "1").lower() not in ("0", "false", "no", "off"),
+        )
+
+
+@dataclass
+class RequestProfile:
+    """What a request needs from a model"""
+    complexity: str
+    prompt_tokens: int
+    context_tokens: int
+    output_tokens: int
+
+
+def classify(prompt: str, context_tokens: int, max_tokens: int) -> RequestProfile:
+    """Sort a request into simple, moderate or complex
+
+    A cheap heuristic over the latest prompt: its length, code in it,
+    reasoning words ("why", "design", "debug", ...) and how many questions
+    it asks. ``context_tokens`` is the whole conversation plus the reply,
+    which decides the context window needed rather than the complexity.
+    """
+    prompt_tokens = estimate_tokens(prompt)
+    score = 0
+    if prompt_tokens > 150:
+        score += 1
+    if prompt_tokens > 1000:
+        score += 1
+    if _CODE_BLOCK_PATTERN.search(prompt):
+        score += 2
+    elif _CODE_PATTERN.search(prompt):
+        score += 1
+    score += min(len({word.lower() for word in _REASONING_PATTERN.findall(prompt)}), 2)
+    if prompt.count("?") + prompt.count("？") >= 3:
+        score += 1
+    complexity = "simple" if score <= 1 else "moderate" if score <= 3 else "complex"
+    return RequestProfile(complexity, prompt_tokens, context_tokens,
+                          min(EXPECTED_OUTPUT_TOKENS[complexity], max_tokens))
+
+
+@dataclass
+class RouteDecision:
+    """The model picked for one request, and what it was expected to save over the baseline"""
+    model: str
+    profile: RequestProfile
+    reason: str
+    expected_latency: float
+    expected_cost: float
+    baseline_model: str
+    baseline_latency: float
+    baseline_cost: float
+
+    @property
+    def expected_latency_saved(self) -> float:
+        return self.baseline_latency - self.expected_latency
+
+    @property
+    def expected_cost_saved(self) -> float:
+        return self.baseline_cost - self.expected_cost
+
+
+class ModelRouter:
+    """Picks the model for each "Auto" request from live per-model latency stats
+
+    Every measured turn, routed or not, feeds ``observe()``: the router
+    keeps each model's last ``window`` times to first token and generation
+    rates, and uses their medians once a model has ``min_samples`` of them,
+    priors before that. ``record()`` logs a routed turn once it finishes.
+    """
+
+    def __init__(self, config: Optional[RouterConfig] = None, models: Optional[Sequence[str]] = None,
+                 counter: Optional[TokenCounter] = None):
+        self.config = config or RouterConfig()
+        self.models = list(models or MODEL_TIERS)
+        self.counter = counter or default_counter
+        self._ttft: Dict[str, Deque[float]] = {}
+        self._rate: Dict[str, Deque[float]] = {}
+        self._lock = threading.Lock()
+        self.routed: Dict[str, int] = {}
+        # Routed turns whose time and cost saved could be measured, and what they saved
+        self.measured = 0
+        self.latency_saved = 0.0
+        self.cost_measured = 0
+        self.cost_saved = 0.0
+
+    def observe(self, metrics: Dict):
+        """Add one finished turn's timings, as recorded by record_turn_metrics"""
+        if metrics.get("mode") not in MEASURED_MODES or metrics.get("error"):
+            return
+        with self._lock:
+            if metrics.get("ttft") is not None:
+                self._ttft.setdefault(metrics["model"], deque(maxlen=self.config.window)).append(metrics["ttft"])
+            # Stopped or empty replies say little about how fast the model generates
+            if metrics.get("tokens_per_sec") and not metrics.get("stopped"):
+                self._rate.setdefault(metrics["model"], deque(maxlen=self.config.window)).append(
+                    metrics["tokens_per_sec"])
+
+    def latency_profile(self, model: str) -> Tuple[float, float, bool]:
+        """(seconds to first token, tokens per second, whether measured) for one model"""
+        prior_ttft, prior_rate = LATENCY_PRIORS.get(model, DEFAULT_LATENCY_PRIOR)
+        with self._lock:
+            ttft = sorted(self._ttft.get(model, ()))
+            rate = sorted(self._rate.get(model, ()))
+        measured_ttft = len(ttft) >= self.config.min_samples
+        measured_rate = len(rate) >= self.config.min_samples
+        return (ttft[len(ttft) // 2] if measured_ttft else prior_ttft,
+                rate[len(rate) // 2] if measured_rate else prior_rate,
+                measured_ttft and measured_rate)
+
+    def expected_latency(self, model: str, output_tokens: int) -> float:
+        ttft, rate, _ = self.latency_profile(model)
+        return ttft + output_tokens / rate
+
+    def _fits(self, model: str, context_tokens: int) -> bool:
+        return MODEL_CONTEXT_WINDOWS.get(model, 0) >= context_tokens
+
+    def route(self, messages: Sequence[Message], max_tokens: int) -> RouteDecision:
+        """Pick the model for a request, given the history it will be sent with"""
+        prompt = next((message["content"] for message in reversed(messages) if message["role"] == "user"), "")
+        context_tokens = sum(self.counter.count_all(messages)) + max_tokens
+        profile = classify(prompt, context_tokens, max_tokens)
+        required_tier = REQUIRED_TIERS[profile.complexity]
+
+        def cost(model: str) -> float:
+            return estimate_cost(model, context_tokens - max_tokens, profile.output_tokens)
+
+        def latency(model: str) -> float:
+            return self.expected_latency(model, profile.output_tokens)
+
+        fitting = [model for model in self.models if self._fits(model, context_tokens)]
+        adequate = [model for model in fitting if MODEL_TIERS.get(model, 0) >= required_tier]
+        if adequate:
+            on_target = [model for model in adequate if latency(model) <= self.config.latency_target]
+            if on_target:
+                model = min(on_target, key=lambda m: (cost(m), latency(m)))
+                reason = f"cheapest {profile.complexity}-capable model within {self.config.latency_target:g}s"
+            else:
+                model = min(adequate, key=latency)
+                reason = f"fastest {profile.complexity}-capable model; none within {self.config.latency_target:g}s"
+        elif fitting:
+            # Nothing good enough fits the conversation; the best model that does is the next best thing
+            model = max(fitting, key=lambda m: (MODEL_TIERS.get(m, 0), -latency(m)))
+            reason = "best model whose context window fits the conversation"
+        else:
+            # Too long for every window; the largest one keeps the most of it
+            model = max(self.models, key=lambda m: MODEL_CONTEXT_WINDOWS.get(m, 0))
+            reason = "largest context window; older messages will be trimmed"
+
+        baseline = self.config.baseline_model
+        if not self._fits(baseline, context_tokens):
+            baseline = max(self.models, key=lambda m: MODEL_CONTEXT_WINDOWS.get(m, 0))
+        return RouteDecision(model, profile, reason, latency(model), cost(model),
+                             baseline, latency(baseline), cost(baseline))
+
+    def measured_latency_saved(self, decision: RouteDecision, metrics: Dict) -> Optional[float]:
+        """Seconds the finished turn took less than the baseline model has been taking for a reply that long
+
+        None when the turn's own time says nothing about the model (a cache
+        hit, an error or a stop) or the baseline hasn't been measured yet.
+        """
+        if (metrics.get("mode") not in MEASURED_MODES or metrics.get("error") or metrics.get("stopped")
+                or metrics.get("total") is None):
+            return None
+        if decision.model == decision.baseline_model:
+            return 0.0
+        ttft, rate, measured = self.latency_profile(decision.baseline_model)
+        if not measured:
+            return None
+        return ttft + (metrics.get("completion_tokens") or 0) / rate - metrics["total"]
+
+    def measured_cost_saved(self, decision: RouteDecision, metrics: Dict) -> Optional[float]:
+        """USD the finished turn cost less than the baseline model would charge for the same tokens
+
+        None when the turn didn't reach the model (a cache hit) or failed.
+        A stopped turn still counts; the tokens it used were billed.
+        """
+        if metrics.get("mode") not in MEASURED_MODES or metrics.get("error") or metrics.get("cost") is None:
+            return None
+        baseline_cost = estimate_cost(decision.baseline_model, metrics.get("prompt_tokens"),
+                                      metrics.get("completion_tokens"))
+        return baseline_cost - metrics["cost"]
+
+    def record(self, decision: RouteDecision, metrics: Dict) -> Dict:
+        """Count and log a routed turn once it has finished; returns its summary for the turn metrics
+
+        ``latency_saved`` and ``cost_saved`` are measured: the turn's total
+        time against the baseline's observed latency, and its cost against
+        the baseline's price for the same tokens, or None when that can't be
+        told. The ``expected_*`` values are what the decision predicted.
+        """
+        latency_saved = self.measured_latency_saved(decision, metrics)
+        cost_saved = self.measured_cost_saved(decision, metrics)
+        summary = {
+            "model": decision.model,
+            "complexity": decision.profile.complexity,
+            "reason": decision.reason,
+            "baseline": decision.baseline_model,
+            "expected_latency": decision.expected_latency,
+            "expected_latency_saved": decision.expected_latency_saved,
+            "latency_saved": latency_saved,
+            "expected_cost_saved": decision.expected_cost_saved,
+            "cost_saved": cost_saved,
+        }
+        with self._lock:
+            self.routed[decision.model] = self.routed.get(decision.model, 0) + 1
+            if latency_saved is not None:
+                self.measured += 1
+                self.latency_saved += latency_saved
+            if cost_saved is not None:
+                self.cost_measured += 1
+                self.cost_saved += cost_saved
+        logger.info(
+            "routed %s request (%d prompt tokens, %d context tokens) to %s: %s; "
+            "expected %.2fs vs %.2fs on %s (%.2fs saved), took %.2fs in %s mode (%s and %s saved)",
+            decision.profile.complexity, decision.profile.prompt_tokens, decision.profile.context_tokens,
+            decision.model, decision.reason, decision.expected_latency, decision.baseline_latency,
+            decision.baseline_model, decision.expected_latency_saved, metrics.get("total", 0.0), metrics.get("mode"),
+            f"{latency_saved:.2f}s" if latency_saved is not None else "unmeasured time",
+            f"${cost_saved:.6f}" if cost_saved is not None else "unmeasured cost"
+        )
+        return summary
+
+    def model_stats(self) -> List[Dict]:
+        """Latency each model is routed on, with how often it has been picked"""
+        rows = []
+        for model in self.models:
+            ttft, rate, measured = self.latency_profile(model)
+            with self._lock:
+                samples = len(self._ttft.get(model, ()))
+                routed = self.routed.get(model, 0)
+            rows.append({"model": model, "tier": MODEL_TIERS.get(model, 0), "samples": samples,
+                         "ttft": ttft, "tokens_per_sec": rate, "measured": measured, "routed": routed})
+        return rows
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                "routed": sum(self.routed.values()),
+                "measured": self.measured,
+                "latency_saved": self.latency_saved,
+                "cost_measured": self.cost_measured,
+                "cost_saved": self.cost_saved,
+            }
+
+
+def log_to_stderr():
+    """Print routing decisions on stderr, for deployments that haven't configured logging"""
+    if not logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("%(asctime)s %(name)s %(message)s"))
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
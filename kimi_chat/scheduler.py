@@ -0,0 +1,272 @@
+"""Rate-limit-aware request scheduling with retries and backoff"""
+
+import email.utils
+import hashlib
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Callable, Dict, Iterator, Optional, TypeVar
+
+if TYPE_CHECKING:
+    from .shared import SharedBackend
+
+T = TypeVar("T")
+
+
+class SchedulerBusyError(Exception):
+    """Raised when a request can't get a slot before its queue timeout"""
+
+
+@dataclass
+class SchedulerConfig:
+    """Per-key rate limits, concurrency, queueing and retry settings"""
+    requests_per_minute: float = 200.0
+    tokens_per_minute: float = 2_000_000.0
+    max_concurrency: int = 50
+    max_queue: int = 100
+    queue_timeout: float = 30.0
+    max_retries: int = 3
+    backoff_base: float = 0.5
+    backoff_max: float = 20.0
+
+    @classmethod
+    def from_env(cls) -> "SchedulerConfig":
+        """Build a config from KIMI_RATE_* / KIMI_QUEUE_* / KIMI_*RETR* environment variables"""
+        defaults = cls()
+        return cls(
+            requests_per_minute=float(os.getenv("KIMI_RATE_RPM", defaults.requests_per_minute)),
+            tokens_per_minute=float(os.getenv("KIMI_RATE_TPM", defaults.tokens_per_minute)),
+            max_concurrency=int(os.getenv("KIMI_MAX_CONCURRENCY", defaults.max_concurrency)),
+            max_queue=int(os.getenv("KIMI_QUEUE_MAX", defaults.max_queue)),
+            queue_timeout=float(os.getenv("KIMI_QUEUE_TIMEOUT", defaults.queue_timeout)),
+            max_retries=int(os.getenv("KIMI_MAX_RETRIES", defaults.max_retries)),
+            backoff_base=float(os.getenv("KIMI_BACKOFF_BASE", defaults.backoff_base)),
+            backoff_max=float(os.getenv("KIMI_BACKOFF_MAX", defaults.backoff_max)),
+        )
+
+
+class TokenBucket:
+    """Classic token bucket refilled continuously at ``rate_per_minute``"""
+
+    def __init__(self, rate_per_minute: float, capacity: Optional[float] = None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity if capacity is not None else rate_per_minute
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self, amount: float) -> float:
+        """Take ``amount`` tokens; return 0 on success or seconds to wait otherwise"""
+        # A request bigger than the bucket can only ever wait for a full one
+        amount = min(amount, self.capacity)
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            if self.tokens >= amount:
+                self.tokens -= amount
+                return 0.0
+            return (amount - self.tokens) / self.rate if self.rate > 0 else float("inf")
+
+    def acquire(self, amount: float, deadline: float) -> float:
+        """Block until ``amount`` tokens are taken; return seconds spent waiting"""
+        waited = 0.0
+        while True:
+            wait = self.try_acquire(amount)
+            if wait == 0.0:
+                return waited
+            remaining = deadline - time.monotonic()
+            if wait > remaining:
+                raise SchedulerBusyError("Rate limit budget exhausted; try again shortly.")
+            time.sleep(wait)
+            waited += wait
+
+
+class SharedTokenBucket(TokenBucket):
+    """Token bucket kept in a shared backend, so every replica draws on the same budget"""
+
+    def __init__(self, backend: "SharedBackend", name: str, rate_per_minute: float,
+                 capacity: Optional[float] = None):
+        super().__init__(rate_per_minute, capacity)
+        self.backend = backend
+        self.name = name
+
+    def try_acquire(self, amount: float) -> float:
+        if amount <= 0:
+            return 0.0
+        return self.backend.take(self.name, min(amount, self.capacity), self.rate, self.capacity)
+
+
+class _KeyState:
+    """Limiter state shared by every request using one API key
+
+    With a shared backend the rate budgets are shared by every replica too;
+    concurrency slots and the queue stay per replica.
+    """
+
+    def __init__(self, config: SchedulerConfig, scale: int = 1,
+                 backend: Optional["SharedBackend"] = None, key: str = ""):
+        if backend is not None:
+            self.requests = SharedTokenBucket(backend, f"ratelimit:{key}:requests", config.requests_per_minute * scale)
+            self.tokens = SharedTokenBucket(backend, f"ratelimit:{key}:tokens", config.tokens_per_minute * scale)
+        else:
+            self.requests = TokenBucket(config.requests_per_minute * scale)
+            self.tokens = TokenBucket(config.tokens_per_minute * scale)
+        self.slots = threading.BoundedSemaphore(config.max_concurrency * scale)
+        self.waiting = 0
+        self.in_flight = 0
+
+
+def retry_after_seconds(error: Exception) -> Optional[float]:
+    """Read Retry-After (seconds or HTTP date) or retry-after-ms from an API error"""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms:
+        try:
+            return float(retry_after_ms) / 1000.0
+        except ValueError:
+            pass
+    retry_after = headers.get("retry-after")
+    if not retry_after:
+        return None
+    try:
+        return float(retry_after)
+    except ValueError:
+        parsed = email.utils.parsedate_to_datetime(retry_after)
+        return max(parsed.timestamp() - time.time(), 0.0) if parsed else None
+
+
+def is_retryable(error: Exception) -> bool:
+    """Transient failures worth retrying; quota and auth errors are not"""
+    import openai
+
+    if isinstance(error, openai.RateLimitError):
+        # Moonshot answers 429 for an empty balance too, which won't recover by waiting
+        body = error.body if isinstance(error.body, dict) else {}
+        return body.get("type") != "exceeded_current_quota_error"
+    return isinstance(error, (openai.APIConnectionError, openai.InternalServerError))
+
+
+class RequestScheduler:
+    """Queue, rate-limit and retry API calls per key, across all sessions
+
+    ``slot()`` admits a request: it waits (bounded by ``max_queue`` and
+    ``queue_timeout``) for one of the key's concurrency slots and for
+    request/token budget. ``call()`` runs a function with exponential
+    backoff and full jitter, honoring Retry-After on 429s. Given a shared
+    backend, the request and token budgets hold across replicas.
+    """
+
+    def __init__(self, config: Optional[SchedulerConfig] = None,
+                 backend: Optional["SharedBackend"] = None):
+        self.config = config or SchedulerConfig()
+        self.backend = backend
+        self._keys: Dict[str, _KeyState] = {}
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.retries = 0
+        self.throttles = 0
+        self.rejected = 0
+        self.queue_wait_total = 0.0
+        self.queue_wait_max = 0.0
+
+    def _state(self, api_key: str) -> _KeyState:
+        key = hashlib.sha256(api_key.encode("utf-8")).hexdigest()
+        with self._lock:
+            state = self._keys.get(key)
+            if state is None:
+                state = self._keys[key] = _KeyState(self.config, backend=self.backend, key=key)
+            return state
+
+    def scale_key(self, api_key: str, scale: int):
+        """Give one key ``scale`` times the configured limits, e.g. a pool of ``scale`` keys"""
+        key = hashlib.sha256(api_key.encode("utf-8")).hexdigest()
+        with self._lock:
+            self._keys[key] = _KeyState(self.config, scale, self.backend, key)
+
+    @contextmanager
+    def slot(self, api_key: str, tokens: int = 0) -> Iterator[None]:
+        """Hold one of the key's concurrency slots for the duration of a request"""
+        state = self._state(api_key)
+        start = time.monotonic()
+        deadline = start + self.config.queue_timeout
+        with self._lock:
+            if state.waiting >= self.config.max_queue:
+                self.rejected += 1
+                raise SchedulerBusyError("Too many requests are queued; try again shortly.")
+            state.waiting += 1
+        try:
+            acquired = state.slots.acquire(timeout=self.config.queue_timeout)
+        finally:
+            with self._lock:
+                state.waiting -= 1
+        if not acquired:
+            with self._lock:
+                self.rejected += 1
+            raise SchedulerBusyError("Timed out waiting for a free request slot.")
+        try:
+            throttled = state.requests.acquire(1, deadline) + state.tokens.acquire(tokens, deadline)
+        except SchedulerBusyError:
+            state.slots.release()
+            with self._lock:
+                self.rejected += 1
+            raise
+        waited = time.monotonic() - start
+        with self._lock:
+            self.requests += 1
+            self.throttles += throttled > 0
+            self.queue_wait_total += waited
+            self.queue_wait_max = max(self.queue_wait_max, waited)
+            state.in_flight += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                state.in_flight -= 1
+            state.slots.release()
+
+    def backoff(self, attempt: int, error: Exception) -> float:
+        """Delay before retry ``attempt`` (1-based)"""
+        retry_after = retry_after_seconds(error)
+        if retry_after is not None:
+            return min(retry_after, self.config.backoff_max)
+        ceiling = min(self.config.backoff_max, self.config.backoff_base * (2 ** (attempt - 1)))
+        return random.uniform(0, ceiling)
+
+    def call(self, fn: Callable[[], T]) -> T:
+        """Run ``fn``, retrying transient API errors with backoff"""
+        attempt = 0
+        while True:
+            try:
+                return fn()
+            except Exception as e:
+                attempt += 1
+                if attempt > self.config.max_retries or not is_retryable(e):
+                    raise
+                with self._lock:
+                    self.retries += 1
+                    self.throttles += getattr(e, "status_code", None) == 429
+                time.sleep(self.backoff(attempt, e))
+
+    def stats(self) -> Dict[str, float]:
+        """Counters for retries, throttles and queue wait time"""
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "retries": self.retries,
+                "throttles": self.throttles,
+                "rejected": self.rejected,
+                "queue_wait_avg": self.queue_wait_total / self.requests if self.requests else 0.0,
+                "queue_wait_max": self.queue_wait_max,
+                "in_flight": sum(state.in_flight for state in self._keys.values()),
+                "queued": sum(state.waiting for state in self._keys.values()),
+            }
@@ -0,0 +1,230 @@
+"""Per-session memory accounting, caps and an idle-session sweeper"""
+
+import os
+import sys
+import threading
+import time
+import weakref
+from dataclasses import dataclass
+from typing import Callable, Dict, List, MutableMapping, Optional, Sequence
+
+from kimi_chat.context import TokenCounter, default_counter
+
+Message = Dict[str, str]
+
+# Trims one idle session's state down to the newest ``keep`` messages; returns how many it dropped
+TrimFunction = Callable[[MutableMapping, int], int]
+
+# Session state key holding the session's _SessionHandle
+HANDLE_KEY = "_kimi_session_handle"
+
+
+@dataclass
+class SessionLimitsConfig:
+    """How much chat history a session may hold in memory, and when it counts as idle"""
+    max_messages: int = 200
+    max_bytes: int = 2_000_000
+    idle_timeout: float = 1800.0
+    idle_keep_messages: int = 20
+    sweep_interval: float = 60.0
+
+    @classmethod
+    def from_env(cls) -> "SessionLimitsConfig":
+        return cls(
+            max_messages=int(os.getenv("KIMI_SESSION_MAX_MESSAGES", cls.max_messages)),
+            max_bytes=int(os.getenv("KIMI_SESSION_MAX_BYTES", cls.max_bytes)),
+            idle_timeout=float(os.getenv("KIMI_SESSION_IDLE_TIMEOUT", cls.idle_timeout)),
+            idle_keep_messages=int(os.getenv("KIMI_SESSION_IDLE_KEEP", cls.idle_keep_messages)),
+            sweep_interval=float(os.getenv("KIMI_SESSION_SWEEP_INTERVAL", cls.sweep_interval)),
+        )
+
+
+def message_bytes(message: Message) -> int:
+    """Memory held by one message: its record or dict, its content and any cached HTML
+
+    Roles and the dict keys are shared by every message, so they aren't
+    counted.
+    """
+    size = sys.getsizeof(message) + sys.getsizeof(message.get("content") or "")
+    html = getattr(message, "html", None)
+    return size + sys.getsizeof(html) if html is not None else size
+
+
+def messages_over_limit(messages: Sequence[Message], max_messages: int, max_bytes: int) -> int:
+    """How many of the oldest messages to drop to fit both caps, always keeping the newest"""
+    drop = max(len(messages) - max_messages, 0)
+    total = sum(message_bytes(message) for message in messages[drop:])
+    while total > max_bytes and drop < len(messages) - 1:
+        total -= message_bytes(messages[drop])
+        drop += 1
+    return drop
+
+
+def process_rss_bytes() -> int:
+    """Resident set size of this process; peak RSS where /proc isn't available"""
+    try:
+        with open("/proc/self/status", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    import resource
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class _SessionHandle:
+    """Lives in a session's own state and points back at it
+
+    The registry only holds a weak reference to the handle, so when
+    Streamlit drops a closed session the handle goes with it.
+    """
+
+    def __init__(self):
+        self.state: Optional[MutableMapping] = None
+
+    def __getstate__(self):
+        # Session state may be pickled; the handle only means something inside this process
+        return {"state": None}
+
+
+@dataclass
+class SessionAccount:
+    """Memory accounting for one browser session"""
+    session_id: str
+    messages: int = 0
+    message_bytes: int = 0
+    tokens: int = 0
+    has_client: bool = False
+    last_active: float = 0.0
+    trimmed: int = 0
+    idle_trimmed: bool = False
+
+
+class SessionRegistry:
+    """Memory accounting for every session in the process, plus an idle sweeper
+
+    Sessions report in with ``touch()`` at the start of each script run.
+    A daemon thread trims sessions that have been idle for ``idle_timeout``
+    down to their newest ``idle_keep_messages`` messages with the app's
+    ``trim`` function. Sessions are tracked through a handle stored in
+    their own state, so sessions Streamlit has closed drop out on the next
+    sweep.
+    """
+
+    def __init__(self, config: Optional[SessionLimitsConfig] = None, trim: Optional[TrimFunction] = None,
+                 counter: Optional[TokenCounter] = None):
+        self.config = config or SessionLimitsConfig()
+        self.trim = trim
+        self.counter = counter or default_counter
+        self._accounts: Dict[str, SessionAccount] = {}
+        self._handles: Dict[str, "weakref.ref[_SessionHandle]"] = {}
+        self._lock = threading.Lock()
+        self.sweeps = 0
+        self.idle_trims = 0
+        self.messages_trimmed = 0
+        self._stop = threading.Event()
+        if self.trim is not None:
+            threading.Thread(target=self._sweep_loop, name="kimi-session-sweeper", daemon=True).start()
+
+    def touch(self, session_id: str, state: MutableMapping, messages: Sequence[Message],
+              has_client: bool) -> SessionAccount:
+        """Record a session's current history and mark it active
+
+        ``state`` is the session's state for this run, which the sweeper may
+        later trim from its own thread.
+        """
+        size = sum(message_bytes(message) for message in messages)
+        tokens = sum(self.counter.count_all(messages))
+        if HANDLE_KEY not in state:
+            state[HANDLE_KEY] = _SessionHandle()
+        handle = state[HANDLE_KEY]
+        handle.state = state
+        with self._lock:
+            account = self._accounts.get(session_id)
+            if account is None:
+                account = self._accounts[session_id] = SessionAccount(session_id)
+            self._handles[session_id] = weakref.ref(handle)
+            account.messages = len(messages)
+            account.message_bytes = size
+            account.tokens = tokens
+            account.has_client = has_client
+            account.last_active = time.monotonic()
+            account.idle_trimmed = False
+            return account
+
+    def record_trim(self, session_id: str, count: int):
+        """Count messages a session dropped from memory to stay under its caps"""
+        with self._lock:
+            account = self._accounts.get(session_id)
+            if account is not None:
+                account.trimmed += count
+            self.messages_trimmed += count
+
+    def forget(self, session_id: str):
+        with self._lock:
+            self._accounts.pop(session_id, None)
+            self._handles.pop(session_id, None)
+
+    def sweep(self) -> int:
+        """Trim every idle session once; returns how many were trimmed"""
+        now = time.monotonic()
+        trimmed = 0
+        with self._lock:
+            self.sweeps += 1
+            for session_id in list(self._accounts):
+                account = self._accounts[session_id]
+                handle = self._handles[session_id]()
+                if handle is None or handle.state is None:
+                    del self._accounts[session_id], self._handles[session_id]
+                    continue
+                state = handle.state
+                if account.idle_trimmed or now - account.last_active < self.config.idle_timeout:
+                    continue
+                # Under the lock, so a session starting a run waits in touch() until this is done
+                try:
+                    dropped = self.trim(state, self.config.idle_keep_messages)
+                except Exception:
+                    continue
+                account.idle_trimmed = True
+                account.trimmed += dropped
+                self.messages_trimmed += dropped
+                kept = state["messages"]
+                account.messages = len(kept)
+                account.message_bytes = sum(message_bytes(message) for message in kept)
+                account.tokens = sum(self.counter.count_all(kept))
+                trimmed += 1
+            self.idle_trims += trimmed
+        return trimmed
+
+    def _sweep_loop(self):
+        while not self._stop.wait(self.config.sweep_interval):
+            self.sweep()
+
+    def close(self):
+        self._stop.set()
+
+    def accounts(self) -> List[SessionAccount]:
+        """Accounts of live sessions, largest first"""
+        with self._lock:
+            return sorted((SessionAccount(**vars(account)) for account in self._accounts.values()),
+                          key=lambda account: account.message_bytes, reverse=True)
+
+    def stats(self) -> Dict[str, float]:
+        now = time.monotonic()
+        with self._lock:
+            accounts = list(self._accounts.values())
+            return {
+                "sessions": len(accounts),
+                "idle": sum(now - account.last_active >= self.config.idle_timeout for account in accounts),
+                "messages": sum(account.messages for account in accounts),
+                "message_bytes": sum(account.message_bytes for account in accounts),
+                "tokens": sum(account.tokens for account in accounts),
+                "with_client": sum(account.has_client for account in accounts),
+                "sweeps": self.sweeps,
+                "idle_trims": self.idle_trims,
+                "messages_trimmed": self.messages_trimmed,
+            }
@@ -0,0 +1,338 @@
+"""State shared by every replica of the app: cached responses, rate-limit buckets and conversations"""
+
+import math
+import os
+import random
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Dict, Iterator, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    import redis
+
+# Refill a bucket and take from it in one step, on the Redis server's clock so replicas on
+# different hosts agree on how much has refilled. Returns the wait as a string, since Redis
+# truncates Lua numbers to integers.
+TOKEN_BUCKET_SCRIPT = """
+local now = redis.call('TIME')
+now = tonumber(now[1]) + tonumber(now[2]) / 1000000
+local amount, rate, capacity = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1]) or capacity
+local updated = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(now - updated, 0) * rate)
+local wait = 0
+if tokens >= amount then
+    tokens = tokens - amount
+elseif rate > 0 then
+    wait = (amount - tokens) / rate
+else
+    wait = -1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+return tostring(wait)
+"""
+
+
+def bucket_ttl(rate: float, capacity: float) -> int:
+    """Seconds after which an untouched bucket is full again and can be forgotten"""
+    return int(math.ceil(capacity / rate)) + 60 if rate > 0 else 24 * 3600
+
+
+class SharedBackend:
+    """Where replicas keep the state they have to agree on
+
+    A small, Redis-shaped set of operations on string values: keys with an
+    optional lifetime, append-only lists, sorted sets, and an atomic token
+    bucket. A SQLite file stands in for replicas on one host; a Redis
+    server serves replicas on several. Ranges are half-open, like slices.
+    """
+
+    name = "shared"
+
+    def __init__(self):
+        self._stats_lock = threading.Lock()
+        self.operations = 0
+        self.busy_time = 0.0
+
+    @contextmanager
+    def _timed(self) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._stats_lock:
+                self.operations += 1
+                self.busy_time += elapsed
+
+    def get(self, key: str) -> Optional[str]:
+        raise NotImplementedError
+
+    def set(self, key: str, value: str, ttl: Optional[float] = None):
+        raise NotImplementedError
+
+    def delete(self, *keys: str):
+        raise NotImplementedError
+
+    def rpush(self, key: str, value: str) -> int:
+        """Append to a list; returns its new length"""
+        raise NotImplementedError
+
+    def lrange(self, key: str, start: int, end: int) -> List[str]:
+        raise NotImplementedError
+
+    def llen(self, key: str) -> int:
+        raise NotImplementedError
+
+    def zadd(self, key: str, member: str, score: float):
+        raise NotImplementedError
+
+    def zrevrange(self, key: str, start: int, end: int) -> List[Tuple[str, float]]:
+        """Members and scores, highest score first"""
+        raise NotImplementedError
+
+    def zrem(self, key: str, member: str):
+        raise NotImplementedError
+
+    def take(self, bucket: str, amount: float, rate: float, capacity: float) -> float:
+        """Refill ``bucket`` at ``rate`` per second and take ``amount``; return 0 or seconds to wait"""
+        raise NotImplementedError
+
+    def stats(self) -> Dict[str, float]:
+        with self._stats_lock:
+            return {
+                "backend": self.name,
+                "operations": self.operations,
+                "avg_ms": 1000 * self.busy_time / self.operations if self.operations else 0.0,
+            }
+
+
+class SQLiteBackend(SharedBackend):
+    """Shared state in one SQLite file, for replicas running on the same host
+
+    WAL journaling lets readers in every process run alongside the single
+    writer; writes that read first (list appends, bucket takes) start with
+    ``BEGIN IMMEDIATE`` so two processes can't interleave them. Buckets
+    use wall-clock time, which every process on the host agrees on.
+    """
+
+    name = "sqlite"
+    # Expired keys are swept on roughly one write in this many
+    PURGE_EVERY = 256
+
+    def __init__(self, path: str):
+        super().__init__()
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._local = threading.local()
+        self._db().executescript(
+            """
+            CREATE TABLE IF NOT EXISTS kv (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                expires_at REAL
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS lists (
+                key TEXT NOT NULL,
+                idx INTEGER NOT NULL,
+                value TEXT NOT NULL,
+                PRIMARY KEY (key, idx)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS zsets (
+                key TEXT NOT NULL,
+                member TEXT NOT NULL,
+                score REAL NOT NULL,
+                PRIMARY KEY (key, member)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS zsets_key_score ON zsets (key, score DESC);
+            CREATE TABLE IF NOT EXISTS buckets (
+                name TEXT PRIMARY KEY,
+                tokens REAL NOT NULL,
+                updated REAL NOT NULL
+            ) WITHOUT ROWID;
+            """
+        )
+
+    def _db(self) -> sqlite3.Connection:
+        db = getattr(self._local, "db", None)
+        if db is None:
+            # Autocommit, so transactions are only the ones opened explicitly below
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        db = self._db()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            yield db
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+
+    def get(self, key):
+        with self._timed():
+            row = self._db().execute(
+                "SELECT value FROM kv WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)",
+                (key, time.time()),
+            ).fetchone()
+        return row[0] if row else None
+
+    def set(self, key, value, ttl=None):
+        now = time.time()
+        with self._timed():
+            db = self._db()
+            db.execute(
+                "INSERT OR REPLACE INTO kv (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, value, now + ttl if ttl is not None else None),
+            )
+            if random.randrange(self.PURGE_EVERY) == 0:
+                db.execute("DELETE FROM kv WHERE expires_at <= ?", (now,))
+
+    def delete(self, *keys):
+        with self._timed(), self._transaction() as db:
+            for key in keys:
+                db.execute("DELETE FROM kv WHERE key = ?", (key,))
+                db.execute("DELETE FROM lists WHERE key = ?", (key,))
+                db.execute("DELETE FROM zsets WHERE key = ?", (key,))
+
+    def rpush(self, key, value):
+        with self._timed(), self._transaction() as db:
+            length = db.execute("SELECT COALESCE(MAX(idx) + 1, 0) FROM lists WHERE key = ?", (key,)).fetchone()[0]
+            db.execute("INSERT INTO lists (key, idx, value) VALUES (?, ?, ?)", (key, length, value))
+        return length + 1
+
+    def lrange(self, key, start, end):
+        with self._timed():
+            rows = self._db().execute(
+                "SELECT value FROM lists WHERE key = ? AND idx >= ? AND idx < ? ORDER BY idx",
+                (key, start, end),
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def llen(self, key):
+        with self._timed():
+            return self._db().execute(
+                "SELECT COALESCE(MAX(idx) + 1, 0) FROM lists WHERE key = ?", (key,)
+            ).fetchone()[0]
+
+    def zadd(self, key, member, score):
+        with self._timed():
+            self._db().execute(
+                "INSERT OR REPLACE INTO zsets (key, member, score) VALUES (?, ?, ?)", (key, member, score)
+            )
+
+    def zrevrange(self, key, start, end):
+        with self._timed():
+            rows = self._db().execute(
+                "SELECT member, score FROM zsets WHERE key = ? ORDER BY score DESC LIMIT ? OFFSET ?",
+                (key, max(end - start, 0), start),
+            ).fetchall()
+        return [(member, score) for member, score in rows]
+
+    def zrem(self, key, member):
+        with self._timed():
+            self._db().execute("DELETE FROM zsets WHERE key = ? AND member = ?", (key, member))
+
+    def take(self, bucket, amount, rate, capacity):
+        now = time.time()
+        with self._timed(), self._transaction() as db:
+            row = db.execute("SELECT tokens, updated FROM buckets WHERE name = ?", (bucket,)).fetchone()
+            tokens = capacity if row is None else min(capacity, row[0] + max(now - row[1], 0.0) * rate)
+            wait = 0.0
+            if tokens >= amount:
+                tokens -= amount
+            else:
+                wait = (amount - tokens) / rate if rate > 0 else float("inf")
+            db.execute(
+                "INSERT OR REPLACE INTO buckets (name, tokens, updated) VALUES (?, ?, ?)", (bucket, tokens, now)
+            )
+        return wait
+
+
+class RedisBackend(SharedBackend):
+    """Shared state on a Redis server (or anything speaking its protocol), for replicas on several hosts
+
+    Needs the optional ``redis`` package. Cached responses expire through
+    Redis TTLs; conversations are kept until deleted, so size the server
+    (or its ``maxmemory`` policy) for them.
+    """
+
+    name = "redis"
+
+    def __init__(self, url: str, client: Optional["redis.Redis"] = None):
+        super().__init__()
+        if client is None:
+            import redis
+
+            client = redis.Redis.from_url(url, decode_responses=True)
+        self.url = url
+        self._redis = client
+        self._take = self._redis.register_script(TOKEN_BUCKET_SCRIPT)
+
+    def get(self, key):
+        with self._timed():
+            return self._redis.get(key)
+
+    def set(self, key, value, ttl=None):
+        with self._timed():
+            self._redis.set(key, value, px=max(int(ttl * 1000), 1) if ttl is not None else None)
+
+    def delete(self, *keys):
+        if keys:
+            with self._timed():
+                self._redis.delete(*keys)
+
+    def rpush(self, key, value):
+        with self._timed():
+            return self._redis.rpush(key, value)
+
+    def lrange(self, key, start, end):
+        if end <= start:
+            return []
+        with self._timed():
+            return self._redis.lrange(key, start, end - 1)
+
+    def llen(self, key):
+        with self._timed():
+            return self._redis.llen(key)
+
+    def zadd(self, key, member, score):
+        with self._timed():
+            self._redis.zadd(key, {member: score})
+
+    def zrevrange(self, key, start, end):
+        if end <= start:
+            return []
+        with self._timed():
+            return [(member, float(score)) for member, score in
+                    self._redis.zrevrange(key, start, end - 1, withscores=True)]
+
+    def zrem(self, key, member):
+        with self._timed():
+            self._redis.zrem(key, member)
+
+    def take(self, bucket, amount, rate, capacity):
+        with self._timed():
+            wait = float(self._take(keys=[bucket], args=[amount, rate, capacity, bucket_ttl(rate, capacity)]))
+        return float("inf") if wait < 0 else wait
+
+
+def backend_from_env() -> Optional[SharedBackend]:
+    """Backend at KIMI_SHARED_URL (sqlite:///path or redis://host:port/db), or None for a single replica"""
+    url = os.getenv("KIMI_SHARED_URL", "").strip()
+    if not url:
+        return None
+    if url.startswith("sqlite:///"):
+        return SQLiteBackend(url[len("sqlite:///"):])
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisBackend(url)
+    raise ValueError(f"Unknown KIMI_SHARED_URL '{url}'; use sqlite:///path/to/file.db or redis://host:port/db")
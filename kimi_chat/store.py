@@ -0,0 +1,386 @@
+"""Persistent conversation storage with paged loading"""
+
+import hashlib
+import itertools
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    from .shared import SharedBackend
+
+Message = Dict[str, str]
+
+
+@dataclass
+class ConversationSummary:
+    id: str
+    title: str
+    updated_at: float
+    message_count: int
+
+
+def owner_id(visitor: str) -> str:
+    """Conversations are scoped to the visitor that created them, stored as a digest of their id"""
+    return hashlib.sha256(visitor.encode("utf-8")).hexdigest()[:32]
+
+
+def make_title(first_message: str, max_chars: int = 60) -> str:
+    title = " ".join(first_message.split())
+    return title if len(title) <= max_chars else title[:max_chars - 1].rstrip() + "…"
+
+
+class ConversationStore:
+    """Where conversations live between sessions
+
+    Messages are written one at a time as they are appended, and read back a
+    page at a time, newest first, so a session only holds what it shows.
+    Sequence numbers start at 1 within each conversation.
+    """
+
+    def create_conversation(self, owner: str, title: str) -> str:
+        raise NotImplementedError
+
+    def append_message(self, conversation_id: str, role: str, content: str) -> int:
+        raise NotImplementedError
+
+    def load_page(self, conversation_id: str, limit: int,
+                  before_seq: Optional[int] = None) -> Tuple[List[Message], int]:
+        """Up to ``limit`` messages older than ``before_seq`` (or the newest), oldest first
+
+        Also returns the sequence number of the oldest message returned, or 0
+        if there are none; pass it back as ``before_seq`` for the next page.
+        """
+        raise NotImplementedError
+
+    def list_conversations(self, owner: str, limit: int = 20, offset: int = 0) -> List[ConversationSummary]:
+        """Most recently updated conversations first"""
+        raise NotImplementedError
+
+    def delete_conversation(self, conversation_id: str):
+        raise NotImplementedError
+
+
+class SQLiteConversationStore(ConversationStore):
+    """Default store: one SQLite file, one connection per thread, WAL journaling"""
+
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._local = threading.local()
+        db = self._db()
+        db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS conversations (
+                id TEXT PRIMARY KEY,
+                owner TEXT NOT NULL,
+                title TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                message_count INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE INDEX IF NOT EXISTS conversations_owner_updated
+                ON conversations (owner, updated_at DESC);
+            CREATE TABLE IF NOT EXISTS messages (
+                conversation_id TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                role TEXT NOT NULL,
+                content TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (conversation_id, seq)
+            ) WITHOUT ROWID;
+            """
+        )
+        db.commit()
+
+    def _db(self) -> sqlite3.Connection:
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    def create_conversation(self, owner, title):
+        conversation_id = uuid.uuid4().hex
+        now = time.time()
+        db = self._db()
+        db.execute(
+            "INSERT INTO conversations (id, owner, title, created_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+            (conversation_id, owner, title, now, now),
+        )
+        db.commit()
+        return conversation_id
+
+    def append_message(self, conversation_id, role, content):
+        db = self._db()
+        with db:
+            row = db.execute(
+                "UPDATE conversations SET message_count = message_count + 1, updated_at = ? "
+                "WHERE id = ? RETURNING message_count",
+                (time.time(), conversation_id),
+            ).fetchone()
+            if row is None:
+                raise KeyError(f"Unknown conversation {conversation_id}")
+            db.execute(
+                "INSERT INTO messages (conversation_id, seq, role, content, created_at) VALUES (?, ?, ?, ?, ?)",
+                (conversation_id, row[0], role, content, time.time()),
+            )
+        return row[0]
+
+    def load_page(self, conversation_id, limit, before_seq=None):
+        rows = self._db().execute(
+            "SELECT seq, role, content FROM messages WHERE conversation_id = ? AND seq < ? "
+            "ORDER BY seq DESC LIMIT ?",
+            (conversation_id, before_seq if before_seq is not None else 2 ** 62, limit),
+        ).fetchall()
+        rows.reverse()
+        return [{"role": role, "content": content} for _, role, content in rows], (rows[0][0] if rows else 0)
+
+    def list_conversations(self, owner, limit=20, offset=0):
+        rows = self._db().execute(
+            "SELECT id, title, updated_at, message_count FROM conversations WHERE owner = ? "
+            "ORDER BY updated_at DESC LIMIT ? OFFSET ?",
+            (owner, limit, offset),
+        ).fetchall()
+        return [ConversationSummary(*row) for row in rows]
+
+    def delete_conversation(self, conversation_id):
+        db = self._db()
+        with db:
+            db.execute("DELETE FROM messages WHERE conversation_id = ?", (conversation_id,))
+            db.execute("DELETE FROM conversations WHERE id = ?", (conversation_id,))
+
+
+class AppendLogConversationStore(ConversationStore):
+    """Append-only JSONL files: one per conversation plus an index log
+
+    Nothing is ever rewritten in place. The index log records conversation
+    creation, updates and deletion and is replayed into memory on start-up.
+    Appending a message logs an update only if the conversation's last one
+    is more than ``touch_interval`` seconds old, so the log grows with
+    conversations rather than messages. Each owner's conversations are
+    kept in update order, so listing the newest is a walk from the end
+    rather than a sort. Message offsets are read once per conversation, so
+    pages can be read with a seek instead of a full scan.
+    """
+
+    def __init__(self, directory: str, touch_interval: float = 60.0):
+        self.directory = directory
+        self.touch_interval = touch_interval
+        os.makedirs(directory, exist_ok=True)
+        self._index_path = os.path.join(directory, "index.jsonl")
+        self._lock = threading.Lock()
+        self._conversations: Dict[str, Dict] = {}
+        # Per owner, conversation ids from least to most recently updated
+        self._recent: Dict[str, "OrderedDict[str, None]"] = {}
+        self._offsets: Dict[str, List[int]] = {}
+        if os.path.exists(self._index_path):
+            with open(self._index_path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        self._apply(json.loads(line))
+                    except json.JSONDecodeError:
+                        continue
+
+    def _apply(self, event: Dict):
+        conversation_id = event["id"]
+        conversation = self._conversations.get(conversation_id)
+        if event["event"] == "create":
+            conversation = self._conversations[conversation_id] = {
+                "owner": event["owner"], "title": event["title"], "updated_at": event["at"], "logged_at": event["at"],
+            }
+            self._recent.setdefault(event["owner"], OrderedDict())[conversation_id] = None
+        elif event["event"] in ("update", "append") and conversation is not None:
+            # "append" is the per-message event older logs were written with
+            conversation["updated_at"] = conversation["logged_at"] = event["at"]
+            if "title" in event:
+                conversation["title"] = event["title"]
+            self._recent[conversation["owner"]].move_to_end(conversation_id)
+        elif event["event"] == "delete" and conversation is not None:
+            del self._conversations[conversation_id]
+            owned = self._recent[conversation["owner"]]
+            del owned[conversation_id]
+            if not owned:
+                del self._recent[conversation["owner"]]
+
+    def _log(self, event: Dict):
+        with open(self._index_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(event, ensure_ascii=False) + "\n")
+        self._apply(event)
+
+    def _messages_path(self, conversation_id: str) -> str:
+        return os.path.join(self.directory, f"{conversation_id}.jsonl")
+
+    def _message_offsets(self, conversation_id: str) -> List[int]:
+        offsets = self._offsets.get(conversation_id)
+        if offsets is None:
+            offsets = []
+            path = self._messages_path(conversation_id)
+            if os.path.exists(path):
+                with open(path, "rb") as f:
+                    position = 0
+                    for line in f:
+                        offsets.append(position)
+                        position += len(line)
+            self._offsets[conversation_id] = offsets
+        return offsets
+
+    def create_conversation(self, owner, title):
+        conversation_id = uuid.uuid4().hex
+        with self._lock:
+            self._log({"event": "create", "id": conversation_id, "owner": owner,
+                       "title": title, "at": time.time()})
+        return conversation_id
+
+    def append_message(self, conversation_id, role, content):
+        with self._lock:
+            conversation = self._conversations.get(conversation_id)
+            if conversation is None:
+                raise KeyError(f"Unknown conversation {conversation_id}")
+            offsets = self._message_offsets(conversation_id)
+            line = (json.dumps({"role": role, "content": content}, ensure_ascii=False) + "\n").encode("utf-8")
+            with open(self._messages_path(conversation_id), "ab") as f:
+                offsets.append(f.tell())
+                f.write(line)
+            now = time.time()
+            if now - conversation["logged_at"] >= self.touch_interval:
+                self._log({"event": "update", "id": conversation_id, "at": now})
+            else:
+                # Kept in memory only; a restart within touch_interval orders by the last logged update
+                conversation["updated_at"] = now
+                self._recent[conversation["owner"]].move_to_end(conversation_id)
+        return len(offsets)
+
+    def load_page(self, conversation_id, limit, before_seq=None):
+        with self._lock:
+            offsets = list(self._message_offsets(conversation_id))
+        end = len(offsets) if before_seq is None else min(before_seq - 1, len(offsets))
+        start = max(end - limit, 0)
+        if start >= end:
+            return [], 0
+        messages = []
+        with open(self._messages_path(conversation_id), "rb") as f:
+            f.seek(offsets[start])
+            for _ in range(end - start):
+                messages.append(json.loads(f.readline()))
+        return messages, start + 1
+
+    def list_conversations(self, owner, limit=20, offset=0):
+        with self._lock:
+            newest = itertools.islice(reversed(self._recent.get(owner, {})), offset, offset + limit)
+            # Message counts come from the offsets, read on first listing rather than replayed from the log
+            return [
+                ConversationSummary(cid, self._conversations[cid]["title"], self._conversations[cid]["updated_at"],
+                                    len(self._message_offsets(cid)))
+                for cid in newest
+            ]
+
+    def delete_conversation(self, conversation_id):
+        with self._lock:
+            if conversation_id in self._conversations:
+                self._log({"event": "delete", "id": conversation_id, "at": time.time()})
+            self._offsets.pop(conversation_id, None)
+        try:
+            os.remove(self._messages_path(conversation_id))
+        except FileNotFoundError:
+            pass
+
+
+class SharedConversationStore(ConversationStore):
+    """Conversations in the backend every replica shares
+
+    Each conversation is a record plus a list of messages, and each owner
+    has a set of conversation ids scored by last update, so a session that
+    lands on another replica still finds its chats.
+    """
+
+    def __init__(self, backend: "SharedBackend"):
+        self.backend = backend
+
+    @staticmethod
+    def _key(conversation_id: str) -> str:
+        return f"conversation:{conversation_id}"
+
+    @staticmethod
+    def _owner_key(owner: str) -> str:
+        return f"conversations:{owner}"
+
+    def _record(self, conversation_id: str) -> Dict:
+        record = self.backend.get(self._key(conversation_id))
+        if record is None:
+            raise KeyError(f"Unknown conversation {conversation_id}")
+        return json.loads(record)
+
+    def create_conversation(self, owner, title):
+        conversation_id = uuid.uuid4().hex
+        now = time.time()
+        self.backend.set(self._key(conversation_id), json.dumps(
+            {"owner": owner, "title": title, "created_at": now}, ensure_ascii=False
+        ))
+        self.backend.zadd(self._owner_key(owner), conversation_id, now)
+        return conversation_id
+
+    def append_message(self, conversation_id, role, content):
+        record = self._record(conversation_id)
+        seq = self.backend.rpush(self._key(conversation_id) + ":messages",
+                                 json.dumps({"role": role, "content": content}, ensure_ascii=False))
+        self.backend.zadd(self._owner_key(record["owner"]), conversation_id, time.time())
+        return seq
+
+    def load_page(self, conversation_id, limit, before_seq=None):
+        key = self._key(conversation_id) + ":messages"
+        total = self.backend.llen(key)
+        end = total if before_seq is None else min(before_seq - 1, total)
+        start = max(end - limit, 0)
+        if start >= end:
+            return [], 0
+        return [json.loads(message) for message in self.backend.lrange(key, start, end)], start + 1
+
+    def list_conversations(self, owner, limit=20, offset=0):
+        summaries = []
+        for conversation_id, updated_at in self.backend.zrevrange(self._owner_key(owner), offset, offset + limit):
+            try:
+                title = self._record(conversation_id)["title"]
+            except KeyError:
+                continue
+            summaries.append(ConversationSummary(
+                conversation_id, title, updated_at, self.backend.llen(self._key(conversation_id) + ":messages")
+            ))
+        return summaries
+
+    def delete_conversation(self, conversation_id):
+        try:
+            record = self._record(conversation_id)
+        except KeyError:
+            return
+        self.backend.zrem(self._owner_key(record["owner"]), conversation_id)
+        self.backend.delete(self._key(conversation_id), self._key(conversation_id) + ":messages")
+
+
+def store_from_env(backend: Optional["SharedBackend"] = None) -> Optional[ConversationStore]:
+    """Store chosen by KIMI_STORE (sqlite, log, shared or none) at KIMI_STORE_PATH
+
+    Defaults to the shared backend when there is one, so every replica sees
+    the same conversations.
+    """
+    kind = os.getenv("KIMI_STORE", "shared" if backend is not None else "sqlite").lower()
+    if kind == "none":
+        return None
+    if kind == "shared":
+        if backend is None:
+            raise ValueError("KIMI_STORE=shared needs a shared backend; set KIMI_SHARED_URL")
+        return SharedConversationStore(backend)
+    if kind == "log":
+        return AppendLogConversationStore(os.getenv("KIMI_STORE_PATH") or os.path.join(".kimi", "conversations"))
+    if kind == "sqlite":
+        return SQLiteConversationStore(os.getenv("KIMI_STORE_PATH") or os.path.join(".kimi", "conversations.db"))
+    raise ValueError(f"Unknown KIMI_STORE '{kind}'; use sqlite, log, shared or none")
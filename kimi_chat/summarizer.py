@@ -0,0 +1,236 @@
+"""Background rolling summaries that stand in for old turns of long chats"""
+
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional
+
+from kimi_chat.completion import get_kimi_response
+from kimi_chat.context import TokenCounter, default_counter
+from kimi_chat.messages import ChatMessage, Role
+from kimi_chat.scheduler import RequestScheduler
+
+if TYPE_CHECKING:
+    import openai
+
+Message = Dict[str, str]
+
+# Messages at positions [start, end) of a conversation, for ones the caller no longer holds
+MessageLoader = Callable[[int, int], List[Message]]
+
+SUMMARY_HEADER = "Summary of the earlier conversation:"
+
+SUMMARY_INSTRUCTIONS = (
+    "You maintain a running summary of a conversation between a user and Kimi, an AI assistant. "
+    "Update the summary with the new messages. Keep facts, decisions, names, numbers, code "
+    "identifiers and open questions; drop greetings and filler. Reply with the updated summary only."
+)
+
+
+@dataclass
+class SummarizerConfig:
+    """When and how long chats get summarized"""
+    model: str = "kimi-k2-turbo-preview"
+    threshold_tokens: int = 8000
+    keep_recent_tokens: int = 3000
+    min_new_messages: int = 4
+    summary_max_tokens: int = 600
+    max_chars_per_message: int = 4000
+    workers: int = 2
+    max_conversations: int = 1000
+    max_pending_usage: int = 20
+    max_reload_messages: int = 200
+
+    @classmethod
+    def from_env(cls) -> "SummarizerConfig":
+        return cls(
+            model=os.getenv("KIMI_SUMMARY_MODEL", cls.model),
+            threshold_tokens=int(os.getenv("KIMI_SUMMARY_THRESHOLD", cls.threshold_tokens)),
+            keep_recent_tokens=int(os.getenv("KIMI_SUMMARY_KEEP_RECENT", cls.keep_recent_tokens)),
+            summary_max_tokens=int(os.getenv("KIMI_SUMMARY_MAX_TOKENS", cls.summary_max_tokens)),
+            workers=int(os.getenv("KIMI_SUMMARY_WORKERS", cls.workers)),
+        )
+
+
+@dataclass
+class RollingSummary:
+    """Summary text covering the first ``covered`` messages of a conversation
+
+    ``gap`` counts the messages among them that were trimmed from the
+    session before they could be summarized and couldn't be loaded back.
+    """
+    text: str
+    covered: int
+    gap: int = 0
+
+
+class ConversationSummarizer:
+    """Keeps a rolling summary per conversation, updated off the request path
+
+    After a turn, ``schedule()`` checks whether the conversation has passed
+    the token threshold and, if so, asks a worker thread to fold the
+    messages that have aged out of the recent window into the existing
+    summary. Before a turn, ``condense()`` swaps the summarized messages for
+    the summary. Display history is never touched.
+
+    Message positions are absolute within the conversation; ``offset`` is
+    the position of the first message the caller holds, for sessions that
+    only keep the newest page of a stored conversation. Messages trimmed
+    from a session before the summary reached them are loaded back with
+    the caller's loader, or recorded as a gap when there is none.
+
+    Summary calls are paid for like any other. Each call's metrics are kept
+    per conversation until ``take_usage()`` hands them to the session.
+    """
+
+    def __init__(self, config: Optional[SummarizerConfig] = None,
+                 scheduler: Optional[RequestScheduler] = None,
+                 counter: Optional[TokenCounter] = None):
+        self.config = config or SummarizerConfig()
+        self.scheduler = scheduler
+        self.counter = counter or default_counter
+        self._executor = ThreadPoolExecutor(max_workers=self.config.workers,
+                                            thread_name_prefix="kimi-summarizer")
+        self._summaries: "OrderedDict[str, RollingSummary]" = OrderedDict()
+        self._pending = set()
+        self._lock = threading.Lock()
+        # Metrics of summary calls not yet taken by their conversation's session
+        self._usage: Dict[str, List[Dict]] = {}
+        self.runs = 0
+        self.failures = 0
+        self.tokens_saved = 0
+        self.gap_messages = 0
+        self.cost_usd = 0.0
+
+    def summary_for(self, conversation_id: str) -> Optional[RollingSummary]:
+        with self._lock:
+            return self._summaries.get(conversation_id)
+
+    def forget(self, conversation_id: str):
+        with self._lock:
+            self._summaries.pop(conversation_id, None)
+            self._usage.pop(conversation_id, None)
+
+    def take_usage(self, conversation_id: str) -> List[Dict]:
+        """Metrics of the summary calls made for a conversation since the last call, in "summary" mode"""
+        with self._lock:
+            return self._usage.pop(conversation_id, [])
+
+    def condense(self, conversation_id: Optional[str], api_messages: List[Message], offset: int = 0,
+                 stats: Optional[Dict] = None) -> List[Message]:
+        """Replace already summarized messages with the summary, keeping the system prompt first"""
+        summary = self.summary_for(conversation_id) if conversation_id else None
+        system = api_messages[:1] if api_messages and api_messages[0].get("role") == "system" else []
+        history = api_messages[len(system):]
+        skip = summary.covered - offset if summary is not None else 0
+        # Always leave the newest message, and ignore summaries from a conversation that was cut short
+        if summary is None or skip >= len(history):
+            condensed = api_messages
+        else:
+            # A summary behind the session's trimmed head still stands for the messages before it
+            summary_message = ChatMessage(Role.SYSTEM, f"{SUMMARY_HEADER}\n{summary.text}")
+            condensed = system + [summary_message] + history[max(skip, 0):]
+        if stats is not None:
+            saved = max(sum(self.counter.count_all(api_messages)) - sum(self.counter.count_all(condensed)), 0)
+            stats["summary_tokens_saved"] = saved
+            with self._lock:
+                self.tokens_saved += saved
+        return condensed
+
+    def schedule(self, conversation_id: str, client: "openai.OpenAI", messages: List[Message],
+                 offset: int = 0, load_messages: Optional[MessageLoader] = None) -> bool:
+        """Queue a summary update if the conversation needs one; returns whether it did
+
+        If the session has trimmed messages the summary doesn't cover yet,
+        ``load_messages`` fetches them on the worker; without it they are a gap.
+        """
+        counts = self.counter.count_all(messages)
+        if sum(counts) <= self.config.threshold_tokens:
+            return False
+        # Everything older than the newest keep_recent_tokens worth of messages gets summarized
+        boundary = len(messages)
+        recent = 0
+        while boundary > 0 and recent + counts[boundary - 1] <= self.config.keep_recent_tokens:
+            boundary -= 1
+            recent += counts[boundary]
+        with self._lock:
+            if conversation_id in self._pending:
+                return False
+            summary = self._summaries.get(conversation_id)
+            covered = summary.covered if summary is not None else offset
+            start = max(covered - offset, 0)
+            trimmed = max(offset - covered, 0)
+            if trimmed + boundary - start < self.config.min_new_messages:
+                return False
+            self._pending.add(conversation_id)
+        new_messages = list(messages[start:boundary])
+        self._executor.submit(self._update, conversation_id, client, summary, new_messages,
+                              offset + boundary, (covered, offset) if trimmed else None, load_messages)
+        return True
+
+    def _update(self, conversation_id: str, client: "openai.OpenAI", summary: Optional[RollingSummary],
+                new_messages: List[Message], covered: int, trimmed: Optional[tuple] = None,
+                load_messages: Optional[MessageLoader] = None):
+        try:
+            gap = summary.gap if summary is not None else 0
+            missing = ""
+            if trimmed is not None:
+                first, last = trimmed
+                loaded = []
+                if load_messages is not None and last - first <= self.config.max_reload_messages:
+                    try:
+                        loaded = load_messages(first, last)
+                    except Exception:
+                        loaded = []
+                if len(loaded) == last - first:
+                    new_messages = loaded + new_messages
+                else:
+                    gap += last - first
+                    with self._lock:
+                        self.gap_messages += last - first
+                    missing = f"({last - first} earlier messages are no longer available)\n\n"
+            limit = self.config.max_chars_per_message
+            transcript = missing + "\n\n".join(
+                f"{message['role']}: {message['content'][:limit]}" for message in new_messages
+            )
+            prompt = [
+                {"role": "system", "content": SUMMARY_INSTRUCTIONS},
+                {"role": "user", "content": f"Current summary:\n{summary.text if summary else '(none yet)'}"
+                                            f"\n\nNew messages:\n{transcript}"},
+            ]
+            metrics: Dict = {}
+            text = get_kimi_response(client, prompt, self.config.model, 0.3, self.config.summary_max_tokens,
+                                     metrics=metrics, scheduler=self.scheduler)
+            metrics["mode"] = "summary"
+            with self._lock:
+                self.runs += 1
+                self.cost_usd += metrics["cost"]
+                usage = self._usage.setdefault(conversation_id, [])
+                usage.append(metrics)
+                # A session that never comes back for its usage shouldn't keep it forever
+                del usage[:-self.config.max_pending_usage]
+                if metrics["error"]:
+                    self.failures += 1
+                    return
+                self._summaries[conversation_id] = RollingSummary(text.strip(), covered, gap)
+                self._summaries.move_to_end(conversation_id)
+                while len(self._summaries) > self.config.max_conversations:
+                    evicted, _ = self._summaries.popitem(last=False)
+                    self._usage.pop(evicted, None)
+        finally:
+            with self._lock:
+                self._pending.discard(conversation_id)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "conversations": len(self._summaries),
+                "pending": len(self._pending),
+                "runs": self.runs,
+                "failures": self.failures,
+                "tokens_saved": self.tokens_saved,
+                "gap_messages": self.gap_messages,
+                "cost_usd": self.cost_usd,
+            }
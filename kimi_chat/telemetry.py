@@ -0,0 +1,238 @@
+"""Per-turn cost estimates and process-wide metrics export"""
+
+import functools
+import json
+import os
+import threading
+import time
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Sequence, Tuple
+
+# USD per million (prompt, completion) tokens, from Moonshot AI's price list
+MODEL_PRICING: Dict[str, Tuple[float, float]] = {
+    "kimi-k2-turbo-preview": (1.15, 8.00),
+    "kimi-k2-0711-preview": (0.60, 2.50),
+    "kimi-k2-0905-preview": (0.60, 2.50),
+    "moonshot-v1-8k": (0.20, 2.00),
+    "moonshot-v1-32k": (1.00, 3.00),
+    "moonshot-v1-128k": (2.00, 5.00),
+}
+
+# Seconds; covers cache hits through long blocking generations
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+# Turn metrics exported as latency histograms
+TIMING_METRICS = ("build", "queue", "network", "ttft", "total")
+
+
+def pricing_from_env() -> Dict[str, Tuple[float, float]]:
+    """MODEL_PRICING with overrides from KIMI_PRICING, e.g. '{"moonshot-v1-8k": [0.2, 2.0]}'"""
+    pricing = dict(MODEL_PRICING)
+    overrides = os.getenv("KIMI_PRICING")
+    if overrides:
+        pricing.update({model: tuple(prices) for model, prices in json.loads(overrides).items()})
+    return pricing
+
+
+_pricing = pricing_from_env()
+
+
+def estimate_cost(model: str, prompt_tokens: Optional[int], completion_tokens: Optional[int]) -> float:
+    """Estimated USD cost of one completion; 0.0 for models without a known price"""
+    prompt_price, completion_price = _pricing.get(model, (0.0, 0.0))
+    return ((prompt_tokens or 0) * prompt_price + (completion_tokens or 0) * completion_price) / 1_000_000
+
+
+@dataclass
+class TelemetryConfig:
+    """Where process-wide metrics are served"""
+    metrics_port: int = 0
+    metrics_host: str = "127.0.0.1"
+
+    @classmethod
+    def from_env(cls) -> "TelemetryConfig":
+        return cls(
+            metrics_port=int(os.getenv("KIMI_METRICS_PORT", cls.metrics_port)),
+            metrics_host=os.getenv("KIMI_METRICS_HOST", cls.metrics_host),
+        )
+
+
+class Histogram:
+    """Cumulative bucket counts in the Prometheus style"""
+
+    def __init__(self, buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(**labels: str) -> str:
+    return "{" + ",".join(f'{name}="{_escape(str(value))}"' for name, value in labels.items()) + "}"
+
+
+class MetricsRegistry:
+    """Turn metrics aggregated across every session of the process, by model and mode
+
+    Sessions aren't used as labels, since each one would be a new time
+    series; per-session totals go on the OpenTelemetry span instead.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[Tuple[str, str], Dict[str, float]] = {}
+        self._histograms: Dict[Tuple[str, str, str], Histogram] = {}
+
+    def observe(self, metrics: Dict):
+        """Add one turn, as recorded by record_turn_metrics"""
+        key = (metrics["model"], metrics["mode"])
+        with self._lock:
+            counters = self._counters.setdefault(key, {
+                "turns": 0, "errors": 0, "prompt_tokens": 0, "completion_tokens": 0, "cost_usd": 0.0,
+                "prompt_tokens_saved": 0, "stopped": 0, "completion_tokens_saved": 0,
+                "routed": 0, "route_measured": 0, "route_seconds_saved": 0.0,
+            })
+            counters["turns"] += 1
+            counters["errors"] += int(bool(metrics.get("error")))
+            counters["prompt_tokens"] += metrics.get("prompt_tokens") or 0
+            counters["completion_tokens"] += metrics.get("completion_tokens") or 0
+            counters["cost_usd"] += metrics.get("cost", 0.0)
+            counters["prompt_tokens_saved"] += metrics.get("prompt_tokens_saved", 0)
+            counters["stopped"] += int(bool(metrics.get("stopped")))
+            counters["completion_tokens_saved"] += metrics.get("completion_tokens_saved", 0)
+            if "route" in metrics:
+                counters["routed"] += 1
+                if metrics["route"]["latency_saved"] is not None:
+                    counters["route_measured"] += 1
+                    counters["route_seconds_saved"] += metrics["route"]["latency_saved"]
+            if metrics.get("error"):
+                # Failed turns would skew latency toward however long the error took
+                return
+            for name in TIMING_METRICS:
+                if metrics.get(name) is not None:
+                    self._histograms.setdefault(key + (name,), Histogram()).observe(metrics[name])
+
+    def render_prometheus(self) -> str:
+        """Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            counter_types = (
+                ("turns", "kimi_turns_total", "Chat turns completed"),
+                ("errors", "kimi_turn_errors_total", "Chat turns that ended in an error"),
+                ("prompt_tokens", "kimi_prompt_tokens_total", "Prompt tokens reported by the API"),
+                ("completion_tokens", "kimi_completion_tokens_total", "Completion tokens generated"),
+                ("cost_usd", "kimi_cost_usd_total", "Estimated spend in USD"),
+                ("prompt_tokens_saved", "kimi_prompt_tokens_saved_total", "Prompt tokens replaced by summaries"),
+                ("stopped", "kimi_turns_stopped_total", "Chat turns the user stopped mid-reply"),
+                ("completion_tokens_saved", "kimi_completion_tokens_saved_total",
+                 "Completion tokens left ungenerated by stopped turns, at most"),
+                ("routed", "kimi_turns_routed_total", "Chat turns the Auto model choice routed"),
+                ("route_measured", "kimi_turns_route_measured_total",
+                 "Routed turns whose time saved against the baseline model was measured"),
+                ("route_seconds_saved", "kimi_route_seconds_saved_total",
+                 "Measured seconds saved by Auto routing: the baseline model's observed latency minus the turn's"),
+            )
+            for field, name, help_text in counter_types:
+                lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+                for (model, mode), counters in sorted(self._counters.items()):
+                    lines.append(f"{name}{_labels(model=model, mode=mode)} {counters[field]:g}")
+            lines += ["# HELP kimi_turn_seconds Turn latency by phase",
+                      "# TYPE kimi_turn_seconds histogram"]
+            for (model, mode, phase), histogram in sorted(self._histograms.items()):
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    labels = _labels(model=model, mode=mode, phase=phase, le=f"{bound:g}")
+                    lines.append(f"kimi_turn_seconds_bucket{labels} {count}")
+                labels = _labels(model=model, mode=mode, phase=phase, le="+Inf")
+                lines.append(f"kimi_turn_seconds_bucket{labels} {histogram.count}")
+                labels = _labels(model=model, mode=mode, phase=phase)
+                lines.append(f"kimi_turn_seconds_sum{labels} {histogram.sum:.6f}")
+                lines.append(f"kimi_turn_seconds_count{labels} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                "turns": sum(c["turns"] for c in self._counters.values()),
+                "errors": sum(c["errors"] for c in self._counters.values()),
+                "cost_usd": sum(c["cost_usd"] for c in self._counters.values()),
+            }
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0].rstrip("/") != "/metrics":
+            self.send_error(404)
+            return
+        body = self.server.registry.render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(registry: MetricsRegistry, port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """Serve ``/metrics`` for Prometheus from a daemon thread"""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    server.registry = registry
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+@functools.lru_cache(maxsize=None)
+def _opentelemetry_trace():
+    """The opentelemetry.trace module, or None if it isn't installed; imported on first use, tried once"""
+    try:
+        from opentelemetry import trace
+    except ImportError:
+        return None
+    return trace
+
+
+def record_turn_span(metrics: Dict, conversation_id: Optional[str] = None, session_cost: Optional[float] = None):
+    """Emit one finished turn as an OpenTelemetry span, when opentelemetry is installed
+
+    The span is back-dated to when the turn started. Without a configured
+    tracer provider the OpenTelemetry API makes this a no-op.
+    """
+    trace = _opentelemetry_trace()
+    if trace is None:
+        return
+    end_ns = time.time_ns()
+    span = trace.get_tracer("kimi_chat").start_span(
+        "chat turn", start_time=end_ns - int(metrics["total"] * 1e9)
+    )
+    span.set_attributes({
+        "gen_ai.system": "moonshot",
+        "gen_ai.request.model": metrics["model"],
+        "gen_ai.usage.input_tokens": metrics.get("prompt_tokens") or 0,
+        "gen_ai.usage.output_tokens": metrics.get("completion_tokens") or 0,
+        "kimi.mode": metrics["mode"],
+        "kimi.cost_usd": metrics.get("cost", 0.0),
+        "kimi.stopped": bool(metrics.get("stopped")),
+        "kimi.routed": "route" in metrics,
+        **{f"kimi.{name}_seconds": metrics[name] for name in TIMING_METRICS if metrics.get(name) is not None},
+    })
+    if conversation_id is not None:
+        span.set_attribute("kimi.conversation_id", conversation_id)
+    if session_cost is not None:
+        span.set_attribute("kimi.session_cost_usd", session_cost)
+    if metrics.get("error"):
+        span.set_status(trace.Status(trace.StatusCode.ERROR))
+    span.end(end_time=end_ns)
@@ -0,0 +1,344 @@
+"""Opt-in spans around the chat hot path and profiles of the slowest turns, as a Chrome trace"""
+
+import contextvars
+import cProfile
+import itertools
+import json
+import math
+import os
+import pstats
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager, nullcontext
+from dataclasses import dataclass, field
+from typing import Any, Deque, Dict, Iterator, List, Optional, Set
+
+# Returned by every span while tracing is off, so call sites cost one attribute check
+_NO_SPAN = nullcontext()
+
+# httpcore trace events (without .started/.complete) and the spans they become
+HTTP_PHASES = {
+    "connection.connect_tcp": "connect (DNS + TCP)",
+    "connection.connect_unix_socket": "connect (unix socket)",
+    "connection.start_tls": "TLS handshake",
+    "http11.send_request_headers": "send request headers",
+    "http11.send_request_body": "send request body",
+    "http11.receive_response_headers": "wait for response headers",
+    "http11.receive_response_body": "read response body",
+    "http2.send_request_headers": "send request headers",
+    "http2.send_request_body": "send request body",
+    "http2.receive_response_headers": "wait for response headers",
+    "http2.receive_response_body": "read response body",
+    "http11.response_closed": "close response",
+    "http2.response_closed": "close response",
+}
+
+
+@dataclass
+class TracingConfig:
+    """Whether turns are traced, where traces go and how many turns are profiled"""
+    enabled: bool = False
+    directory: str = os.path.join(".kimi", "traces")
+    profile_percent: float = 1.0
+    profiler: str = "cprofile"
+    profile_window: int = 1000
+    max_profiles: int = 50
+
+    @classmethod
+    def from_env(cls) -> "TracingConfig":
+        """Build a config from KIMI_TRACE* environment variables"""
+        defaults = cls()
+        return cls(
+            enabled=os.getenv("KIMI_TRACE", "0").lower() not in ("0", "false", "no", "off"),
+            directory=os.getenv("KIMI_TRACE_DIR") or defaults.directory,
+            profile_percent=float(os.getenv("KIMI_TRACE_PROFILE_PERCENT", defaults.profile_percent)),
+            profiler=os.getenv("KIMI_TRACE_PROFILER", defaults.profiler).lower(),
+            profile_window=int(os.getenv("KIMI_TRACE_PROFILE_WINDOW", defaults.profile_window)),
+            max_profiles=int(os.getenv("KIMI_TRACE_MAX_PROFILES", defaults.max_profiles)),
+        )
+
+
+@dataclass
+class TurnTrace:
+    """One traced turn: its arguments and the profile of every thread it ran on"""
+    id: int
+    profiler: Optional[str]
+    args: Dict[str, Any] = field(default_factory=dict)
+    _profiles: List[Any] = field(default_factory=list)
+    _lock: threading.Lock = field(default_factory=threading.Lock)
+
+    @contextmanager
+    def profile_thread(self) -> Iterator[None]:
+        """Profile the calling thread for as long as the block runs"""
+        if self.profiler is None:
+            yield
+            return
+        if self.profiler == "pyinstrument":
+            from pyinstrument import Profiler
+
+            profiler = Profiler(async_mode="disabled")
+            profiler.start()
+        else:
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError:
+                # From Python 3.12 cProfile runs on sys.monitoring, which allows one profiler per
+                # interpreter; the one already running (this turn's, or a concurrent turn's) sees
+                # this thread's calls too
+                yield
+                return
+        try:
+            yield
+        finally:
+            if self.profiler == "pyinstrument":
+                profile = profiler.stop()
+            else:
+                profiler.disable()
+                profile = profiler
+            with self._lock:
+                self._profiles.append(profile)
+
+    def save_profile(self, path_stem: str) -> Optional[str]:
+        """Write the profiles gathered so far as one file; returns its path"""
+        with self._lock:
+            profiles = list(self._profiles)
+        if not profiles:
+            return None
+        if self.profiler == "pyinstrument":
+            from pyinstrument.renderers import HTMLRenderer
+            from pyinstrument.session import Session
+
+            session = profiles[0]
+            for other in profiles[1:]:
+                session = Session.combine(session, other)
+            path = path_stem + ".html"
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(HTMLRenderer().render(session))
+            return path
+        stats = pstats.Stats(profiles[0])
+        for other in profiles[1:]:
+            stats.add(other)
+        path = path_stem + ".prof"
+        stats.dump_stats(path)
+        return path
+
+
+# The turn the current code runs for; worker threads inherit it from the thread that started them
+_current_turn: "contextvars.ContextVar[Optional[TurnTrace]]" = contextvars.ContextVar("kimi_turn", default=None)
+
+
+class _Span:
+    __slots__ = ("tracer", "name", "args", "start")
+
+    def __init__(self, tracer: "Tracer", name: str, args: Dict[str, Any]):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.tracer.complete(self.name, self.start, **self.args)
+        return False
+
+
+class Tracer:
+    """Spans written as Chrome trace events, plus profiles of the slowest turns
+
+    Does nothing until configured with tracing enabled. Then each span is
+    appended to ``trace-<time>-<pid>.json`` as it ends, in the JSON array
+    format that Perfetto and chrome://tracing open without its closing
+    bracket; each thread is its own track. Every turn is profiled, and the
+    profile is kept if the turn was slower than all but the slowest
+    ``profile_percent`` of the last ``profile_window`` turns before it.
+    """
+
+    def __init__(self, config: Optional[TracingConfig] = None):
+        self._lock = threading.Lock()
+        self.configure(config or TracingConfig())
+
+    def configure(self, config: TracingConfig):
+        with self._lock:
+            self.config = config
+            self.enabled = config.enabled
+            self.path: Optional[str] = None
+            self._file = None
+            self._named_threads: Set[int] = set()
+            self._turn_ids = itertools.count(1)
+            self._durations: Deque[float] = deque(maxlen=config.profile_window)
+            self._profiles: Deque[str] = deque()
+            self.profiler = self._pick_profiler(config)
+            self.spans = 0
+            self.turns = 0
+            self.profiles_written = 0
+
+    @staticmethod
+    def _pick_profiler(config: TracingConfig) -> Optional[str]:
+        if not config.enabled or config.profile_percent <= 0:
+            return None
+        if config.profiler == "pyinstrument":
+            try:
+                import pyinstrument  # noqa: F401
+            except ImportError:
+                return "cprofile"
+        return config.profiler if config.profiler in ("cprofile", "pyinstrument") else "cprofile"
+
+    def _write(self, events: List[Dict]):
+        with self._lock:
+            if self._file is None:
+                os.makedirs(self.config.directory, exist_ok=True)
+                self.path = os.path.join(self.config.directory,
+                                         f"trace-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}.json")
+                # Line buffered, so the file can be opened while the app runs
+                self._file = open(self.path, "w", encoding="utf-8", buffering=1)
+                self._file.write("[\n")
+            thread = threading.current_thread()
+            if thread.ident not in self._named_threads:
+                self._named_threads.add(thread.ident)
+                events = [{"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": thread.ident,
+                           "args": {"name": thread.name}}] + events
+            for event in events:
+                self._file.write(json.dumps(event, default=str) + ",\n")
+            self.spans += 1
+
+    def _event(self, name: str, phase: str, start: float, args: Dict[str, Any]) -> Dict:
+        turn = _current_turn.get()
+        if turn is not None:
+            args = {"turn": turn.id, **args}
+        return {"name": name, "ph": phase, "ts": start * 1e6, "pid": os.getpid(),
+                "tid": threading.get_ident(), "args": args}
+
+    def span(self, name: str, **args):
+        """Time the block as a span named ``name``"""
+        if not self.enabled:
+            return _NO_SPAN
+        return _Span(self, name, args)
+
+    def complete(self, name: str, start: float, end: Optional[float] = None, **args):
+        """Record a span that has already happened, from perf_counter() readings"""
+        if not self.enabled:
+            return
+        event = self._event(name, "X", start, args)
+        event["dur"] = ((end if end is not None else time.perf_counter()) - start) * 1e6
+        self._write([event])
+
+    def instant(self, name: str, **args):
+        """Record a point in time, such as the first token arriving"""
+        if not self.enabled:
+            return
+        event = self._event(name, "i", time.perf_counter(), args)
+        event["s"] = "t"
+        self._write([event])
+
+    def annotate(self, **args):
+        """Add arguments to the span of the turn being traced"""
+        turn = _current_turn.get()
+        if turn is not None:
+            turn.args.update(args)
+
+    def thread_profile(self):
+        """Profile the calling thread as part of the current turn, if it is being profiled"""
+        turn = _current_turn.get()
+        if not self.enabled or turn is None:
+            return _NO_SPAN
+        return turn.profile_thread()
+
+    @contextmanager
+    def turn(self, **args) -> Iterator[Optional[TurnTrace]]:
+        """Trace and profile one chat turn; threads started inside it with its context join it"""
+        if not self.enabled:
+            yield None
+            return
+        turn = TurnTrace(next(self._turn_ids), self.profiler, dict(args))
+        token = _current_turn.set(turn)
+        start = time.perf_counter()
+        try:
+            with turn.profile_thread():
+                yield turn
+        except BaseException as e:
+            # Streamlit ends runs with exceptions too; the turn was cut short, not broken
+            turn.args["ended_by"] = type(e).__name__
+            raise
+        finally:
+            seconds = time.perf_counter() - start
+            if self.profiler is not None and self._slow(seconds):
+                turn.args["profile"] = self._keep_profile(turn)
+            self.complete("chat turn", start, **turn.args)
+            _current_turn.reset(token)
+            with self._lock:
+                self.turns += 1
+
+    def _slow(self, seconds: float) -> bool:
+        """Whether a turn is slower than all but the slowest ``profile_percent`` of the turns before it
+
+        Until the window holds enough turns for that share to be at least one
+        of them, no turn counts as slow; otherwise every early turn would.
+        """
+        with self._lock:
+            ordered = sorted(self._durations)
+            self._durations.append(seconds)
+        warm_up = min(math.ceil(100 / self.config.profile_percent), self.config.profile_window)
+        if len(ordered) < warm_up:
+            return False
+        threshold = ordered[min(len(ordered) - 1, int(len(ordered) * (1 - self.config.profile_percent / 100)))]
+        return seconds >= threshold
+
+    def _keep_profile(self, turn: TurnTrace) -> Optional[str]:
+        os.makedirs(self.config.directory, exist_ok=True)
+        path = turn.save_profile(os.path.join(
+            self.config.directory, f"profile-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{turn.id}"
+        ))
+        if path is None:
+            return None
+        with self._lock:
+            self._profiles.append(path)
+            self.profiles_written += 1
+            expired = [self._profiles.popleft() for _ in range(len(self._profiles) - self.config.max_profiles)]
+        for old in expired:
+            try:
+                os.remove(old)
+            except OSError:
+                pass
+        return path
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "path": self.path,
+                "spans": self.spans,
+                "turns": self.turns,
+                "profiler": self.profiler,
+                "profiles_written": self.profiles_written,
+                "profiles_kept": len(self._profiles),
+            }
+
+
+class HttpTrace:
+    """httpcore trace callback turning connection and request phases into spans"""
+
+    def __init__(self, tracer: Tracer):
+        self.tracer = tracer
+        self._started: Dict[str, float] = {}
+
+    def __call__(self, event_name: str, info: Dict):
+        phase, _, state = event_name.rpartition(".")
+        if state == "started":
+            self._started[phase] = time.perf_counter()
+        elif phase in self._started:
+            self.tracer.complete(HTTP_PHASES.get(phase, phase), self._started.pop(phase),
+                                 **({"failed": True} if state == "failed" else {}))
+
+
+def trace_http_request(request):
+    """httpx request hook: trace the request's connection and HTTP phases while tracing is on"""
+    if default_tracer.enabled:
+        request.extensions["trace"] = HttpTrace(default_tracer)
+
+
+# Shared by everything in the process, so library code can add spans without being handed a tracer
+default_tracer = Tracer()
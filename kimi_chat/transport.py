@@ -0,0 +1,94 @@
+"""httpx transport that sends each request through the load balancer"""
+
+from typing import Callable, Iterator
+
+import httpx
+
+from kimi_chat.balancer import LoadBalancer, Upstream, UpstreamState
+
+# Statuses that count against an upstream; other 4xx are the request's fault
+FAILURE_STATUSES = {401, 403, 429}
+
+
+def is_upstream_failure(status_code: int) -> bool:
+    return status_code >= 500 or status_code in FAILURE_STATUSES
+
+
+class _ReleasingStream(httpx.SyncByteStream):
+    """Response body that releases the upstream once it is read or closed"""
+
+    def __init__(self, stream: httpx.SyncByteStream, release: Callable[[bool], None]):
+        self._stream = stream
+        self._release = release
+        self._ok = True
+        self._released = False
+
+    def __iter__(self) -> Iterator[bytes]:
+        try:
+            yield from self._stream
+        except Exception:
+            self._ok = False
+            raise
+
+    def close(self):
+        try:
+            self._stream.close()
+        finally:
+            if not self._released:
+                self._released = True
+                self._release(self._ok)
+
+
+class BalancedTransport(httpx.BaseTransport):
+    """Rewrite each request to the balancer's chosen endpoint and key
+
+    The OpenAI client is built against ``base_url``; requests under that
+    path are re-rooted at the upstream's base URL and their bearer token
+    swapped for the upstream's key. A request stays in flight until its
+    response body is closed, so a long stream counts as outstanding.
+    """
+
+    def __init__(self, balancer: LoadBalancer, base_url: str, limits: httpx.Limits):
+        self.balancer = balancer
+        self._base_path = httpx.URL(base_url).raw_path.decode("ascii").rstrip("/")
+        self._transport = httpx.HTTPTransport(limits=limits)
+        balancer.health_check = self.check
+
+    def _route(self, request: httpx.Request, upstream: Upstream) -> httpx.Request:
+        path = request.url.raw_path.decode("ascii")
+        if path.startswith(self._base_path):
+            path = path[len(self._base_path):]
+        url = httpx.URL(upstream.base_url.rstrip("/") + path)
+        headers = request.headers.copy()
+        headers["host"] = url.netloc.decode("ascii")
+        headers["authorization"] = f"Bearer {upstream.api_key}"
+        return httpx.Request(request.method, url, headers=headers, stream=request.stream,
+                             extensions=request.extensions)
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        state: UpstreamState = self.balancer.acquire()
+        try:
+            response = self._transport.handle_request(self._route(request, state.upstream))
+        except Exception:
+            self.balancer.release(state, ok=False)
+            raise
+        failed = is_upstream_failure(response.status_code)
+        headers = response.headers
+        release = lambda ok: self.balancer.release(state, ok and not failed, headers)
+        return httpx.Response(response.status_code, headers=response.headers,
+                              stream=_ReleasingStream(response.stream, release),
+                              extensions=response.extensions)
+
+    def check(self, upstream: Upstream) -> bool:
+        """Health check: list models on the upstream with its key"""
+        request = httpx.Request("GET", upstream.base_url.rstrip("/") + "/models",
+                                headers={"authorization": f"Bearer {upstream.api_key}"})
+        response = self._transport.handle_request(request)
+        try:
+            response.read()
+        finally:
+            response.close()
+        return response.status_code == 200
+
+    def close(self):
+        self._transport.close()
@@ -1,11 +1,52 @@
 import streamlit as st
-import openai
-from typing import List, Dict
+from streamlit.runtime.scriptrunner import StopException, get_script_run_ctx
+from typing import TYPE_CHECKING, Callable, List, Dict, MutableMapping, Optional
+import hmac
 import os
+import re
+import secrets
+import time
+import uuid
 from dotenv import load_dotenv
+from kimi_chat.balancer import BalancerConfig, LoadBalancer
+from kimi_chat.cache import ResponseCache, ResponseCacheConfig, response_key
+from kimi_chat.clients import ClientPoolConfig, ClientRegistry
+from kimi_chat.coalesce import CoalescerConfig, RequestCoalescer
+from kimi_chat.completion import build_api_messages, get_kimi_response, record_turn_metrics, stream_kimi_response
+from kimi_chat.context import CONTEXT_POLICIES, CONTEXT_POLICY_LABELS, ContextWindowManager, estimate_tokens
+from kimi_chat.documents import DOCUMENT_TYPES, DocumentLibrary, RetrievalConfig, with_excerpts
+from kimi_chat.fanout import fan_out
+from kimi_chat.generation import Generation
+from kimi_chat.markdown import MarkdownRenderer
+from kimi_chat.messages import ChatHistory, ChatMessage
+from kimi_chat.models import AUTO_DESCRIPTION, AUTO_MODEL, DEFAULT_MODEL, MODEL_DESCRIPTIONS
+from kimi_chat.prefetch import STARTER_PROMPTS, PrefetchConfig, Prefetcher
+from kimi_chat.rendering import (
+    page_styles, render_history_html, render_message_html, render_streaming_html, visible_history
+)
+from kimi_chat.reruns import PAGE_LOAD, ActionRuns, RunTracker
+from kimi_chat.router import ModelRouter, RouteDecision, RouterConfig, log_to_stderr
+from kimi_chat.scheduler import RequestScheduler, SchedulerConfig
+from kimi_chat.sessions import SessionLimitsConfig, SessionRegistry, messages_over_limit, process_rss_bytes
+from kimi_chat.shared import SharedBackend, backend_from_env
+from kimi_chat.store import ConversationStore, make_title, owner_id, store_from_env
+from kimi_chat.summarizer import ConversationSummarizer, MessageLoader, SummarizerConfig
+from kimi_chat.telemetry import (
+    MetricsRegistry, TelemetryConfig, record_turn_span, start_metrics_server
+)
+from kimi_chat.tracing import Tracer, TracingConfig, default_tracer
+
+if TYPE_CHECKING:
+    # Imported for annotations only; the SDK loads on the first message
+    import openai
+
+@st.cache_resource(show_spinner=False)
+def load_environment():
+    """Load .env once per process rather than on every rerun"""
+    load_dotenv()
 
 # Load environment variables
-load_dotenv()
+load_environment()
 
 # Page configuration
 st.set_page_config(
@@ -20,431 +61,999 @@ st.set_page_config(
     }
 )
 
-# Custom CSS for professional, modern styling
-st.markdown("""
-    <style>
-    /* Main app background with soft gradient */
-    .stApp {
-        background: linear-gradient(135deg, #f5f7fa 0%, #c3cfe2 100%);
-    }
-    
-    /* Remove default padding */
-    .block-container {
-        padding-top: 2rem;
-        padding-bottom: 2rem;
-        max-width: 1200px;
-    }
-    
-    /* Sidebar styling */
-    [data-testid="stSidebar"] {
-        background: linear-gradient(180deg, #1e293b 0%, #0f172a 100%);
-        min-width: 350px !important;
-        width: 350px !important;
-    }
-    
-    /* Hide sidebar collapse button */
-    [data-testid="collapsedControl"] {
-        display: none;
-    }
-    
-    button[kind="header"] {
-        display: none;
-    }
-    
-    [data-testid="stSidebar"] [data-testid="stMarkdownContainer"] {
-        color: #e2e8f0;
-    }
-    
-    /* Sidebar headers */
-    [data-testid="stSidebar"] h1, 
-    [data-testid="stSidebar"] h2, 
-    [data-testid="stSidebar"] h3 {
-        color: #ffffff;
-        font-weight: 700;
-    }
-    
-    /* Input fields in sidebar */
-    [data-testid="stSidebar"] .stTextInput input {
-        background-color: #334155;
-        color: #f1f5f9;
-        border: 1px solid #475569;
-        border-radius: 8px;
-    }
-    
-    [data-testid="stSidebar"] .stTextInput input:focus {
-        border-color: #818cf8;
-        box-shadow: 0 0 0 2px rgba(129, 140, 248, 0.2);
-    }
-    
-    /* Selectbox in sidebar */
-    [data-testid="stSidebar"] .stSelectbox [data-baseweb="select"] {
-        background-color: #334155;
-    }
-    
-    [data-testid="stSidebar"] .stSelectbox div[data-baseweb="select"] > div {
-        background-color: #334155;
-        color: #f1f5f9;
-        border-color: #475569;
-    }
-    
-    /* Slider in sidebar */
-    [data-testid="stSidebar"] .stSlider {
-        padding: 1rem 0;
-    }
-    
-    /* Main title styling */
-    h1 {
-        color: #1e293b;
-        font-weight: 800;
-        font-size: 2.5rem;
-        margin-bottom: 0.5rem;
-        text-shadow: 0 2px 4px rgba(255, 255, 255, 0.5);
-    }
-    
-    h4 {
-        color: #475569;
-        font-weight: 400;
-        margin-top: 0;
-    }
-    
-    /* Chat messages container */
-    .chat-message {
-        padding: 1.2rem;
-        margin: 1rem 0;
-        border-radius: 16px;
-        animation: fadeIn 0.3s ease-in;
-        max-width: 85%;
-        box-shadow: 0 2px 8px rgba(0, 0, 0, 0.1);
-    }
-    
-    @keyframes fadeIn {
-        from { opacity: 0; transform: translateY(10px); }
-        to { opacity: 1; transform: translateY(0); }
-    }
-    
-    .user-message {
-        background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-        color: white;
-        margin-left: auto;
-        border-bottom-right-radius: 4px;
-    }
-    
-    .assistant-message {
-        background: #ffffff;
-        color: #1e293b;
-        margin-right: auto;
-        border-bottom-left-radius: 4px;
-        border: 1px solid #cbd5e1;
-        box-shadow: 0 2px 4px rgba(0, 0, 0, 0.08);
-    }
-    
-    .message-header {
-        font-weight: 700;
-        margin-bottom: 0.5rem;
-        display: flex;
-        align-items: center;
-        gap: 0.5rem;
-    }
-    
-    .message-content {
-        line-height: 1.6;
-        font-size: 0.95rem;
-    }
-    
-    .user-message .message-content {
-        color: #ffffff;
-    }
-    
-    .assistant-message .message-content {
-        color: #334155;
-    }
-    
-    /* Chat input styling */
-    .stChatInput {
-        border-radius: 12px;
-        overflow: hidden;
-    }
-    
-    .stChatInput > div {
-        background: white;
-        border: 2px solid #e2e8f0;
-        border-radius: 12px;
-        transition: all 0.2s ease;
-    }
-    
-    .stChatInput > div:focus-within {
-        border-color: #667eea;
-        box-shadow: 0 0 0 3px rgba(102, 126, 234, 0.1);
-    }
-    
-    .stChatInput textarea {
-        font-size: 1rem;
-        padding: 0.75rem;
-    }
-    
-    /* Buttons */
-    .stButton button {
-        border-radius: 10px;
-        font-weight: 600;
-        padding: 0.6rem 1.5rem;
-        border: none;
-        transition: all 0.3s ease;
-        width: 100%;
-        text-transform: uppercase;
-        letter-spacing: 0.5px;
-        font-size: 0.875rem;
-    }
-    
-    .stButton button:hover {
-        transform: translateY(-2px);
-        box-shadow: 0 6px 20px rgba(0, 0, 0, 0.15);
-    }
-    
-    /* Primary button (Clear Chat) */
-    [data-testid="stSidebar"] .stButton button {
-        background: linear-gradient(135deg, #ef4444 0%, #dc2626 100%);
-        color: white;
-    }
-    
-    [data-testid="stSidebar"] .stButton button:hover {
-        background: linear-gradient(135deg, #dc2626 0%, #b91c1c 100%);
-    }
-    
-    /* Main content area buttons */
-    .stButton button {
-        background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-        color: white;
-    }
-    
-    .stButton button:hover {
-        background: linear-gradient(135deg, #5a67d8 0%, #6b46a0 100%);
-    }
-    
-    /* Expander styling */
-    .streamlit-expanderHeader {
-        background-color: rgba(255, 255, 255, 0.1);
-        border-radius: 8px;
-        font-weight: 600;
-    }
-    
-    /* Warning and info boxes */
-    .stAlert {
-        border-radius: 12px;
-        border: none;
-        box-shadow: 0 2px 8px rgba(0, 0, 0, 0.1);
-    }
-    
-    /* Spinner */
-    .stSpinner > div {
-        border-top-color: #667eea !important;
-    }
-    
-    .stSpinner > div > div {
-        color: #667eea !important;
-        font-weight: 600;
-        font-size: 1rem;
-    }
-    
-    /* Footer */
-    .footer {
-        text-align: center;
-        color: #475569;
-        padding: 2rem 0 1rem 0;
-        font-size: 0.9rem;
-        border-top: 1px solid rgba(203, 213, 225, 0.5);
-        margin-top: 3rem;
-    }
-    
-    /* Stats badges */
-    .stats-container {
-        display: flex;
-        gap: 1rem;
-        margin: 1.5rem 0;
-        flex-wrap: wrap;
-    }
-    
-    .stat-badge {
-        background: rgba(255, 255, 255, 0.8);
-        padding: 0.75rem 1.25rem;
-        border-radius: 12px;
-        color: #334155;
-        font-size: 0.9rem;
-        font-weight: 500;
-        border: 1px solid rgba(203, 213, 225, 0.6);
-        backdrop-filter: blur(10px);
-    }
-    
-    .stat-badge strong {
-        color: #667eea;
-        margin-right: 0.5rem;
-    }
-    
-    /* Empty state */
-    .empty-state {
-        text-align: center;
-        padding: 3rem 2rem;
-        background: rgba(255, 255, 255, 0.7);
-        border-radius: 16px;
-        margin: 2rem 0;
-        border: 2px dashed #94a3b8;
-        backdrop-filter: blur(10px);
-    }
-    
-    .empty-state-icon {
-        font-size: 4rem;
-        margin-bottom: 1rem;
-    }
-    
-    .empty-state-text {
-        color: #1e293b;
-        font-size: 1.1rem;
-        margin-bottom: 0.5rem;
-        font-weight: 600;
-    }
-    
-    .empty-state-subtext {
-        color: #64748b;
-        font-size: 0.9rem;
-    }
-    
-    /* Scrollbar styling */
-    ::-webkit-scrollbar {
-        width: 8px;
-        height: 8px;
-    }
-    
-    ::-webkit-scrollbar-track {
-        background: #f1f5f9;
-    }
-    
-    ::-webkit-scrollbar-thumb {
-        background: #cbd5e1;
-        border-radius: 4px;
-    }
-    
-    ::-webkit-scrollbar-thumb:hover {
-        background: #94a3b8;
-    }
-    
-    /* Code blocks in messages */
-    .message-content code {
-        background: rgba(0, 0, 0, 0.1);
-        padding: 0.2rem 0.4rem;
-        border-radius: 4px;
-        font-family: 'Courier New', monospace;
-        font-size: 0.9em;
-    }
-    
-    .assistant-message code {
-        background: #f1f5f9;
-    }
-    
-    /* Links in messages */
-    .message-content a {
-        color: inherit;
-        text-decoration: underline;
-        font-weight: 500;
-    }
-    
-    .user-message a {
-        color: #fff;
-    }
-    
-    .assistant-message a {
-        color: #667eea;
-    }
-    </style>
-""", unsafe_allow_html=True)
+# Custom CSS for professional, modern styling, read from disk once per process
+st.markdown(page_styles(), unsafe_allow_html=True)
 
 # Initialize session state
 if 'messages' not in st.session_state:
-    st.session_state.messages = []
+    st.session_state.messages = ChatHistory()
 if 'api_key' not in st.session_state:
     # Try to load from environment variable first
     env_api_key = os.getenv('KIMI_API_KEY', '')
     st.session_state.api_key = env_api_key
 if 'model_name' not in st.session_state:
-    st.session_state.model_name = "kimi-k2-turbo-preview"
+    st.session_state.model_name = DEFAULT_MODEL
+if 'model_choice' not in st.session_state:
+    # The model selected in the settings form, which may be Auto
+    st.session_state.model_choice = DEFAULT_MODEL
+if 'auto_model' not in st.session_state:
+    st.session_state.auto_model = False
 if 'temperature' not in st.session_state:
     st.session_state.temperature = 0.6
 if 'max_tokens' not in st.session_state:
     st.session_state.max_tokens = 2000
 if 'total_messages' not in st.session_state:
     st.session_state.total_messages = 0
+if 'stream_responses' not in st.session_state:
+    st.session_state.stream_responses = True
+if 'turn_metrics' not in st.session_state:
+    st.session_state.turn_metrics = []
+if 'context_policy' not in st.session_state:
+    st.session_state.context_policy = "pinned_system"
+if 'cache_lookups' not in st.session_state:
+    st.session_state.cache_lookups = 0
+if 'cache_hits' not in st.session_state:
+    st.session_state.cache_hits = 0
+if 'cache_latency_saved' not in st.session_state:
+    st.session_state.cache_latency_saved = 0.0
+if 'history_pages' not in st.session_state:
+    st.session_state.history_pages = 0
+if 'compare_models' not in st.session_state:
+    st.session_state.compare_models = []
+if 'last_comparison' not in st.session_state:
+    st.session_state.last_comparison = []
+if 'documents' not in st.session_state:
+    # Attached documents by uploaded file id
+    st.session_state.documents = {}
+if 'conversation_id' not in st.session_state:
+    st.session_state.conversation_id = None
+if 'visitor' not in st.session_state:
+    # Saved conversations belong to a random id kept in the page URL, not to the API key,
+    # which every visitor shares when it comes from .env; the URL brings a visitor back to them
+    visitor = st.query_params.get('visitor', '')
+    if not re.fullmatch(r'[\w-]{22,64}', visitor):
+        visitor = secrets.token_urlsafe(16)
+        st.query_params['visitor'] = visitor
+    st.session_state.visitor = visitor
+if 'history_oldest_seq' not in st.session_state:
+    # Store sequence number of the oldest message held in session state
+    st.session_state.history_oldest_seq = 1
+if 'session_cost' not in st.session_state:
+    st.session_state.session_cost = 0.0
+if 'background_summary' not in st.session_state:
+    st.session_state.background_summary = True
+if 'session_id' not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex
+if 'run_log' not in st.session_state:
+    # Script runs of this session's recent actions, newest last
+    st.session_state.run_log = []
+
+# Chat history paging: newest messages always shown, older ones loaded on demand
+HISTORY_RECENT_MESSAGES = 40
+HISTORY_PAGE_SIZE = 50
+CONVERSATION_LIST_SIZE = 20
+# Turns kept for the session metrics panel
+TURN_METRICS_HISTORY = 50
+# Seconds between refreshes of a reply being generated
+GENERATION_POLL_INTERVAL = 0.1
+# Seconds a stopped reply waits for its request to wind down and report usage
+GENERATION_STOP_TIMEOUT = 2.0
+# User actions kept for the session's run counts
+RUN_LOG_HISTORY = 20
+
+@st.cache_resource
+def get_client_registry() -> ClientRegistry:
+    """Process-wide client registry; sessions using KIMI_API_KEY are balanced across KIMI_UPSTREAMS"""
+    balancer_config = BalancerConfig.from_env()
+    balancer = LoadBalancer(balancer_config) if balancer_config.upstreams else None
+    return ClientRegistry(ClientPoolConfig.from_env(), balancer)
+
+@st.cache_resource
+def get_context_manager() -> ContextWindowManager:
+    """Process-wide context manager, so token counts are shared across sessions"""
+    return ContextWindowManager()
+
+@st.cache_resource
+def get_shared_backend() -> Optional[SharedBackend]:
+    """Backend shared with the other replicas at KIMI_SHARED_URL, or None when running alone"""
+    return backend_from_env()
+
+@st.cache_resource
+def get_response_cache() -> ResponseCache:
+    """Process-wide response cache shared by all Streamlit sessions, and by every replica with a shared backend"""
+    return ResponseCache(ResponseCacheConfig.from_env(), get_shared_backend())
+
+@st.cache_resource
+def get_request_scheduler() -> RequestScheduler:
+    """Process-wide scheduler, so per-key limits hold across all sessions"""
+    scheduler = RequestScheduler(SchedulerConfig.from_env(), get_shared_backend())
+    balancer = get_client_registry().balancer
+    if balancer is not None:
+        # The balanced client's key stands for every key in the pool
+        scheduler.scale_key(balancer.config.pool_key, len(balancer.upstreams))
+    return scheduler
+
+@st.cache_resource
+def get_coalescer() -> Optional[RequestCoalescer]:
+    """Process-wide single-flight layer, or None when KIMI_COALESCE=0"""
+    config = CoalescerConfig.from_env()
+    return RequestCoalescer(config) if config.enabled else None
+
+@st.cache_resource
+def get_metrics_registry() -> MetricsRegistry:
+    """Process-wide turn metrics, served to Prometheus when KIMI_METRICS_PORT is set"""
+    registry = MetricsRegistry()
+    config = TelemetryConfig.from_env()
+    if config.metrics_port:
+        start_metrics_server(registry, config.metrics_port, config.metrics_host)
+    return registry
+
+@st.cache_resource
+def get_summarizer() -> ConversationSummarizer:
+    """Process-wide summarizer; its worker threads serve every session"""
+    return ConversationSummarizer(SummarizerConfig.from_env(), get_request_scheduler())
+
+@st.cache_resource
+def get_conversation_store() -> Optional[ConversationStore]:
+    """Process-wide conversation store, or None when KIMI_STORE=none"""
+    return store_from_env(get_shared_backend())
+
+@st.cache_resource
+def get_prefetcher() -> Prefetcher:
+    """Process-wide prefetcher holding ready answers for the starter prompts"""
+    return Prefetcher(PrefetchConfig.from_env(), get_request_scheduler())
+
+@st.cache_resource
+def get_document_library() -> DocumentLibrary:
+    """Process-wide document indexes on disk, shared by every session that attaches the same file"""
+    return DocumentLibrary(RetrievalConfig.from_env())
+
+@st.cache_resource
+def get_model_router() -> ModelRouter:
+    """Process-wide model router; every session's turns feed its latency stats"""
+    config = RouterConfig.from_env()
+    if config.log_decisions:
+        log_to_stderr()
+    return ModelRouter(config, counter=get_context_manager().counter)
+
+@st.cache_resource
+def get_run_tracker() -> RunTracker:
+    """Process-wide script runs per user action, for the admin page"""
+    return RunTracker()
 
-def initialize_openai_client(api_key: str) -> openai.OpenAI:
-    """Initialize OpenAI client with Kimi API configuration"""
+@st.cache_resource
+def get_tracer() -> Tracer:
+    """Process-wide tracer, writing spans and slow-turn profiles when KIMI_TRACE=1"""
+    default_tracer.configure(TracingConfig.from_env())
+    return default_tracer
+
+def trim_session_state(state: MutableMapping, keep: int) -> int:
+    """Drop all but the newest ``keep`` messages from a session's state
+
+    Takes the state rather than using st.session_state, so the idle sweeper
+    can trim other sessions from its own thread. Stored conversations can
+    page the dropped messages back in.
+    """
+    messages = state["messages"]
+    drop = len(messages) - keep
+    if drop <= 0:
+        return 0
+    state["messages"] = messages[drop:]
+    state["history_oldest_seq"] = state["history_oldest_seq"] + drop
+    state["history_pages"] = 0
+    return drop
+
+@st.cache_resource
+def get_session_registry() -> SessionRegistry:
+    """Process-wide session memory accounting; its sweeper trims idle sessions"""
+    return SessionRegistry(SessionLimitsConfig.from_env(), trim_session_state)
+
+def enforce_session_limits():
+    """Drop the oldest messages from session state once it is over the per-session caps"""
+    registry = get_session_registry()
+    overflow = messages_over_limit(
+        st.session_state.messages, registry.config.max_messages, registry.config.max_bytes
+    )
+    if overflow:
+        trim_session_state(st.session_state, len(st.session_state.messages) - overflow)
+        registry.record_trim(st.session_state.session_id, overflow)
+
+def touch_session():
+    """Account for this session's memory; sessions left idle are trimmed in the background"""
+    get_session_registry().touch(
+        st.session_state.session_id,
+        get_script_run_ctx().session_state,
+        st.session_state.messages,
+        bool(st.session_state.api_key)
+    )
+
+def user_action(name: str, handler: Optional[Callable] = None, *args):
+    """Widget callback naming the user action behind the runs that follow, then handling it"""
+    st.session_state.new_action = name
+    if handler is not None:
+        handler(*args)
+
+def begin_run() -> ActionRuns:
+    """Attribute this script run to the action that caused it, whose runs it returns
+
+    Runs no callback has named since the last action, such as the rerun
+    after a reply was preempted, count toward that action.
+    """
+    action = st.session_state.pop('new_action', None)
+    if action is not None or not st.session_state.run_log:
+        st.session_state.run_log.append(ActionRuns(action or PAGE_LOAD))
+        del st.session_state.run_log[:-RUN_LOG_HISTORY]
+        get_run_tracker().begin(action or PAGE_LOAD)
+    return st.session_state.run_log[-1]
+
+def end_run(action: ActionRuns, started: float, partial: bool):
+    """Add this run's script time to the action that caused it
+
+    Leaves session state alone, since a run being stopped can't read it.
+    """
+    seconds = time.perf_counter() - started
+    action.add(partial, seconds)
+    get_run_tracker().record(action.action, partial, seconds)
+    get_tracer().complete("script run", started, action=action.action, partial=partial)
+
+def append_message(role: str, content: str):
+    """Add a message to the chat and write it through to the conversation store"""
+    st.session_state.messages.append(ChatMessage(role, content))
+    st.session_state.total_messages += 1
+    store = get_conversation_store()
+    if store is None:
+        if st.session_state.conversation_id is None:
+            # Unsaved chats still need an id to keep their summary under
+            st.session_state.conversation_id = uuid.uuid4().hex
+        enforce_session_limits()
+        return
     try:
-        client = openai.OpenAI(
-            api_key=api_key,
-            base_url="https://api.moonshot.ai/v1"
-        )
-        return client
+        if st.session_state.conversation_id is None:
+            st.session_state.conversation_id = store.create_conversation(
+                owner_id(st.session_state.visitor), make_title(content)
+            )
+        store.append_message(st.session_state.conversation_id, role, content)
     except Exception as e:
-        st.error(f"Failed to initialize OpenAI client: {str(e)}")
+        st.warning(f"Couldn't save message: {str(e)}")
+        return
+    # Older messages stay in the store and are paged back in on demand
+    enforce_session_limits()
+
+def discard_pending_turn():
+    """Stop a reply that is still being generated, without adding it to the chat"""
+    turn = st.session_state.pop('pending_turn', None)
+    if turn is not None:
+        turn["generation"].cancel()
+
+def open_conversation(conversation_id: Optional[str]):
+    """Switch to a stored conversation, loading only its newest messages"""
+    discard_pending_turn()
+    messages, oldest_seq = [], 1
+    store = get_conversation_store()
+    if conversation_id is not None and store is not None:
+        messages, oldest_seq = store.load_page(conversation_id, HISTORY_RECENT_MESSAGES)
+    st.session_state.conversation_id = conversation_id
+    st.session_state.messages = ChatHistory(messages)
+    st.session_state.history_oldest_seq = max(oldest_seq, 1)
+    st.session_state.total_messages = 0
+    st.session_state.turn_metrics = []
+    st.session_state.history_pages = 0
+    st.session_state.last_comparison = []
+
+def load_older_messages():
+    """Reveal the next page of history, fetching it from the store once session state runs out"""
+    _, hidden_count = visible_history(
+        st.session_state.messages, HISTORY_RECENT_MESSAGES, HISTORY_PAGE_SIZE, st.session_state.history_pages
+    )
+    store = get_conversation_store()
+    if not hidden_count and store is not None and st.session_state.conversation_id is not None:
+        older, oldest_seq = store.load_page(
+            st.session_state.conversation_id, HISTORY_PAGE_SIZE, st.session_state.history_oldest_seq
+        )
+        st.session_state.messages[:0] = older
+        if older:
+            st.session_state.history_oldest_seq = oldest_seq
+    st.session_state.history_pages += 1
+
+def stored_messages_loader(conversation_id: Optional[str]) -> Optional[MessageLoader]:
+    """Loads messages trimmed from the session back from the store, for the summarizer"""
+    store = get_conversation_store()
+    if store is None or conversation_id is None:
         return None
+    # Positions are 0-based and sequence numbers 1-based, so [start, end) are the messages before seq end + 1
+    return lambda start, end: store.load_page(conversation_id, end - start, end + 1)[0]
 
-def get_kimi_response(client: openai.OpenAI, messages: List[Dict[str, str]], 
-                     model: str, temperature: float, max_tokens: int) -> str:
-    """Get response from Kimi AI API"""
+def attach_documents(uploads: List) -> List[str]:
+    """Index newly uploaded files and forget removed ones; returns errors for files that couldn't be attached"""
+    attached = st.session_state.documents
+    errors = []
+    for upload in uploads:
+        if upload.file_id in attached:
+            continue
+        try:
+            with st.spinner(f"Indexing {upload.name}..."):
+                attached[upload.file_id] = get_document_library().add(
+                    upload.name, upload.getvalue().decode("utf-8", errors="replace")
+                )
+        except (ValueError, OSError) as e:
+            errors.append(str(e))
+    current = {upload.file_id for upload in uploads}
+    for file_id in [file_id for file_id in attached if file_id not in current]:
+        del attached[file_id]
+    return errors
+
+def initialize_openai_client(api_key: str) -> Optional["openai.OpenAI"]:
+    """Get the pooled OpenAI client for the Kimi API configuration"""
     try:
-        # Add system message if not present
-        if not messages or messages[0].get("role") != "system":
-            system_message = {
-                "role": "system", 
-                "content": "You are Kimi, an AI assistant created by Moonshot AI."
-            }
-            messages = [system_message] + messages
-        
-        response = client.chat.completions.create(
-            model=model,
-            messages=messages,
-            temperature=temperature,
-            max_tokens=max_tokens,
-            stream=False
-        )
-        return response.choices[0].message.content
-    except openai.AuthenticationError as e:
-        error_msg = "**Authentication Error** ❌\n\n"
-        error_msg += "Your API key is invalid or not activated.\n\n"
-        error_msg += "**Troubleshooting Steps:**\n"
-        error_msg += "1. Verify your API key at [platform.moonshot.ai](https://platform.moonshot.ai)\n"
-        error_msg += "2. Ensure your account has credits (minimum $1)\n"
-        error_msg += "3. Check if the API key is active and not expired\n"
-        error_msg += "4. Try generating a new API key\n\n"
-        error_msg += f"_Error details: {str(e)}_"
-        return error_msg
-    except openai.APIError as e:
-        return f"**API Error** ❌\n\n{str(e)}\n\nPlease try again or contact support."
-    except openai.APIConnectionError as e:
-        return f"**Connection Error** ❌\n\nCouldn't connect to Kimi AI servers.\n\n{str(e)}"
-    except openai.RateLimitError as e:
-        return f"**Rate Limit Error** ❌\n\nYou've exceeded the rate limit.\n\n{str(e)}"
+        return get_client_registry().get(api_key)
     except Exception as e:
-        return f"**Unexpected Error** ❌\n\n{str(e)}"
+        st.error(f"Failed to initialize OpenAI client: {str(e)}")
+        return None
 
-def display_chat_message(role: str, content: str):
+def display_chat_message(role: str, content: str, placeholder=None):
     """Display a chat message with professional styling"""
-    if role == "user":
-        st.markdown(f"""
-            <div class="chat-message user-message">
-                <div class="message-header">
-                    <span>👤</span>
-                    <span>You</span>
-                </div>
-                <div class="message-content">{content}</div>
-            </div>
-        """, unsafe_allow_html=True)
+    target = placeholder if placeholder is not None else st
+    with get_tracer().span("render message", role=role, chars=len(content)):
+        target.markdown(render_message_html(role, content), unsafe_allow_html=True)
+
+def display_streaming_message(renderer: MarkdownRenderer, text: str, placeholder):
+    """Redraw a reply that is still arriving, with a cursor; only lines that changed are converted"""
+    with get_tracer().span("render message", role="assistant", chars=len(text), streaming=True):
+        placeholder.markdown(render_streaming_html(renderer, text + " ▌"), unsafe_allow_html=True)
+
+def finish_turn(response: str, turn_metrics: Dict, context_stats: Dict, context_time: float,
+                cache_key: Optional[str] = None, route: Optional[RouteDecision] = None):
+    """Record a finished turn's metrics and add the reply to the chat"""
+    finish_start = time.perf_counter()
+    if cache_key and turn_metrics and not turn_metrics["error"] and not turn_metrics.get("stopped"):
+        get_response_cache().put(cache_key, response, turn_metrics["total"])
+    
+    if turn_metrics:
+        # Context selection is part of building the request
+        turn_metrics["build"] += context_time
+        turn_metrics["context"] = context_stats
+        turn_metrics["prompt_tokens_saved"] = context_stats.get("summary_tokens_saved", 0)
+        # Summaries made since the last turn were paid for too; count them with the turn that used them
+        summary_usage = get_summarizer().take_usage(st.session_state.conversation_id)
+        for usage in summary_usage:
+            get_metrics_registry().observe(usage)
+        turn_metrics["summary_cost"] = sum(usage["cost"] for usage in summary_usage)
+        st.session_state.session_cost += turn_metrics["cost"] + turn_metrics["summary_cost"]
+        if route is not None:
+            turn_metrics["route"] = get_model_router().record(route, turn_metrics)
+        if turn_metrics["mode"] != "compare":
+            get_metrics_registry().observe(turn_metrics)
+            get_model_router().observe(turn_metrics)
+        record_turn_span(turn_metrics, st.session_state.conversation_id, st.session_state.session_cost)
+        get_tracer().annotate(model=turn_metrics["model"], mode=turn_metrics["mode"], ttft=turn_metrics["ttft"],
+                              total=turn_metrics["total"], completion_tokens=turn_metrics["completion_tokens"])
+        st.session_state.turn_metrics.append(turn_metrics)
+        del st.session_state.turn_metrics[:-TURN_METRICS_HISTORY]
+    
+    # Add assistant response to history
+    append_message("assistant", response)
+    
+    # Fold turns that have aged out of the recent window into the summary, off the request path
+    if st.session_state.background_summary:
+        client = initialize_openai_client(st.session_state.api_key)
+        if client is not None:
+            get_summarizer().schedule(
+                st.session_state.conversation_id,
+                client,
+                st.session_state.messages,
+                st.session_state.history_oldest_seq - 1,
+                load_messages=stored_messages_loader(st.session_state.conversation_id)
+            )
+    get_tracer().complete("finish turn", finish_start)
+
+def stop_generation(turn: Dict):
+    """Stop the reply being generated, keeping what has arrived so far in the chat"""
+    generation = turn["generation"]
+    text = generation.cancel()
+    # The request is closed at its next delta; give it a moment to record what it used
+    generation.wait(GENERATION_STOP_TIMEOUT)
+    turn_metrics = dict(generation.metrics)
+    if not turn_metrics:
+        # A blocking request can't be cut short; it is still running and its usage is not known yet
+        record_turn_metrics(turn_metrics, "stream" if turn["stream"] else "blocking", turn["model"],
+                            turn["started"], None, 0)
+    turn_metrics["stopped"] = True
+    # Upper bound: the reply could have ended on its own before max_tokens; a blocking request runs to the end anyway
+    turn_metrics["completion_tokens_saved"] = (max(turn["max_tokens"] - turn_metrics["completion_tokens"], 0)
+                                               if turn["stream"] else 0)
+    del st.session_state.pending_turn
+    finish_turn(text + "\n\n_⏹️ Stopped early._" if text else "_⏹️ Stopped before Kimi AI replied._",
+                turn_metrics, turn["context_stats"], turn["context_time"], route=turn["route"])
+
+def stream_pending_turn():
+    """Show the reply being generated until it finishes, within this run
+
+    The chat input's stop button stops the run, which stops the reply; the
+    next run adds it to the chat as far as it got. A full rerun ends this
+    run without stopping it, and the next run picks the reply up.
+    """
+    turn = st.session_state.pending_turn
+    generation = turn["generation"]
+    placeholder = st.empty()
+    renderer = MarkdownRenderer()
+    stream_start = time.perf_counter()
+    try:
+        # Redrawn on every poll, even before the first token, since a stop only lands when the script draws
+        while not generation.wait(GENERATION_POLL_INTERVAL):
+            text = generation.text
+            if turn["stream"] and text:
+                display_streaming_message(renderer, text, placeholder)
+            else:
+                placeholder.caption(f"🤖 Kimi AI is thinking... {time.perf_counter() - turn['started']:.1f}s")
+    except StopException:
+        # Session state can't be touched once the run is stopping, but the reply can
+        generation.cancel()
+        raise
+    finally:
+        get_tracer().complete("stream reply", stream_start)
+    del st.session_state.pending_turn
+    finish_turn(generation.text, dict(generation.metrics), turn["context_stats"], turn["context_time"],
+                turn["cache_key"], turn["route"])
+    display_chat_message("assistant", st.session_state.messages[-1]["content"], placeholder)
+
+def use_different_key():
+    """Swap the key loaded from .env for one typed into the sidebar"""
+    st.session_state.api_key_input_override = True
+
+def use_api_key():
+    """Take the key typed into the sidebar, leaving the current one when the field is cleared"""
+    if st.session_state.api_key_input:
+        st.session_state.api_key = st.session_state.api_key_input
+
+def apply_settings():
+    """Apply the settings form; the other settings are bound to session state by their keys"""
+    # With Auto, model_name is the model the last message was routed to
+    st.session_state.auto_model = st.session_state.model_choice == AUTO_MODEL
+    if not st.session_state.auto_model:
+        st.session_state.model_name = st.session_state.model_choice
+
+def clear_chat():
+    """Delete the current conversation and start an empty one"""
+    store = get_conversation_store()
+    if st.session_state.conversation_id is not None:
+        get_summarizer().forget(st.session_state.conversation_id)
+        if store is not None:
+            store.delete_conversation(st.session_state.conversation_id)
+    open_conversation(None)
+    st.session_state.cache_lookups = 0
+    st.session_state.cache_hits = 0
+    st.session_state.cache_latency_saved = 0.0
+
+def choose_starter_prompt(prompt: str):
+    """Send a suggested prompt as the next message"""
+    st.session_state.suggested_prompt = prompt
+
+touch_session()
+
+def render_admin_page():
+    """Process-wide memory and cache totals for operators"""
+    st.title("🛠️ Admin")
+    registry = get_session_registry()
+    session_stats = registry.stats()
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Sessions", f"{session_stats['sessions']:,}")
+    col2.metric("Idle", f"{session_stats['idle']:,}")
+    col3.metric("Process RSS", f"{process_rss_bytes() / 1e6:.0f} MB")
+    col4.metric("Message Memory", f"{session_stats['message_bytes'] / 1e6:.1f} MB")
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Messages Held", f"{session_stats['messages']:,}")
+    col2.metric("Tokens Held", f"{session_stats['tokens']:,}")
+    col3.metric("Sessions With Key", f"{session_stats['with_client']:,}")
+    col4.metric("Messages Trimmed", f"{session_stats['messages_trimmed']:,}")
+    st.caption(f"Idle sweeper: {session_stats['sweeps']} sweeps, {session_stats['idle_trims']} sessions trimmed; "
+               f"sessions idle for {registry.config.idle_timeout:.0f}s keep their newest "
+               f"{registry.config.idle_keep_messages} messages")
+    
+    pool_stats = get_client_registry().stats()
+    cache_stats = get_response_cache().stats()
+    prefetch_stats = get_prefetcher().stats()
+    prefetched = f"Prefetched answers: {prefetch_stats['answers']} · " if prefetch_stats["enabled"] else ""
+    summary_stats = get_summarizer().stats()
+    st.caption(f"Pooled clients: {pool_stats['size']} · Response cache: {cache_stats['size']} entries · "
+               f"Token counts cached: {get_context_manager().counter.stats()['entries']:,} · "
+               f"Summaries: {summary_stats['conversations']} (${summary_stats['cost_usd']:.4f}, "
+               f"{summary_stats['gap_messages']:,} messages missed) · {prefetched}"
+               f"Documents open: {get_document_library().stats()['open']}")
+    backend = get_shared_backend()
+    if backend is not None:
+        backend_stats = backend.stats()
+        st.caption(f"Shared {backend_stats['backend']} backend: {backend_stats['operations']:,} operations, "
+                   f"{backend_stats['avg_ms']:.2f} ms average · "
+                   f"{cache_stats['shared_hits']:,} cache hits from other replicas")
+    trace_stats = get_tracer().stats()
+    if trace_stats['enabled']:
+        st.caption(f"Tracing to {trace_stats['path'] or get_tracer().config.directory}: "
+                   f"{trace_stats['turns']:,} turns, {trace_stats['spans']:,} events · "
+                   f"{trace_stats['profiles_kept']} {trace_stats['profiler']} profiles kept of the slowest "
+                   f"{get_tracer().config.profile_percent:g}% of turns")
+    
+    if st.button("🧹 Sweep idle sessions now"):
+        st.toast(f"Trimmed {registry.sweep()} idle sessions")
+    
+    st.subheader("Largest Sessions")
+    st.dataframe([{
+        "session": account.session_id[:8],
+        "messages": account.messages,
+        "KB": round(account.message_bytes / 1024, 1),
+        "tokens": account.tokens,
+        "idle (s)": round(time.monotonic() - account.last_active),
+        "trimmed": account.trimmed,
+    } for account in registry.accounts()[:50]])
+    
+    st.subheader("Model Routing")
+    st.caption(f"Auto targets {get_model_router().config.latency_target:g}s replies; "
+               "models without enough measured turns are routed on priors")
+    st.dataframe([{
+        "model": row["model"],
+        "tier": row["tier"],
+        "turns measured": row["samples"],
+        "first token (s)": round(row["ttft"], 2),
+        "tokens/sec": round(row["tokens_per_sec"], 1),
+        "measured": row["measured"],
+        "routed": row["routed"],
+    } for row in get_model_router().model_stats()])
+    
+    st.subheader("Script Runs")
+    run_stats = get_run_tracker().stats()
+    st.caption(f"{run_stats['actions']:,} user actions caused {run_stats['full_runs']:,} full and "
+               f"{run_stats['partial_runs']:,} partial runs; script time includes replies streamed within a run")
+    st.dataframe([{
+        "action": row["action"],
+        "count": row["count"],
+        "full runs": round(row["full_runs"], 2),
+        "partial runs": round(row["partial_runs"], 2),
+        "script time (s)": round(row["script_time"], 3),
+    } for row in get_run_tracker().action_stats()])
+
+# Process-wide totals for operators, at ?admin=<KIMI_ADMIN_TOKEN>
+admin_token = os.getenv('KIMI_ADMIN_TOKEN', '')
+if admin_token and hmac.compare_digest(st.query_params.get('admin', ''), admin_token):
+    render_admin_page()
+    st.stop()
+
+run_started = time.perf_counter()
+run_action = begin_run()
+
+def render_session_panel():
+    """Session stats, chat actions and stored conversations, redrawn by the chat after every turn"""
+    # Session statistics
+    st.subheader("📊 Session Stats")
+    col1, col2 = st.columns(2)
+    with col1:
+        st.metric("Messages", len(st.session_state.messages))
+    with col2:
+        st.metric("Model", st.session_state.model_name.split('-')[1].upper())
+    
+    if st.session_state.turn_metrics:
+        last_turn = st.session_state.turn_metrics[-1]
+        col1, col2 = st.columns(2)
+        with col1:
+            st.metric("First Token", f"{last_turn['ttft']:.2f}s")
+        with col2:
+            st.metric("Tokens/sec", f"{last_turn['tokens_per_sec']:.1f}")
+        st.caption(f"Last turn: {last_turn['mode']} mode, {last_turn['total']:.2f}s total")
+        timings = [f"{phase} {last_turn[phase]:.2f}s" for phase in ("build", "queue", "network")
+                   if last_turn.get(phase) is not None]
+        if timings:
+            st.caption("Breakdown: " + ", ".join(timings))
+        if "context" in last_turn:
+            context = last_turn["context"]
+            st.caption(f"Context: {context['prompt_tokens']:,} / {context['budget']:,} tokens, "
+                       f"{context['dropped_messages']} older messages trimmed")
+            if "excerpts" in context:
+                st.caption(f"Documents: {context['excerpts']} excerpts, {context['excerpt_tokens']:,} tokens "
+                           f"sent instead of {context['document_tokens']:,}")
+            if context.get("summary_tokens_saved") or last_turn.get("summary_cost"):
+                st.caption(f"Summary saved {context.get('summary_tokens_saved', 0):,} prompt tokens "
+                           f"for ${last_turn.get('summary_cost', 0.0):.4f} of summarizing")
+        if "route" in last_turn:
+            route = last_turn["route"]
+            if route["latency_saved"] is None:
+                saved = f"expected to be {route['expected_latency_saved']:.1f}s faster than {route['baseline']}"
+            else:
+                saved = f"{route['latency_saved']:.1f}s faster than {route['baseline']} has been"
+            st.caption(f"Auto picked {route['model']} for a {route['complexity']} request, {saved}")
+        if last_turn.get("stopped"):
+            st.caption(f"Stopped early after {last_turn['completion_tokens']:,} tokens, "
+                       f"saving up to {last_turn['completion_tokens_saved']:,} completion tokens")
+    
+    if len(st.session_state.turn_metrics) > 1:
+        with st.expander("📈 Turn History", expanded=False):
+            turns = st.session_state.turn_metrics
+            st.metric("First Token", f"{turns[-1]['ttft']:.2f}s",
+                      chart_data=[turn["ttft"] for turn in turns], chart_type="line")
+            st.metric("Total Latency", f"{turns[-1]['total']:.2f}s",
+                      chart_data=[turn["total"] for turn in turns], chart_type="line")
+            st.metric("Tokens", f"{(turns[-1]['prompt_tokens'] or 0) + turns[-1]['completion_tokens']:,}",
+                      chart_data=[(turn["prompt_tokens"] or 0) + turn["completion_tokens"] for turn in turns],
+                      chart_type="bar")
+            st.metric("Cost", f"${turns[-1]['cost']:.4f}",
+                      chart_data=[turn["cost"] for turn in turns], chart_type="bar")
+            st.metric("Tokens Saved", f"{turns[-1].get('prompt_tokens_saved', 0):,}",
+                      chart_data=[turn.get("prompt_tokens_saved", 0) for turn in turns], chart_type="bar",
+                      help="Prompt tokens the rolling summary saved on each turn")
+    
+    if st.session_state.session_cost:
+        st.caption(f"Estimated session cost: ${st.session_state.session_cost:.4f}")
+    
+    # What the last click or message cost in script runs
+    last_action = st.session_state.run_log[-1]
+    st.caption(f"Last action ({last_action.action}): {last_action.full_runs} full and "
+               f"{last_action.partial_runs} partial runs, {last_action.script_time:.2f}s of script time")
+    
+    if st.session_state.cache_lookups:
+        col1, col2 = st.columns(2)
+        with col1:
+            hit_ratio = st.session_state.cache_hits / st.session_state.cache_lookups
+            st.metric("Cache Hits", f"{hit_ratio:.0%}")
+        with col2:
+            st.metric("Time Saved", f"{st.session_state.cache_latency_saved:.1f}s")
+    
+    scheduler_stats = get_request_scheduler().stats()
+    if scheduler_stats["retries"] or scheduler_stats["throttles"] or scheduler_stats["rejected"]:
+        st.caption(f"Scheduler: {scheduler_stats['retries']} retries, {scheduler_stats['throttles']} throttled, "
+                   f"{scheduler_stats['rejected']} rejected, avg queue wait {scheduler_stats['queue_wait_avg']:.2f}s")
+    
+    coalescer = get_coalescer()
+    coalesce_stats = coalescer.stats() if coalescer is not None else None
+    if coalesce_stats and coalesce_stats["coalesced"]:
+        st.caption(f"Shared requests: {coalesce_stats['coalesced']} duplicates joined an in-flight call, "
+                   f"{coalesce_stats['calls']} calls made")
+    
+    prefetch_stats = get_prefetcher().stats()
+    if prefetch_stats["enabled"] and (prefetch_stats["hits"] or prefetch_stats["misses"]):
+        st.caption(f"Starter prompts: {prefetch_stats['hit_rate']:.0%} answered from prefetch "
+                   f"({prefetch_stats['hits']} of {prefetch_stats['hits'] + prefetch_stats['misses']} clicks), "
+                   f"${prefetch_stats['cost_usd']:.4f} spent prefetching")
+    
+    router_stats = get_model_router().stats()
+    if router_stats["routed"]:
+        cost_change = "saved" if router_stats["cost_saved"] >= 0 else "extra"
+        st.caption(f"Auto routing: {router_stats['routed']} messages routed; against "
+                   f"{get_model_router().config.baseline_model}, {router_stats['latency_saved']:.0f}s saved over "
+                   f"{router_stats['measured']} timed and ${abs(router_stats['cost_saved']):.4f} {cost_change} "
+                   f"over {router_stats['cost_measured']} billed")
+    
+    pool_stats = get_client_registry().stats()
+    st.caption(f"Client pool: {pool_stats['hits']} hits / {pool_stats['misses']} misses, {pool_stats['size']} open")
+    
+    balancer = get_client_registry().balancer
+    if balancer is not None:
+        with st.expander("🔀 Upstreams", expanded=False):
+            for upstream in balancer.stats():
+                status = "🟢" if upstream["healthy"] else "🔴"
+                st.caption(f"{status} {upstream['name']}: {upstream['utilization']:.0%} of quota used, "
+                           f"{upstream['in_flight']} in flight, {upstream['requests']} requests, "
+                           f"{upstream['failures']} failures")
+    
+    st.markdown("---")
+    
+    # Action buttons
+    st.button("🗑️ Clear Chat", use_container_width=True, type="primary",
+              on_click=user_action, args=("clear chat", clear_chat))
+    
+    # Stored conversations, most recent first
+    conversation_store = get_conversation_store()
+    if conversation_store is not None and st.session_state.api_key:
+        st.markdown("---")
+        st.subheader("💬 Conversations")
+        st.button("➕ New Chat", use_container_width=True, key="new_chat",
+                  on_click=user_action, args=("new chat", open_conversation, None))
+        for conversation in conversation_store.list_conversations(
+            owner_id(st.session_state.visitor), CONVERSATION_LIST_SIZE
+        ):
+            is_current = conversation.id == st.session_state.conversation_id
+            st.button(
+                f"{'▶️ ' if is_current else ''}{conversation.title}",
+                key=f"conversation_{conversation.id}",
+                use_container_width=True,
+                help=f"{conversation.message_count} messages",
+                on_click=None if is_current else user_action,
+                args=None if is_current else ("open conversation", open_conversation, conversation.id)
+            )
+
+def render_config_badges():
+    """The model and sampling settings the next message is sent with"""
+    st.markdown(f"""
+        <div class="stats-container">
+            <div class="stat-badge"><strong>Model:</strong> {st.session_state.model_name}</div>
+            <div class="stat-badge"><strong>Temperature:</strong> {st.session_state.temperature}</div>
+            <div class="stat-badge"><strong>Max Tokens:</strong> {st.session_state.max_tokens}</div>
+        </div>
+    """, unsafe_allow_html=True)
+
+def run_turn(user_input: str, starter_prompt: bool):
+    """Send a message and show its reply below the chat, all within the current run"""
+    # Created on the first message rather than on page load, since it imports the OpenAI SDK
+    client = initialize_openai_client(st.session_state.api_key)
+    if client is None:
+        st.stop()
+    
+    # Add user message to history
+    append_message("user", user_input)
+    display_chat_message("user", user_input)
+    
+    # A starter prompt opening a chat may already have a prefetched answer
+    prefetched = None
+    if (starter_prompt and get_prefetcher().config.enabled and not st.session_state.compare_models
+            and not st.session_state.documents and len(st.session_state.messages) == 1):
+        lookup_start = time.perf_counter()
+        prefetched = get_prefetcher().take(
+            st.session_state.api_key,
+            user_input,
+            st.session_state.model_name,
+            st.session_state.temperature,
+            st.session_state.max_tokens
+        )
+        get_tracer().complete("prefetch lookup", lookup_start, hit=prefetched is not None)
+    
+    # Prepare messages for API
+    build_start = time.perf_counter()
+    context_manager = get_context_manager()
+    context_stats = {}
+    history = build_api_messages(st.session_state.messages)
+    if st.session_state.background_summary:
+        # Older turns that the background summarizer has condensed are sent as its summary
+        history = get_summarizer().condense(
+            st.session_state.conversation_id,
+            history,
+            st.session_state.history_oldest_seq - 1,
+            stats=context_stats
+        )
+    if st.session_state.documents:
+        # Only the parts of the attached documents that match this message are sent
+        documents = list(st.session_state.documents.values())
+        excerpts = get_document_library().search(documents, user_input)
+        history = with_excerpts(history, excerpts)
+        context_stats["excerpts"] = len(excerpts)
+        context_stats["excerpt_tokens"] = sum(estimate_tokens(excerpt.text) for excerpt in excerpts)
+        context_stats["document_tokens"] = sum(document.tokens for document in documents)
+    
+    # With Auto, send the message to the fastest model that is good enough for it
+    route = None
+    if st.session_state.auto_model and prefetched is None:
+        route = get_model_router().route(history, st.session_state.max_tokens)
+        st.session_state.model_name = route.model
+    turn_models = [st.session_state.model_name] + [
+        model for model in st.session_state.compare_models if model != st.session_state.model_name
+    ]
+    
+    # Trimmed to fit the smallest context window in use
+    context_model = min(
+        turn_models,
+        key=lambda model: context_manager.budget(model, st.session_state.max_tokens)
+    )
+    api_messages = context_manager.select(
+        history,
+        context_model,
+        st.session_state.max_tokens,
+        policy=CONTEXT_POLICIES[st.session_state.context_policy](),
+        stats=context_stats
+    )
+    context_time = time.perf_counter() - build_start
+    get_tracer().complete("build context", build_start, messages=len(api_messages))
+    turn_metrics = {}
+    
+    # Serve repeated low-temperature prompts from the response cache
+    response_cache = get_response_cache()
+    cache_key = None
+    cached = None
+    if response_cache.cacheable(st.session_state.temperature) and len(turn_models) == 1 and prefetched is None:
+        lookup_start = time.perf_counter()
+        cache_key = response_key(
+            st.session_state.api_key,
+            st.session_state.model_name,
+            st.session_state.temperature,
+            st.session_state.max_tokens,
+            api_messages
+        )
+        cached = response_cache.get(cache_key)
+        get_tracer().complete("cache lookup", lookup_start, hit=cached is not None)
+        st.session_state.cache_lookups += 1
+    
+    if prefetched is not None:
+        response = prefetched.content
+        record_turn_metrics(turn_metrics, "prefetch", st.session_state.model_name, lookup_start, None, 0)
+    elif cached is not None:
+        response = cached.content
+        st.session_state.cache_hits += 1
+        st.session_state.cache_latency_saved += cached.latency
+        record_turn_metrics(turn_metrics, "cache", st.session_state.model_name, lookup_start, None, 0)
+    elif len(turn_models) > 1:
+        # Send the prompt to every model at once, each streaming into its own column
+        placeholders = {}
+        renderers = {model: MarkdownRenderer() for model in turn_models}
+        for column, model in zip(st.columns(len(turn_models)), turn_models):
+            column.caption(f"**{model}**")
+            placeholders[model] = column.empty()
+        results = fan_out(
+            client,
+            turn_models,
+            api_messages,
+            st.session_state.temperature,
+            st.session_state.max_tokens,
+            on_delta=lambda model, text: display_streaming_message(renderers[model], text, placeholders[model]),
+            scheduler=get_request_scheduler()
+        )
+        for result in results:
+            st.session_state.last_comparison.append({
+                "model": result.model,
+                "content": result.content,
+                "latency": result.latency,
+                "completion_tokens": result.completion_tokens,
+            })
+        model_metrics = [dict(result.metrics, mode="compare") for result in results]
+        # Each model is exported on its own; the session sees the turn's total spend
+        for metrics in model_metrics:
+            get_metrics_registry().observe(metrics)
+            get_model_router().observe(metrics)
+        for placeholder, result in zip(placeholders.values(), st.session_state.last_comparison):
+            display_chat_message("assistant", result["content"], placeholder)
+        # The selected model's answer is the one kept in the conversation
+        response = st.session_state.last_comparison[0]["content"]
+        turn_metrics.update(model_metrics[0])
+        turn_metrics["cost"] = sum(metrics["cost"] for metrics in model_metrics)
     else:
-        st.markdown(f"""
-            <div class="chat-message assistant-message">
-                <div class="message-header">
-                    <span>🤖</span>
-                    <span>Kimi AI</span>
-                </div>
-                <div class="message-content">{content}</div>
-            </div>
-        """, unsafe_allow_html=True)
+        # Generate on a worker thread, so a stop or a full rerun can end this run while the reply carries on
+        # Session state belongs to the script thread, so the worker gets plain values
+        model = st.session_state.model_name
+        temperature = st.session_state.temperature
+        max_tokens = st.session_state.max_tokens
+        scheduler = get_request_scheduler()
+        coalescer = get_coalescer()
+        stream = st.session_state.stream_responses
+        if stream:
+            source = lambda metrics: stream_kimi_response(
+                client,
+                api_messages,
+                model,
+                temperature,
+                max_tokens,
+                metrics=metrics,
+                scheduler=scheduler,
+                coalescer=coalescer
+            )
+        else:
+            # One non-streaming request, so its latency can be compared with streaming
+            source = lambda metrics: iter([get_kimi_response(
+                client,
+                api_messages,
+                model,
+                temperature,
+                max_tokens,
+                metrics=metrics,
+                scheduler=scheduler,
+                coalescer=coalescer
+            )])
+        st.session_state.pending_turn = {
+            "generation": Generation(source),
+            "started": time.perf_counter(),
+            "stream": stream,
+            "model": model,
+            "max_tokens": max_tokens,
+            "context_stats": context_stats,
+            "context_time": context_time,
+            "cache_key": cache_key,
+            "route": route,
+        }
+        stream_pending_turn()
+        return
+    
+    finish_turn(response, turn_metrics, context_stats, context_time,
+                cache_key if cached is None else None, route)
+    if len(turn_models) == 1:
+        display_chat_message("assistant", response)
+
+@st.fragment
+def chat_region(run_started: float, run_action: ActionRuns, session_panel):
+    """The chat, rerun on its own for every message and every click inside it
+
+    A message is sent and answered within one partial run. The session
+    panel in the sidebar is redrawn from here afterwards, so its stats
+    follow each turn without a full rerun.
+    """
+    # On a full run the script timed itself from the top; a partial run times itself from here
+    partial = bool(get_script_run_ctx().fragment_ids_this_run)
+    if partial:
+        touch_session()
+        run_started = time.perf_counter()
+        run_action = begin_run()
+    try:
+        # A reply stopped in the last run goes into the chat as far as it got
+        turn = st.session_state.get('pending_turn')
+        if turn is not None and turn["generation"].cancelled:
+            stop_generation(turn)
+        
+        # Display current configuration
+        badges = st.empty()
+        with badges:
+            render_config_badges()
+        st.markdown("---")
+        
+        # Pinned to the bottom of the page; while a reply is generated its button stops it
+        with st.bottom:
+            user_input = st.chat_input(
+                "Type your message here..." if len(st.session_state.messages) > 0 else "Start your conversation...",
+                key="user_input",
+                submit_mode="stop",
+                on_submit=user_action,
+                args=("send message",)
+            )
+        
+        # Handle suggested prompts
+        starter_prompt = 'suggested_prompt' in st.session_state
+        if starter_prompt:
+            user_input = st.session_state.suggested_prompt
+            del st.session_state.suggested_prompt
+        if user_input:
+            st.session_state.last_comparison = []
+        
+        # Display chat messages or empty state
+        if len(st.session_state.messages) == 0 and not user_input:
+            
+            # Suggested prompts
+            for column, (label, prompt) in zip(st.columns(len(STARTER_PROMPTS)), STARTER_PROMPTS):
+                with column:
+                    st.button(label, use_container_width=True,
+                              on_click=user_action, args=("starter prompt", choose_starter_prompt, prompt))
+            
+            # Open the API connection, and prefetch the starter answers if enabled, while the user decides
+            client_registry = get_client_registry()
+            api_key = st.session_state.api_key
+            get_prefetcher().warm(
+                api_key,
+                lambda: client_registry.get(api_key),
+                st.session_state.model_name,
+                st.session_state.temperature,
+                st.session_state.max_tokens
+            )
+        elif len(st.session_state.messages) > 0:
+            # Display chat history as one batched element, older pages on demand
+            history, hidden_count = visible_history(
+                st.session_state.messages,
+                HISTORY_RECENT_MESSAGES,
+                HISTORY_PAGE_SIZE,
+                st.session_state.history_pages
+            )
+            dropped_older = st.session_state.history_oldest_seq - 1
+            stored_older = dropped_older if get_conversation_store() is not None else 0
+            if dropped_older and not stored_older:
+                st.caption(f"{dropped_older} older messages were cleared from memory")
+            if hidden_count or stored_older:
+                older_count = min(hidden_count or stored_older, HISTORY_PAGE_SIZE)
+                st.button(f"⬆️ Load {older_count} older messages", key="load_older_messages",
+                          on_click=user_action, args=("load older messages", load_older_messages))
+            with get_tracer().span("render history", messages=len(history)):
+                st.markdown(render_history_html(history), unsafe_allow_html=True)
+            
+            # Side-by-side answers from the last multi-model turn
+            if st.session_state.last_comparison:
+                columns = st.columns(len(st.session_state.last_comparison))
+                for column, result in zip(columns, st.session_state.last_comparison):
+                    with column:
+                        st.caption(f"**{result['model']}** · {result['latency']:.2f}s · "
+                                   f"{result['completion_tokens']} tokens")
+                        display_chat_message("assistant", result["content"])
+        
+        if user_input:
+            with get_tracer().turn(action=run_action.action):
+                run_turn(user_input, starter_prompt)
+            # Auto may have switched the model for this turn
+            with badges:
+                render_config_badges()
+        elif 'pending_turn' in st.session_state:
+            # A full rerun ended the run streaming this reply; carry on showing it
+            stream_pending_turn()
+    finally:
+        end_run(run_action, run_started, partial)
+    
+    with session_panel:
+        render_session_panel()
 
 # Sidebar configuration
 with st.sidebar:    
@@ -456,9 +1065,8 @@ with st.sidebar:
     if env_api_key and not st.session_state.get('api_key_input_override'):
         st.success("✓ API Key loaded from .env", icon="✅")
         st.caption(f"Key: {env_api_key[:8]}...{env_api_key[-4:]}")
-        if st.button("🔄 Use different key", key="override_env_key"):
-            st.session_state.api_key_input_override = True
-            st.rerun()
+        st.button("🔄 Use different key", key="override_env_key",
+                  on_click=user_action, args=("use different key", use_different_key))
     else:
         api_key_input = st.text_input(
             "API Key",
@@ -466,109 +1074,132 @@ with st.sidebar:
             placeholder="sk-xxxxxxxxxxxxxxxx",
             help="Get your API key from platform.moonshot.ai or set KIMI_API_KEY in .env",
             label_visibility="collapsed",
-            value=st.session_state.api_key if not env_api_key else ""
+            value=st.session_state.api_key if not env_api_key else "",
+            key="api_key_input",
+            on_change=user_action,
+            args=("enter API key", use_api_key)
         )
         
         if api_key_input:
-            st.session_state.api_key = api_key_input
             st.success("✓ API Key configured", icon="✅")
         elif not env_api_key:
             st.info("Enter your API key to start", icon="ℹ️")
     
     st.markdown("---")
     
-    # Model selection with descriptions
-    st.subheader("🤖 Model Selection")
-    model_descriptions = {
-        "kimi-k2-turbo-preview": "⚡ Fastest - Best for quick responses (kimi-k2-turbo-preview)",
-        "kimi-k2-0711-preview": "🎯 Latest - Enhanced capabilities (kimi-k2-0711-preview)",
-        "kimi-k2-0905-preview": "🧠 Advanced - Superior reasoning (kimi-k2-0905-preview)",
-        "moonshot-v1-8k": "📝 Standard - 8K context (moonshot-v1-8k)",
-        "moonshot-v1-32k": "📚 Extended - 32K context (moonshot-v1-32k)",
-        "moonshot-v1-128k": "📖 Maximum - 128K context (moonshot-v1-128k)"
-    }
-    
-    selected_model = st.selectbox(
-        "Choose Model",
-        options=list(model_descriptions.keys()),
-        format_func=lambda x: model_descriptions[x],
-        help="Select the AI model that best fits your needs",
-        label_visibility="collapsed"
-    )
-    st.session_state.model_name = selected_model
-    
-    st.markdown("---")
-    
-    # Advanced settings in expander
-    with st.expander("🎛️ Advanced Settings", expanded=False):
-        st.markdown("##### Temperature")
-        st.caption("Controls response creativity and randomness")
-        st.session_state.temperature = st.slider(
-            "Temperature",
-            min_value=0.0,
-            max_value=1.0,
-            value=0.6,
-            step=0.1,
-            help="Lower = More focused and deterministic\nHigher = More creative and varied",
+    # Settings are bound to session state by key and applied together, in one rerun, when submitted
+    with st.form("settings", border=False):
+        # Model selection with descriptions
+        st.subheader("🤖 Model Selection")
+        st.selectbox(
+            "Choose Model",
+            options=[AUTO_MODEL] + list(MODEL_DESCRIPTIONS.keys()),
+            format_func=lambda x: AUTO_DESCRIPTION if x == AUTO_MODEL else MODEL_DESCRIPTIONS[x],
+            key="model_choice",
+            help="Select the AI model that best fits your needs, or Auto to pick one for each message",
             label_visibility="collapsed"
         )
         
-        # Temperature indicator
-        if st.session_state.temperature <= 0.3:
-            st.info("🎯 Factual & Precise", icon="💡")
-        elif st.session_state.temperature <= 0.6:
-            st.info("⚖️ Balanced", icon="💡")
-        else:
-            st.info("🎨 Creative & Varied", icon="💡")
-        
-        st.markdown("##### Max Response Length")
-        st.caption("Maximum tokens in AI response")
-        st.session_state.max_tokens = st.slider(
-            "Max Tokens",
-            min_value=100,
-            max_value=4000,
-            value=2000,
-            step=100,
-            help="Longer responses require more tokens",
-            label_visibility="collapsed"
+        st.multiselect(
+            "Compare with",
+            options=list(MODEL_DESCRIPTIONS),
+            key="compare_models",
+            help="Also send each prompt to these models and show the answers side by side"
         )
         
-        st.caption(f"~{st.session_state.max_tokens * 0.75:.0f} words maximum")
+        # Advanced settings in expander
+        with st.expander("🎛️ Advanced Settings", expanded=False):
+            st.markdown("##### Temperature")
+            st.caption("Controls response creativity and randomness")
+            st.slider(
+                "Temperature",
+                min_value=0.0,
+                max_value=1.0,
+                step=0.1,
+                key="temperature",
+                help="Lower = More focused and deterministic\nHigher = More creative and varied",
+                label_visibility="collapsed"
+            )
+            
+            # Temperature indicator
+            if st.session_state.temperature <= 0.3:
+                st.info("🎯 Factual & Precise", icon="💡")
+            elif st.session_state.temperature <= 0.6:
+                st.info("⚖️ Balanced", icon="💡")
+            else:
+                st.info("🎨 Creative & Varied", icon="💡")
+            
+            st.markdown("##### Max Response Length")
+            st.caption("Maximum tokens in AI response")
+            st.slider(
+                "Max Tokens",
+                min_value=100,
+                max_value=4000,
+                step=100,
+                key="max_tokens",
+                help="Longer responses require more tokens",
+                label_visibility="collapsed"
+            )
+            
+            st.caption(f"~{st.session_state.max_tokens * 0.75:.0f} words maximum")
+            
+            st.markdown("##### Context Window")
+            st.caption("What to send when the chat outgrows the model's context")
+            st.selectbox(
+                "Context Policy",
+                options=list(CONTEXT_POLICIES.keys()),
+                format_func=lambda x: CONTEXT_POLICY_LABELS[x],
+                key="context_policy",
+                label_visibility="collapsed"
+            )
+            st.toggle(
+                "Summarize long chats",
+                key="background_summary",
+                help="Condense older turns into a rolling summary in the background, "
+                     "so long chats send fewer prompt tokens"
+            )
+            
+            st.markdown("##### Streaming")
+            st.toggle(
+                "Stream responses",
+                key="stream_responses",
+                help="Show the response token by token as it is generated. Off sends one "
+                     "non-streaming request and shows the reply when it is complete"
+            )
+        
+        st.form_submit_button("Apply settings", use_container_width=True,
+                              on_click=user_action, args=("apply settings", apply_settings))
     
     st.markdown("---")
     
-    # Session statistics
-    st.subheader("📊 Session Stats")
-    col1, col2 = st.columns(2)
-    with col1:
-        st.metric("Messages", len(st.session_state.messages))
-    with col2:
-        st.metric("Model", st.session_state.model_name.split('-')[1].upper())
+    # Documents are searched on each turn instead of being pasted into the chat
+    st.subheader("📎 Documents")
+    uploads = st.file_uploader(
+        "Attach documents",
+        type=DOCUMENT_TYPES,
+        accept_multiple_files=True,
+        key="document_uploads",
+        help="Only the parts relevant to each message are sent to Kimi AI",
+        label_visibility="collapsed",
+        on_change=user_action,
+        args=("attach documents",)
+    )
+    for error in attach_documents(uploads or []):
+        st.error(error, icon="⚠️")
+    for document in st.session_state.documents.values():
+        st.caption(f"📄 {document.name} · {document.chunks:,} parts, {document.tokens:,} tokens")
     
     st.markdown("---")
     
-    # Action buttons
-    if st.button("🗑️ Clear Chat", use_container_width=True, type="primary"):
-        st.session_state.messages = []
-        st.session_state.total_messages = 0
-        st.rerun()
+    # Filled in by the chat, which redraws it after every turn
+    session_panel = st.container()
 
 # Main chat interface
 
-# Display current configuration
-if st.session_state.api_key:
-    st.markdown(f"""
-        <div class="stats-container">
-            <div class="stat-badge"><strong>Model:</strong> {st.session_state.model_name}</div>
-            <div class="stat-badge"><strong>Temperature:</strong> {st.session_state.temperature}</div>
-            <div class="stat-badge"><strong>Max Tokens:</strong> {st.session_state.max_tokens}</div>
-        </div>
-    """, unsafe_allow_html=True)
-
-st.markdown("---")
-
 # Check if API key is provided
 if not st.session_state.api_key:
+    st.markdown("---")
+    
     # Empty state with better design
     st.markdown("""
         <div class="empty-state">
@@ -584,85 +1215,29 @@ if not st.session_state.api_key:
     with st.expander("🚀 Quick Start Guide"):
         st.markdown("""
         ### Get Started in 3 Steps:
-        
+
         1. **Create Account**
            - Visit [platform.moonshot.ai](https://platform.moonshot.ai)
            - Sign up for a free account
-        
+
         2. **Get API Key**
            - Navigate to API Keys section
            - Generate a new API key
            - Copy the key (starts with `sk-`)
-        
+
         3. **Add Credits**
            - Go to billing section
            - Add minimum $1 credit
            - Start chatting!
-        
+
         ### Need Help?
         - 📚 [Documentation](https://platform.moonshot.cn/docs)
         - 💬 [Community Forum](https://platform.moonshot.ai)
         - 📧 Support: support@moonshot.ai
         """)
-else:
-    # Initialize client
-    client = initialize_openai_client(st.session_state.api_key)
     
-    if client:
-        # Display chat messages or empty state
-        if len(st.session_state.messages) == 0:
-            
-            # Suggested prompts
-            col1, col2, col3 = st.columns(3)
-            
-            with col1:
-                if st.button("📝 Write an email", use_container_width=True):
-                    st.session_state.suggested_prompt = "Help me write a professional email"
-            
-            with col2:
-                if st.button("💻 Explain code", use_container_width=True):
-                    st.session_state.suggested_prompt = "Explain what async/await means in programming"
-            
-            with col3:
-                if st.button("🎨 Creative ideas", use_container_width=True):
-                    st.session_state.suggested_prompt = "Give me creative project ideas"
-        else:
-            # Display chat history
-            for message in st.session_state.messages:
-                display_chat_message(message["role"], message["content"])
-        
-        # Chat input
-        user_input = st.chat_input(
-            "Type your message here..." if len(st.session_state.messages) > 0 else "Start your conversation...",
-            key="user_input"
-        )
-        
-        # Handle suggested prompts
-        if 'suggested_prompt' in st.session_state:
-            user_input = st.session_state.suggested_prompt
-            del st.session_state.suggested_prompt
-        
-        if user_input:
-            # Add user message to history
-            st.session_state.messages.append({"role": "user", "content": user_input})
-            st.session_state.total_messages += 1
-            
-            # Get Kimi response with better loading state
-            with st.spinner("🤖 Kimi AI is thinking..."):
-                # Prepare messages for API
-                api_messages = st.session_state.messages.copy()
-                
-                response = get_kimi_response(
-                    client, 
-                    api_messages,
-                    st.session_state.model_name,
-                    st.session_state.temperature,
-                    st.session_state.max_tokens
-                )
-            
-            # Add assistant response to history
-            st.session_state.messages.append({"role": "assistant", "content": response})
-            st.session_state.total_messages += 1
-            
-            # Rerun to update the display
-            st.rerun()
\ No newline at end of file
+    end_run(run_action, run_started, partial=False)
+    with session_panel:
+        render_session_panel()
+else:
+    chat_region(run_started, run_action, session_panel)
@@ -7,7 +7,7 @@ setup(
     author="Your Name",
     packages=find_packages(),
     install_requires=[
-        "streamlit>=1.28.0",
+        "streamlit>=1.59.0",
         "openai>=1.0.0",
         "python-dotenv>=1.0.0",
     ],
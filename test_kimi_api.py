@@ -8,7 +8,7 @@ import os
 import sys
 from typing import List, Dict
 
-def test_kimi_api(api_key: str) -> bool:
+def test_kimi_api(api_key: str, base_url: str = "https://api.moonshot.cn/v1") -> bool:
     """Test Kimi AI API connectivity and basic functionality"""
     
     print("🧪 Testing Kimi AI API Integration...")
@@ -18,9 +18,9 @@ def test_kimi_api(api_key: str) -> bool:
         # Initialize OpenAI client with Kimi configuration
         client = openai.OpenAI(
             api_key=api_key,
-            base_url="https://api.moonshot.cn/v1"
+            base_url=base_url
         )
-        print("✅ OpenAI client initialized successfully")
+        print(f"✅ OpenAI client initialized successfully ({base_url})")
         
         # Test basic chat completion
         test_messages = [
@@ -94,8 +94,8 @@ def main():
         print("❌ API key is required!")
         sys.exit(1)
     
-    # Run tests
-    success = test_kimi_api(api_key)
+    # Run tests, against KIMI_BASE_URL if set (e.g. the local mock server)
+    success = test_kimi_api(api_key, os.getenv("KIMI_BASE_URL") or "https://api.moonshot.cn/v1")
     
     if success:
         print("\n✨ Your Kimi AI API is ready to use!")